@@ -23,6 +23,7 @@ import pisi.context as ctx
 import pisi.uri
 import pisi.util
 import pisi.pgraph as pgraph
+import pisi.solver
 import pisi.db.packagedb
 import pisi.db.repodb
 import pisi.db.filesdb
@@ -31,6 +32,7 @@ import pisi.db.historydb
 import pisi.db.sourcedb
 import pisi.db.componentdb
 import pisi.db.groupdb
+import pisi.db.transaction
 import pisi.index
 import pisi.config
 import pisi.metadata
@@ -42,6 +44,8 @@ import pisi.operations.upgrade
 import pisi.operations.install
 import pisi.operations.history
 import pisi.operations.helper
+import pisi.operations.fetch
+import pisi.operations.extract
 import pisi.operations.check
 import pisi.operations.emerge
 import pisi.operations.build
@@ -420,7 +424,7 @@ def fetch(packages=[], path=os.path.curdir):
         ctx.ui.info(_("%s package found in %s repository") % (package.name, repo))
         uri = pisi.uri.URI(package.packageURI)
         output = os.path.join(path, uri.path())
-        if os.path.exists(output) and package.packageHash == pisi.util.sha1_file(output):
+        if os.path.exists(output) and package.packageHash == pisi.util.file_digest(output):
             ctx.ui.warning(_("%s package already fetched") % uri.path())
             continue
         if uri.is_absolute_path():
@@ -437,8 +441,9 @@ def upgrade(packages=[], repo=None):
     @param packages: list of package names -> list_of_strings
     @param repo: name of the repository that only the packages from that repo going to be upgraded
     """
-    pisi.db.historydb.HistoryDB().create_history("upgrade")
-    return pisi.operations.upgrade.upgrade(packages, repo)
+    with pisi.db.transaction.Transaction():
+        pisi.db.historydb.HistoryDB().create_history("upgrade")
+        return pisi.operations.upgrade.upgrade(packages, repo)
 
 @locked
 def remove(packages, ignore_dependency=False, ignore_safety=False):
@@ -448,8 +453,9 @@ def remove(packages, ignore_dependency=False, ignore_safety=False):
     @param ignore_dependency: removes packages without looking into theirs reverse deps if True
     @param ignore_safety: system.base packages can also be removed if True
     """
-    pisi.db.historydb.HistoryDB().create_history("remove")
-    return pisi.operations.remove.remove(packages, ignore_dependency, ignore_safety)
+    with pisi.db.transaction.Transaction():
+        pisi.db.historydb.HistoryDB().create_history("remove")
+        return pisi.operations.remove.remove(packages, ignore_dependency, ignore_safety)
 
 @locked
 def install(packages, reinstall=False, ignore_file_conflicts=False, ignore_package_conflicts=False):
@@ -463,19 +469,20 @@ def install(packages, reinstall=False, ignore_file_conflicts=False, ignore_packa
     install packages.
     """
 
-    pisi.db.historydb.HistoryDB().create_history("install")
-
     if not ctx.get_option('ignore_file_conflicts'):
         ctx.set_option('ignore_file_conflicts', ignore_file_conflicts)
 
     if not ctx.get_option('ignore_package_conflicts'):
         ctx.set_option('ignore_package_conflicts', ignore_package_conflicts)
 
-    # Install pisi package files or pisi packages from a repository
-    if packages and packages[0].endswith(ctx.const.package_suffix):
-        return pisi.operations.install.install_pkg_files(packages, reinstall)
-    else:
-        return pisi.operations.install.install_pkg_names(packages, reinstall)
+    with pisi.db.transaction.Transaction():
+        pisi.db.historydb.HistoryDB().create_history("install")
+
+        # Install pisi package files or pisi packages from a repository
+        if packages and packages[0].endswith(ctx.const.package_suffix):
+            return pisi.operations.install.install_pkg_files(packages, reinstall)
+        else:
+            return pisi.operations.install.install_pkg_names(packages, reinstall)
 
 @locked
 def takeback(operation):
@@ -485,10 +492,11 @@ def takeback(operation):
     @param operation: number of the operation that the system will be taken back -> integer
     """
 
-    historydb = pisi.db.historydb.HistoryDB()
-    historydb.create_history("takeback")
+    with pisi.db.transaction.Transaction():
+        historydb = pisi.db.historydb.HistoryDB()
+        historydb.create_history("takeback")
 
-    pisi.operations.history.takeback(operation)
+        pisi.operations.history.takeback(operation)
 
 def get_takeback_plan(operation):
     """
@@ -521,8 +529,9 @@ def emerge(packages):
     Builds and installs the given packages from source
     @param packages: list of package names -> list_of_strings
     """
-    pisi.db.historydb.HistoryDB().create_history("emerge")
-    return pisi.operations.emerge.emerge(packages)
+    with pisi.db.transaction.Transaction():
+        pisi.db.historydb.HistoryDB().create_history("emerge")
+        return pisi.operations.emerge.emerge(packages)
 
 @locked
 def delete_cache():
@@ -627,6 +636,9 @@ def package_graph(A, packagedb, ignore_installed = False, reverse=False):
 
     ctx.ui.debug('A = %s' % str(A))
 
+    if isinstance(packagedb, pisi.db.packagedb.PackageDB):
+        return pisi.solver.Solver().package_graph(A, ignore_installed, reverse)
+
     # try to construct a pisi graph of packages to
     # install / reinstall
 
@@ -775,16 +787,24 @@ def info_name(package_name, useinstalldb=False):
 
 def index(dirs=None, output='pisi-index.xml',
           skip_sources=False, skip_signing=False,
-          compression=0):
-    """Accumulate PiSi XML files in a directory, and write an index."""
+          compression=0, incremental=False):
+    """Accumulate PiSi XML files in a directory, and write an index.
+    In incremental mode, the entries of the packages that have not
+    changed since the output index was written are reused."""
     index = pisi.index.Index()
     index.distribution = None
     if not dirs:
         dirs = ['.']
+
+    previous = None
+    if incremental and os.path.exists(output):
+        ctx.ui.info(_('Reading previous index %s') % output)
+        previous = pisi.index.read_previous_index(output)
+
     for repo_dir in dirs:
         repo_dir = str(repo_dir)
         ctx.ui.info(_('Building index of PiSi files under %s') % repo_dir)
-        index.index(repo_dir, skip_sources)
+        index.index(repo_dir, skip_sources, previous)
 
     sign = None if skip_signing else pisi.file.File.detached
     index.write(output, sha1sum=True, compress=compression, sign=sign)
@@ -868,17 +888,12 @@ def __update_repo(repo, force=False):
 
 # FIXME: rebuild_db is only here for filesdb and it really is ugly. we should not need any rebuild.
 @locked
-def rebuild_db(files=False):
-
-    filesdb = pisi.db.filesdb.FilesDB()
-    installdb = pisi.db.installdb.InstallDB()
-
-    def rebuild_filesdb():
-        for pkg in list_installed():
-            ctx.ui.info(_('Adding \'%s\' to db... ') % pkg, noln=True)
-            files = installdb.get_files(pkg)
-            filesdb.add_files(pkg, files)
-            ctx.ui.info(_('OK.'))
+def rebuild_db(files=False, incremental=False):
+    """
+    Rebuilds the files database from the installed packages.
+    @param incremental: only re-index the packages that were added, changed
+    or removed since the last rebuild -> boolean
+    """
 
     # save parameters and shutdown pisi
     options = ctx.config.options
@@ -886,9 +901,13 @@ def rebuild_db(files=False):
     comar = ctx.comar
     pisi._cleanup()
 
-    filesdb.close()
-    filesdb.destroy()
-    filesdb.init()
+    if not incremental:
+        # Remove the old database before the instance that rebuilds it
+        # is created, so that the index is not built twice
+        pisi.db.filesdb.FilesDB().destroy()
+        pisi.db.filesdb.FilesDB().invalidate()
+
+    filesdb = pisi.db.filesdb.FilesDB()
 
     # reinitialize everything
     set_userinterface(ui)
@@ -896,7 +915,7 @@ def rebuild_db(files=False):
     set_comar(comar)
 
     # construct new database
-    rebuild_filesdb()
+    filesdb.rebuild(incremental)
 
 ############# FIXME: this was a quick fix. ##############################
 
@@ -975,7 +994,8 @@ def clearCache(all=False):
                     pass
 
     def removeAll(cacheDir):
-        cached = glob.glob("%s/*.pisi" % cacheDir) + glob.glob("%s/*.part" % cacheDir)
+        cached = glob.glob("%s/*.pisi" % cacheDir) + glob.glob("%s/*.part" % cacheDir) + \
+                 glob.glob("%s/*%s" % (cacheDir, ctx.const.validator_suffix))
         for pkg in cached:
             try:
                 os.remove(pkg)
@@ -997,3 +1017,6 @@ def clearCache(all=False):
         removeOrderByLimit(cacheDir, order, cacheLimit)
     else:
         removeAll(cacheDir)
+
+    # Forget the hashes of the removed packages
+    pisi.util.digest_cache().prune()
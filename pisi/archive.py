@@ -14,11 +14,15 @@
 
 # standard library modules
 import os
+import sys
 import stat
+import zlib
 import errno
 import shutil
+import struct
 import tarfile
 import zipfile
+import collections
 
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
@@ -38,9 +42,16 @@ class ArchiveHandlerNotInstalled(Exception):
 
 
 # Proxy class inspired from tarfile._BZ2Proxy
+#
+# Install archives of big packages are hundreds of megabytes, so the
+# decompressed data is kept in the chunks returned by the decompressor
+# instead of being joined into a single buffer and sliced on every read.
+# A chunk is only copied when it is partly read, and skipped data is
+# dropped without copying. Reading is forward only, as tarfile reads
+# the members of an archive in order while extracting it.
 class _LZMAProxy(object):
 
-    blocksize = 16 * 1024
+    blocksize = 64 * 1024
 
     def __init__(self, fileobj, mode):
         self.fileobj = fileobj
@@ -56,34 +67,77 @@ class _LZMAProxy(object):
             # Seeking here can cause problems with Python 2.7
             # if hasattr(self.fileobj, "seek"):
             #     self.fileobj.seek(0)
-            self.buf = ""
+            self.chunks = collections.deque()
+            self.offset = 0
+            self.available = 0
+            self.eof = False
         else:
             self.lzmaobj = lzma.LZMACompressor()
 
-    def read(self, size):
-        b = [self.buf]
-        x = len(self.buf)
-        while x < size:
+    def __fill(self, size):
+        "decompress until size bytes are available or the stream ends"
+        while self.available < size and not self.eof:
             raw = self.fileobj.read(self.blocksize)
             if not raw:
+                self.eof = True
                 break
             try:
                 data = self.lzmaobj.decompress(raw)
             except EOFError:
+                self.eof = True
+                break
+            if data:
+                self.chunks.append(data)
+                self.available += len(data)
+
+    def __consume(self, size, parts=None):
+        "drop size bytes from the buffer, appending them to parts if given"
+        while size:
+            chunk = self.chunks[0]
+            end = self.offset + size
+            if end < len(chunk):
+                if parts is not None:
+                    parts.append(chunk[self.offset:end])
+                self.offset = end
                 break
-            b.append(data)
-            x += len(data)
-        self.buf = "".join(b)
 
-        buf = self.buf[:size]
-        self.buf = self.buf[size:]
-        self.pos += len(buf)
-        return buf
+            if parts is not None:
+                parts.append(chunk[self.offset:] if self.offset else chunk)
+            size -= len(chunk) - self.offset
+            self.chunks.popleft()
+            self.offset = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            self.__fill(sys.maxint)
+            size = self.available
+        else:
+            self.__fill(size)
+            size = min(size, self.available)
+
+        parts = []
+        self.__consume(size, parts)
+        self.available -= size
+        self.pos += size
+
+        if len(parts) == 1:
+            return parts[0]
+        return "".join(parts)
 
     def seek(self, pos):
         if pos < self.pos:
-            self.init()
-        self.read(pos - self.pos)
+            raise tarfile.StreamError("seeking backwards is not allowed")
+
+        # Skip decompressed data without copying it
+        while pos > self.pos:
+            if not self.available:
+                self.__fill(1)
+                if not self.available:
+                    break
+            size = min(pos - self.pos, self.available)
+            self.__consume(size)
+            self.available -= size
+            self.pos += size
 
     def tell(self):
         return self.pos
@@ -99,6 +153,48 @@ class _LZMAProxy(object):
             self.fileobj.write(raw)
 
 
+class _StoredMember(object):
+    """Reads an uncompressed member of a zip file straight from the file,
+    without the buffering of zipfile.ZipExtFile"""
+
+    def __init__(self, file_path, zinfo):
+        self.name = zinfo.filename
+        self.fileobj = open(file_path, "rb")
+        self.fileobj.seek(zinfo.header_offset)
+
+        header = self.fileobj.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader or \
+                header[0:4] != zipfile.stringFileHeader:
+            self.fileobj.close()
+            raise zipfile.BadZipfile("Bad magic number for file header")
+
+        header = struct.unpack(zipfile.structFileHeader, header)
+        self.fileobj.seek(header[zipfile._FH_FILENAME_LENGTH] +
+                          header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+
+        self.left = zinfo.file_size
+        self.crc = 0
+        self.expected_crc = zinfo.CRC
+
+    def read(self, size=-1):
+        if size < 0 or size > self.left:
+            size = self.left
+
+        data = self.fileobj.read(size)
+        if len(data) != size:
+            raise zipfile.BadZipfile("Truncated file %r" % self.name)
+
+        self.left -= size
+        self.crc = zlib.crc32(data, self.crc)
+        if not self.left and self.crc & 0xffffffff != self.expected_crc:
+            raise zipfile.BadZipfile("Bad CRC-32 for file %r" % self.name)
+
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+
 class TarFile(tarfile.TarFile):
 
     @classmethod
@@ -282,13 +378,10 @@ class ArchiveTar(ArchiveBase):
             self.tar = tarfile.open(self.file_path, rmode,
                                     fileobj=self.fileobj)
 
-        oldwd = None
-        try:
-            # Don't fail if CWD doesn't exist (#6748)
-            oldwd = os.getcwd()
-        except OSError:
-            pass
-        os.chdir(target_dir)
+        # Paths are joined to target_dir instead of changing the working
+        # directory, which is shared by the threads of the process.
+        def target_path(name):
+            return os.path.join(target_dir, name)
 
         uid = os.getuid()
         gid = os.getgid()
@@ -297,18 +390,21 @@ class ArchiveTar(ArchiveBase):
             if callback:
                 callback(tarinfo, extracted=False)
 
+            path = target_path(tarinfo.name)
+
             if tarinfo.issym() and \
-                    os.path.isdir(tarinfo.name) and \
-                    not os.path.islink(tarinfo.name):
+                    os.path.isdir(path) and \
+                    not os.path.islink(path):
                 # Changing a directory with a symlink. tarfile module
                 # cannot handle this case.
+                link_path = target_path(tarinfo.linkname)
 
-                if os.path.isdir(tarinfo.linkname):
+                if os.path.isdir(link_path):
                     # Symlink target is a directory. Move old directory's
                     # content to this directory.
-                    for filename in os.listdir(tarinfo.name):
-                        old_path = util.join_path(tarinfo.name, filename)
-                        new_path = util.join_path(tarinfo.linkname, filename)
+                    for filename in os.listdir(path):
+                        old_path = util.join_path(path, filename)
+                        new_path = util.join_path(link_path, filename)
 
                         if os.path.lexists(new_path):
                             if not os.path.isdir(new_path):
@@ -319,26 +415,25 @@ class ArchiveTar(ArchiveBase):
 
                         os.renames(old_path, new_path)
 
-                    if os.path.exists(tarinfo.name):
-                        os.rmdir(tarinfo.name)
+                    if os.path.exists(path):
+                        os.rmdir(path)
 
-                elif not os.path.lexists(tarinfo.linkname):
+                elif not os.path.lexists(link_path):
                     # Symlink target does not exist. Assume the old
                     # directory is moved to another place in package.
-                    os.renames(tarinfo.name, tarinfo.linkname)
+                    os.renames(path, link_path)
 
                 else:
                     # This should not happen. Probably a packaging error.
                     # Try to rename directory
                     try:
-                        os.rename(tarinfo.name,
-                                  "%s.renamed-by-pisi" % tarinfo.name)
+                        os.rename(path, "%s.renamed-by-pisi" % path)
                     except:
                         # If fails, try to remove it
-                        shutil.rmtree(tarinfo.name)
+                        shutil.rmtree(path)
 
             try:
-                self.tar.extract(tarinfo)
+                self.tar.extract(tarinfo, target_dir)
             except OSError, e:
                 # Handle the case where an upper directory cannot
                 # be created because of a conflict with an existing
@@ -356,22 +451,20 @@ class ArchiveTar(ArchiveBase):
                     upper_dirs.insert(0, head)
                     head, tail = os.path.split(head)
 
-                for path in upper_dirs:
-                    if not os.path.lexists(path):
+                for upper_dir in map(target_path, upper_dirs):
+                    if not os.path.lexists(upper_dir):
                         break
 
-                    if not os.path.isdir(path):
+                    if not os.path.isdir(upper_dir):
                         # A file with the same name exists.
                         # Remove the existing file.
-                        os.remove(path)
+                        os.remove(upper_dir)
                         break
-                else:
-                    # No conflicts detected! This is probably not the case
-                    # mentioned here. Raise the same exception.
-                    raise
 
-                # Try to extract again.
-                self.tar.extract(tarinfo)
+                # Try to extract again. If no conflicts are detected, the
+                # directories may have been created by a package extracted
+                # at the same time. Otherwise the same exception is raised.
+                self.tar.extract(tarinfo, target_dir)
 
             # tarfile.extract does not honor umask. It must be honored
             # explicitly. See --no-same-permissions option of tar(1),
@@ -379,24 +472,18 @@ class ArchiveTar(ArchiveBase):
             #
             # Note: This is no good while installing a pisi package.
             # Thats why this is optional.
-            if self.no_same_permissions and not os.path.islink(tarinfo.name):
-                os.chmod(tarinfo.name, tarinfo.mode & ~ctx.const.umask)
+            if self.no_same_permissions and not os.path.islink(path):
+                os.chmod(path, tarinfo.mode & ~ctx.const.umask)
 
             if self.no_same_owner:
-                if not os.path.islink(tarinfo.name):
-                    os.chown(tarinfo.name, uid, gid)
+                if not os.path.islink(path):
+                    os.chown(path, uid, gid)
                 else:
-                    os.lchown(tarinfo.name, uid, gid)
+                    os.lchown(path, uid, gid)
 
             if callback:
                 callback(tarinfo, extracted=True)
 
-        try:
-            if oldwd:
-                os.chdir(oldwd)
-        # Bug #6748
-        except OSError:
-            pass
         self.close()
 
     def add_to_archive(self, file_name, arc_name=None):
@@ -531,6 +618,11 @@ class ArchiveZip(ArchiveBase):
         self.zip_obj = zipfile.ZipFile(self.file_path, mode)
 
     def open(self, file_path, mode="r"):
+        zinfo = self.zip_obj.getinfo(file_path)
+        # Compressed archives are stored uncompressed in the package
+        if zinfo.compress_type == zipfile.ZIP_STORED and \
+                not zinfo.flag_bits & 0x1 and mode == "r":
+            return _StoredMember(self.file_path, zinfo)
         return self.zip_obj.open(file_path, mode)
 
     def close(self):
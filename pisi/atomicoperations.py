@@ -61,63 +61,72 @@ class Install(AtomicOperation):
     "Install class, provides install routines for pisi packages"
 
     @staticmethod
-    def from_name(name, ignore_dep = None):
+    def locate(name):
+        """Return the path or URI of the package file to be installed for
+        the given package name and its expected sha1sum. Delta package is
+        preferred if there is one for the installed release."""
         packagedb = pisi.db.packagedb.PackageDB()
-        # download package and return an installer object
         # find package in repository
         repo = packagedb.which_repo(name)
-        if repo:
-            repodb = pisi.db.repodb.RepoDB()
-            ctx.ui.info(_("Package %s found in repository %s") % (name, repo))
-
-            repo = repodb.get_repo(repo)
-            pkg = packagedb.get_package(name)
-            delta = None
-
-            installdb = pisi.db.installdb.InstallDB()
-            # Package is installed. This is an upgrade. Check delta.
-            if installdb.has_package(pkg.name):
-                (version, release, build, distro, distro_release) = installdb.get_version_and_distro_release(pkg.name)
-                # pisi distro upgrade should not use delta support
-                if distro == pkg.distribution and distro_release == pkg.distributionRelease:
-                    delta = pkg.get_delta(release)
-
-            ignore_delta = ctx.config.values.general.ignore_delta
-
-            # If delta exists than use the delta uri.
-            if delta and not ignore_delta:
-                pkg_uri = delta.packageURI
-                pkg_hash = delta.packageHash
-            else:
-                pkg_uri = pkg.packageURI
-                pkg_hash = pkg.packageHash
+        if not repo:
+            raise Error(_("Package %s not found in any active repository.") % name)
 
-            uri = pisi.uri.URI(pkg_uri)
-            if uri.is_absolute_path():
-                pkg_path = str(pkg_uri)
-            else:
-                pkg_path = os.path.join(os.path.dirname(repo.indexuri.get_uri()),
-                                        str(uri.path()))
+        repodb = pisi.db.repodb.RepoDB()
+        ctx.ui.info(_("Package %s found in repository %s") % (name, repo))
 
-            ctx.ui.info(_("Package URI: %s") % pkg_path, verbose=True)
+        repo = repodb.get_repo(repo)
+        pkg = packagedb.get_package(name)
+        delta = None
 
-            # Bug 4113
-            cached_file = pisi.package.Package.is_cached(pkg_path)
-            if cached_file and util.sha1_file(cached_file) != pkg_hash:
-                os.unlink(cached_file)
-                cached_file = None
+        installdb = pisi.db.installdb.InstallDB()
+        # Package is installed. This is an upgrade. Check delta.
+        if installdb.has_package(pkg.name):
+            (version, release, build, distro, distro_release) = installdb.get_version_and_distro_release(pkg.name)
+            # pisi distro upgrade should not use delta support
+            if distro == pkg.distribution and distro_release == pkg.distributionRelease:
+                delta = pkg.get_delta(release)
 
-            install_op = Install(pkg_path, ignore_dep)
+        ignore_delta = ctx.config.values.general.ignore_delta
 
-            # Bug 4113
-            if not cached_file:
-                downloaded_file = install_op.package.filepath
-                if pisi.util.sha1_file(downloaded_file) != pkg_hash:
-                    raise pisi.Error(_("Download Error: Package does not match the repository package."))
+        # If delta exists than use the delta uri.
+        if delta and not ignore_delta:
+            pkg_uri = delta.packageURI
+            pkg_hash = delta.packageHash
+        else:
+            pkg_uri = pkg.packageURI
+            pkg_hash = pkg.packageHash
 
-            return install_op
+        uri = pisi.uri.URI(pkg_uri)
+        if uri.is_absolute_path():
+            pkg_path = str(pkg_uri)
         else:
-            raise Error(_("Package %s not found in any active repository.") % name)
+            pkg_path = os.path.join(os.path.dirname(repo.indexuri.get_uri()),
+                                    str(uri.path()))
+
+        ctx.ui.info(_("Package URI: %s") % pkg_path, verbose=True)
+
+        return pkg_path, pkg_hash
+
+    @staticmethod
+    def from_name(name, ignore_dep = None):
+        # download package and return an installer object
+        pkg_path, pkg_hash = Install.locate(name)
+
+        # Bug 4113
+        cached_file = pisi.package.Package.is_cached(pkg_path)
+        if cached_file and util.file_digest(cached_file) != pkg_hash:
+            os.unlink(cached_file)
+            cached_file = None
+
+        install_op = Install(pkg_path, ignore_dep)
+
+        # Bug 4113
+        if not cached_file:
+            downloaded_file = install_op.package.filepath
+            if pisi.util.file_digest(downloaded_file) != pkg_hash:
+                raise pisi.Error(_("Download Error: Package does not match the repository package."))
+
+        return install_op
 
     def __init__(self, package_fname, ignore_dep = None, ignore_file_conflicts = None):
         "initialize from a file name"
@@ -137,11 +146,34 @@ class Install(AtomicOperation):
         self.filesdb = pisi.db.filesdb.FilesDB()
         self.installdb = pisi.db.installdb.InstallDB()
         self.operation = INSTALL
+        self.diff = None
 
     def install(self, ask_reinstall = True):
+        self.prepare(ask_reinstall)
+
+        ctx.disable_keyboard_interrupts()
+
+        self.extract_install()
+        self.store_pisi_files()
+        self.configure()
+
+        ctx.enable_keyboard_interrupts()
+
+        self.notify_installed()
+
+    # The phases of install. Only unpack and store_pisi_files may run
+    # concurrently for independent packages, see operations.extract.
+
+    def prepare(self, ask_reinstall = True):
+        "check the package and the operation before changing anything"
 
         # Any package should remove the package it replaces before
         self.check_replaces()
+        self.check(ask_reinstall)
+        self.run_old_remove_scripts()
+
+    def check(self, ask_reinstall = True):
+        "check the package and the operation without changing the system"
 
         ctx.ui.status(_('Installing %s, version %s, release %s') %
                 (self.pkginfo.name, self.pkginfo.version,
@@ -154,15 +186,19 @@ class Install(AtomicOperation):
         self.check_relations()
         self.check_operation()
 
-        ctx.disable_keyboard_interrupts()
+    def run_old_remove_scripts(self):
+        "run the remove scripts of the installed version of the package"
+        if self.reinstall():
+            self.remove_old = Remove(self.pkginfo.name)
+            self.remove_old.run_preremove()
+            self.remove_old.run_postremove()
 
-        self.extract_install()
-        self.store_pisi_files()
+    def configure(self):
+        "run COMAR scripts and register the package"
         self.postinstall()
         self.update_databases()
 
-        ctx.enable_keyboard_interrupts()
-
+    def notify_installed(self):
         ctx.ui.close()
         if self.operation == UPGRADE:
             event = pisi.ui.upgraded
@@ -202,7 +238,12 @@ class Install(AtomicOperation):
         # we passed check_conflicts tests in operations.py than this means a non-conflicting
         # pkg is in "order" to be installed that has no file conflict problem with this package. 
         # PS: we need this because "order" generating code does not consider conflicts.
+        replaced = [x.package for x in self.pkginfo.replaces]
         def really_conflicts(pkg):
+            # Replaced packages are removed before the package is extracted
+            if pkg in replaced:
+                return False
+
             if not self.pkginfo.conflicts:
                 return True
 
@@ -274,13 +315,16 @@ class Install(AtomicOperation):
             self.old_files = self.installdb.get_files(pkg.name)
             self.old_pkginfo = self.installdb.get_info(pkg.name)
             self.old_path = self.installdb.pkg_dir(pkg.name, iversion_s, irelease_s)
-            self.remove_old = Remove(pkg.name)
-            self.remove_old.run_preremove()
-            self.remove_old.run_postremove()
 
     def reinstall(self):
         return not self.operation == INSTALL
 
+    def files_diff(self):
+        "differences between the files of the installed and the new package"
+        if self.diff is None:
+            self.diff = pisi.operations.delta.FilesDiff(self.old_files, self.files)
+        return self.diff
+
     def postinstall(self):
         self.config_later = False
         if ctx.comar:
@@ -313,10 +357,16 @@ class Install(AtomicOperation):
 
     def extract_install(self):
         "unzip package in place"
+        self.prepare_extract()
+        self.unpack()
+        self.finish_extract()
+
+    def prepare_extract(self):
+        "keep changed config files and relocate the files of a delta package"
 
         ctx.ui.notify(pisi.ui.extracting, package = self.pkginfo, files = self.files)
 
-        config_changed = []
+        config_changed = self.config_changed = []
         def check_config_changed(config):
             fpath = pisi.util.join_path(ctx.config.dest_dir(), config.path)
             if pisi.util.config_changed(config):
@@ -326,38 +376,13 @@ class Install(AtomicOperation):
                     os.unlink(fpath + '.old')
                 os.rename(fpath, fpath + '.old')
 
-        # old config files are kept as they are. New config files from the installed
-        # packages are saved with ".newconfig" string appended to their names.
-        def rename_configs():
-            for path in config_changed:
-                newconfig = path + '.newconfig'
-                oldconfig = path + '.old'
-                if os.path.exists(newconfig):
-                    os.unlink(newconfig)
-
-                # In the case of delta packages: the old package and the new package
-                # may contain same config typed files with same hashes, so the delta
-                # package will not have that config file. In order to protect user
-                # changed config files, they are renamed with ".old" prefix in case
-                # of the hashes of these files on the filesystem and the new config 
-                # file that is coming from the new package. But in delta package case
-                # with the given scenario there wont be any, so we can pass this one.
-                # If the config files were not be the same between these packages the
-                # delta package would have it and extract it and the path would point
-                # to that new config file. If they are same and the user had changed 
-                # that file and using the changed config file, there is no problem 
-                # here.
-                if os.path.exists(path):
-                    os.rename(path, newconfig)
-
-                os.rename(oldconfig, path)
-
         # Package file's path may not be relocated or content may not be changed but
         # permission may be changed
         def update_permissions():
-            permissions = pisi.operations.delta.find_permission_changes(self.old_files, self.files)
-            for path, mode in permissions:
-                os.chmod(path, mode)
+            for new_file in self.files_diff().permission_changes:
+                path = os.path.join(ctx.config.dest_dir(), new_file.path)
+                if os.path.exists(path):
+                    os.chmod(path, int(new_file.mode, 8))
 
         # Delta package does not contain the files that have the same hash as in 
         # the old package's. Because it means the file has not changed. But some 
@@ -366,7 +391,7 @@ class Install(AtomicOperation):
         def relocate_files():
             missing_old_files = set()
 
-            for old_file, new_file in pisi.operations.delta.find_relocations(self.old_files, self.files):
+            for old_file, new_file in self.files_diff().relocations:
                 old_path = os.path.join(ctx.config.dest_dir(), old_file.path)
                 new_path = os.path.join(ctx.config.dest_dir(), new_file.path)
 
@@ -401,20 +426,71 @@ class Install(AtomicOperation):
                 for f in sorted(missing_old_files):
                     ctx.ui.warning("    - %s" % f)
 
+        if self.reinstall():
+            # get 'config' typed file objects
+            new = filter(lambda x: x.type == 'config', self.files.list)
+            old = filter(lambda x: x.type == 'config', self.old_files.list)
+
+            # get config path lists
+            newconfig = set(str(x.path) for x in new)
+            oldconfig = set(str(x.path) for x in old)
+
+            config_overlaps = newconfig & oldconfig
+            if config_overlaps:
+                files = filter(lambda x: x.path in config_overlaps, old)
+                for f in files:
+                    check_config_changed(f)
+        else:
+            for f in self.files.list:
+                if f.type == 'config':
+                    # there may be left over config files
+                    check_config_changed(f)
+
+        if self.package_fname.endswith(ctx.const.delta_package_suffix):
+            relocate_files()
+            update_permissions()
+
+    def unpack(self):
+        self.package.extract_install(ctx.config.dest_dir())
+
+    def finish_extract(self):
+        "rename changed config files and remove the files left from the old package"
+
+        # old config files are kept as they are. New config files from the installed
+        # packages are saved with ".newconfig" string appended to their names.
+        def rename_configs():
+            for path in self.config_changed:
+                newconfig = path + '.newconfig'
+                oldconfig = path + '.old'
+                if os.path.exists(newconfig):
+                    os.unlink(newconfig)
+
+                # In the case of delta packages: the old package and the new package
+                # may contain same config typed files with same hashes, so the delta
+                # package will not have that config file. In order to protect user
+                # changed config files, they are renamed with ".old" prefix in case
+                # of the hashes of these files on the filesystem and the new config 
+                # file that is coming from the new package. But in delta package case
+                # with the given scenario there wont be any, so we can pass this one.
+                # If the config files were not be the same between these packages the
+                # delta package would have it and extract it and the path would point
+                # to that new config file. If they are same and the user had changed 
+                # that file and using the changed config file, there is no problem 
+                # here.
+                if os.path.exists(path):
+                    os.rename(path, newconfig)
+
+                os.rename(oldconfig, path)
+
         # remove left over files from the old package.
         def clean_leftovers():
             stat_cache = {}
 
             files_by_name = {}
-            new_paths = []
             for f in self.files.list:
                 files_by_name.setdefault(os.path.basename(f.path), []).append(f)
-                new_paths.append(f.path)
-
-            for old_file in self.old_files.list:
-                if old_file.path in new_paths:
-                    continue
 
+            for old_file in self.files_diff().removed:
                 old_file_path = os.path.join(ctx.config.dest_dir(), old_file.path)
 
                 try:
@@ -448,33 +524,7 @@ class Install(AtomicOperation):
                 else:
                     Remove.remove_file(old_file, self.pkginfo.name)
 
-        if self.reinstall():
-            # get 'config' typed file objects
-            new = filter(lambda x: x.type == 'config', self.files.list)
-            old = filter(lambda x: x.type == 'config', self.old_files.list)
-
-            # get config path lists
-            newconfig = set(str(x.path) for x in new)
-            oldconfig = set(str(x.path) for x in old)
-
-            config_overlaps = newconfig & oldconfig
-            if config_overlaps:
-                files = filter(lambda x: x.path in config_overlaps, old)
-                for f in files:
-                    check_config_changed(f)
-        else:
-            for f in self.files.list:
-                if f.type == 'config':
-                    # there may be left over config files
-                    check_config_changed(f)
-
-        if self.package_fname.endswith(ctx.const.delta_package_suffix):
-            relocate_files()
-            update_permissions()
-
-        self.package.extract_install(ctx.config.dest_dir())
-
-        if config_changed:
+        if self.config_changed:
             rename_configs()
 
         if self.reinstall():
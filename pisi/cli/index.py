@@ -73,6 +73,12 @@ class Index(command.Command):
                          default=False,
                          help=_("Do not sign index."))
 
+        group.add_option("-i", "--incremental",
+                         action="store_true",
+                         default=False,
+                         help=_("Reuse the entries of the existing output "
+                                "index for unchanged packages."))
+
         self.parser.add_option_group(group)
 
     def run(self):
@@ -90,4 +96,5 @@ class Index(command.Command):
         index(self.args or ["."], ctx.get_option('output'),
               skip_sources=ctx.get_option('skip_sources'),
               skip_signing=ctx.get_option('skip_signing'),
-              compression=compression)
+              compression=compression,
+              incremental=ctx.get_option('incremental'))
@@ -10,6 +10,7 @@
 # Please read the COPYING file.
 #
 
+import copy
 import optparse
 
 import gettext
@@ -89,7 +90,9 @@ all repositories.
             if ctx.config.get_option('uninstalled') and p in installed_list:
                 continue
 
-            package = self.packagedb.get_package(p, repo)
+            # The package is shared with the database, copy it before
+            # decorating its name
+            package = copy.copy(self.packagedb.get_package(p, repo))
 
             if p in installed_list:
                 package.name = util.colorize(package.name, 'green')
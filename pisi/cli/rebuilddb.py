@@ -43,10 +43,13 @@ dirs under /var/lib/pisi
 
         group.add_option("-f", "--files", action="store_true",
                                default=False, help=_("Rebuild files database"))
+        group.add_option("-i", "--incremental", action="store_true",
+                               default=False, help=_("Only re-index packages changed since the last rebuild"))
 
         self.parser.add_option_group(group)
 
     def run(self):
         self.init(database=True)
         if ctx.ui.confirm(_('Rebuild PiSi databases?')):
-            pisi.api.rebuild_db(ctx.get_option('files'))
+            pisi.api.rebuild_db(ctx.get_option('files'),
+                                ctx.get_option('incremental'))
@@ -21,6 +21,12 @@
 #destinationdirectory = /
 #autoclean = False
 #bandwidth_limit = 0
+#fetch_workers = 4
+#fetch_connections_per_host = 2
+#fetch_timeout = 30
+#pipelined_install = False
+#package_metadata_cache_limit = 16
+#install_workers = 1
 #
 #[build]
 #host = i686-pc-linux-gnu
@@ -86,6 +92,12 @@ class GeneralDefaults:
     package_cache = False
     package_cache_limit = 0
     bandwidth_limit = 0
+    fetch_workers = 4
+    fetch_connections_per_host = 2
+    fetch_timeout = 30
+    pipelined_install = False
+    package_metadata_cache_limit = 16
+    install_workers = 1
     ignore_safety = False
     ignore_delta = False
 
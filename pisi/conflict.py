@@ -17,6 +17,7 @@ __trans = gettext.translation('pisi', fallback=True)
 _ = __trans.ugettext
 
 import pisi.relation
+import pisi.db
 
 """ Conflict relation """
 class Conflict(pisi.relation.Relation):
@@ -36,6 +37,15 @@ class Conflict(pisi.relation.Relation):
             s += _(" release ") + self.release
         return s
 
+def from_tuple(value):
+    """Returns the Conflict of a (package, constraints) table tuple"""
+    package, constraints = value
+    conflict = Conflict()
+    conflict.package = package
+    for attr, attr_value in constraints:
+        setattr(conflict, attr, attr_value)
+    return conflict
+
 def installed_package_conflicts(confinfo):
     """determine if an installed package in *repository* conflicts with
 given conflicting spec"""
@@ -49,40 +59,39 @@ def package_conflicts(pkg, confs):
     return None
 
 def calculate_conflicts(order, packagedb):
+    """Returns the installed packages conflicting with the packages of
+    order, the packages of order conflicting with each other and the
+    conflicts of each package with the installed packages"""
 
-    # check conflicting packages in the installed system
-    def check_installed(pkg, order):
-        conflicts = []
-
-        for conflict in pkg.conflicts:
-            if conflict.package not in order and installed_package_conflicts(conflict):
-                conflicts.append(conflict)
-
-        return conflicts
+    # Only the packages named in the conflicts index of the package
+    # database can be in conflict, the ones that are installed or in the
+    # order are found by set intersections and checked against the
+    # installed and the repository versions.
+    index = packagedb.get_conflicts_index()
+    installed = pisi.db.installdb.InstallDB().get_installed_versions()
 
     B_0 = set(order)
-    conflicting_pkgs = conflicts_inorder = set()
+    conflicting_pkgs = set()
+    conflicts_inorder = set()
     conflicting_pairs = {}
 
-    for x in order:
-        pkg = packagedb.get_package(x)
-
-        # check if any package has conflicts with the installed packages
-        conflicts = check_installed(pkg, order)
-        if conflicts:
-            conflicting_pairs[x] = map(lambda c:str(c), conflicts)
-            conflicting_pkgs = conflicting_pkgs.union(map(lambda c:c.package, conflicts))
-
-        # now check if any package has conflicts with each other
-        B_i = B_0.intersection(set(map(lambda c:c.package, pkg.conflicts)))
-        conflicts_inorder_i = set()
-        for p in map(lambda x:packagedb.get_package(x), B_i):
-            conflicted = package_conflicts(p, pkg.conflicts)
-            if conflicted:
-                conflicts_inorder_i.add(str(conflicted))
-
-        if conflicts_inorder_i:
-            conflicts_inorder = conflicts_inorder.union(conflicts_inorder_i)
-            conflicts_inorder.add(pkg.name)
+    # check if any package has conflicts with the installed packages
+    for name in sorted(set(index).intersection(installed).difference(B_0)):
+        version, release = installed[name]
+        for pkg, constraints in index[name]:
+            if pkg in B_0 and pisi.relation.satisfies_constraints(constraints, version, release):
+                conflicting_pairs.setdefault(pkg, []).append(str(from_tuple((name, constraints))))
+                conflicting_pkgs.add(name)
+
+    # now check if any package has conflicts with each other
+    for name in B_0.intersection(index):
+        entry = packagedb.get_entry(name)
+        found = set()
+        for pkg, constraints in index[name]:
+            if pkg in B_0 and pkg not in found and \
+                    pisi.relation.satisfies_constraints(constraints, entry.version, entry.release):
+                found.add(pkg)
+                conflicts_inorder.add(str(from_tuple((name, constraints))))
+                conflicts_inorder.add(pkg)
 
     return (conflicting_pkgs, conflicts_inorder, conflicting_pairs)
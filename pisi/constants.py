@@ -57,6 +57,8 @@ class Constants:
         self.__c.xz_suffix = ".xz"
 
         self.__c.partial_suffix = ".part"
+        # suffix for the validators of partially downloaded files
+        self.__c.validator_suffix = ".validator"
         self.__c.temporary_suffix = ".tmp"
 
         # suffix for auto generated debug packages
@@ -96,6 +98,9 @@ class Constants:
         self.__c.needs_restart = "needsrestart"
         self.__c.needs_reboot = "needsreboot"
         self.__c.files_db = "files.db"
+        self.__c.files_index = "files.index"
+        self.__c.transaction_journal = "transaction.journal"
+        self.__c.digest_cache = "digest.cache"
         self.__c.repos = "repos"
 
         #file/directory permissions
@@ -11,10 +11,13 @@
 #
 
 def invalidate_caches():
-    # Invalidates pisi caches in use and forces to re-fill caches from disk when needed
-    for db in [packagedb.PackageDB(), sourcedb.SourceDB(), componentdb.ComponentDB(),
-               installdb.InstallDB(), historydb.HistoryDB(), groupdb.GroupDB(), repodb.RepoDB()]:
-        db.invalidate()
+    # Invalidates pisi caches that are out of date with the data on disk and
+    # forces to re-fill them from disk when needed. RepoDB goes first as the
+    # others check their repositories with it.
+    for db in [repodb.RepoDB(), packagedb.PackageDB(), sourcedb.SourceDB(), componentdb.ComponentDB(),
+               installdb.InstallDB(), historydb.HistoryDB(), groupdb.GroupDB()]:
+        if db.is_stale():
+            db.invalidate()
 
 def flush_caches():
     # Invalidate and flush caches to re-generate them when needed
@@ -31,7 +34,11 @@ def update_caches():
             db.cache_save()
 
 def regenerate_caches():
-    flush_caches()
+    # Invalidate caches and regenerate them. Caches are not flushed, the
+    # databases reuse the parts of them that are still up to date.
+    for db in [packagedb.PackageDB(), sourcedb.SourceDB(),
+               componentdb.ComponentDB(), groupdb.GroupDB()]:
+        db.invalidate()
     # Force cache regeneration
     for db in [packagedb.PackageDB(), sourcedb.SourceDB(),
                componentdb.ComponentDB(), groupdb.GroupDB()]:
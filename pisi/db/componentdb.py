@@ -10,7 +10,6 @@
 # Please read the COPYING file.
 #
 
-import re
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
 _ = __trans.ugettext
@@ -19,6 +18,7 @@ import pisi
 import pisi.db.repodb
 import pisi.db.itembyrepo
 import pisi.component
+import pisi.db.searchindex as searchindex
 import pisi.db.lazydb as lazydb
 
 class ComponentDB(lazydb.LazyDB):
@@ -26,22 +26,27 @@ class ComponentDB(lazydb.LazyDB):
     def __init__(self):
         lazydb.LazyDB.__init__(self, cacheable=True)
 
+    def cache_stamp(self):
+        return pisi.db.repodb.RepoDB().get_repo_stamps()
+
     def init(self):
         component_nodes = {}
         component_packages = {}
         component_sources = {}
+        component_search = {}
 
         repodb = pisi.db.repodb.RepoDB()
 
         for repo in repodb.list_repos():
             doc = repodb.get_repo_doc(repo)
-            component_nodes[repo] = self.__generate_components(doc)
+            component_nodes[repo], component_search[repo] = self.__generate_components(doc)
             component_packages[repo] = self.__generate_packages(doc)
             component_sources[repo] = self.__generate_sources(doc)
 
         self.cdb = pisi.db.itembyrepo.ItemByRepo(component_nodes)
         self.cpdb = pisi.db.itembyrepo.ItemByRepo(component_packages)
         self.csdb = pisi.db.itembyrepo.ItemByRepo(component_sources)
+        self.sidb = pisi.db.itembyrepo.ItemByRepo(component_search)
 
     def __generate_packages(self, doc):
         components = {}
@@ -57,7 +62,15 @@ class ComponentDB(lazydb.LazyDB):
         return components
  
     def __generate_components(self, doc):
-        return dict(map(lambda x: (x.getTagData("Name"), x.toString()), doc.tags("Component")))
+        components = {}
+        search_index = searchindex.SearchIndex()
+        for component in doc.tags("Component"):
+            name = component.getTagData("Name")
+            components[name] = component.toString()
+            search_index.add_texts(name, "localname", component, "LocalName")
+            search_index.add_texts(name, "summary", component, "Summary")
+            search_index.add_texts(name, "desc", component, "Description")
+        return components, search_index.table
 
     def has_component(self, name, repo = None):
         return self.cdb.has_item(name, repo)
@@ -66,19 +79,10 @@ class ComponentDB(lazydb.LazyDB):
         return self.cdb.get_item_keys(repo)
 
     def search_component(self, terms, lang=None, repo=None):
-        rename = '<LocalName xml:lang="(%s|en)">.*?%s.*?</LocalName>'
-        resum = '<Summary xml:lang="(%s|en)">.*?%s.*?</Summary>'
-        redesc = '<Description xml:lang="(%s|en)">.*?%s.*?</Description>'
-
         if not lang:
             lang = pisi.pxml.autoxml.LocalText.get_lang()
-        found = []
-        for name, xml in self.cdb.get_items_iter(repo):
-            if name not in found and terms == filter(lambda term: re.compile(rename % (lang, term), re.I).search(xml) or \
-                                                         re.compile(resum % (lang, term), re.I).search(xml) or \
-                                                         re.compile(redesc % (lang, term), re.I).search(xml), terms):
-                found.append(name)
-        return found
+        fields = {'localname': True, 'summary': True, 'desc': True}
+        return searchindex.search(self.sidb.get_repo_tables(repo), terms, lang, fields)
 
     # Returns the component in given repo or first found component in repo order if repo is None
     def get_component(self, component_name, repo = None):
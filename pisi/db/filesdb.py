@@ -11,78 +11,420 @@
 #
 
 import os
-import re
-import shelve
-import hashlib
+import mmap
+import multiprocessing
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.ugettext
 
 import pisi
 import pisi.context as ctx
+import pisi.util as util
+import pisi.files
 import pisi.db.lazydb as lazydb
 
-# FIXME:
-# We could traverse through files.xml files of the packages to find the path and
-# the package - a linear search - as some well known package managers do. But the current 
-# file conflict mechanism of pisi prevents this and needs a fast has_file function. 
-# So currently filesdb is the only db and we cant still get rid of rebuild-db :/
+# The files index is a text file of "path\0package\n" records sorted by
+# path, mapped into memory. Paths that are not in lower case have a lower
+# case copy in a third field, "path\0package\0lower case path\n", so that
+# case insensitive substring searches scan the mapping for the lower case
+# term without copying it. Exact and prefix lookups are binary searches on
+# the mapping; none of them needs to read the files.xml of installed
+# packages.
+#
+# Changes made by add_files and remove_files are appended to a journal
+# and kept in memory until close() merges them into the index.
+#
+# The manifest records the state of each installed package directory
+# when the index was last built, so that a rebuild only needs to read
+# the files.xml of the packages changed since then.
+INDEX_FORMAT = "pisi-files-index-2\n"
+INDEX_FORMAT_PREFIX = "pisi-files-index-"
+
+def _encode(path):
+    if isinstance(path, unicode):
+        return path.encode("utf-8")
+    return path
+
+def _index_record(path, pkg):
+    lower = path.lower()
+    if lower == path:
+        return "%s\0%s\n" % (path, pkg)
+    return "%s\0%s\0%s\n" % (path, pkg, lower)
+
+def _package_state(package_dir):
+    """Returns the manifest fields of an installed package directory"""
+    files_xml = os.path.join(package_dir, ctx.const.files_xml)
+    metadata_xml = os.path.join(package_dir, ctx.const.metadata_xml)
+    return (os.path.basename(package_dir),
+            repr(os.stat(package_dir).st_mtime),
+            repr(os.stat(files_xml).st_mtime),
+            util.sha1_file(metadata_xml))
+
+def _read_package_files(params):
+    try:
+        pkg, files_xml = params
+
+        ctx.ui.info("%-80.80s\r" % (_('Adding \'%s\' to db... ') % pkg), noln = True)
+
+        files = pisi.files.Files()
+        files.read(files_xml)
+        return pkg, [_encode(f.path) for f in files.list]
+
+    except KeyboardInterrupt:
+        # Worker processes can't propagate KeyboardInterrupt, see
+        # pisi.index.add_package
+        raise Exception
 
 class FilesDB(lazydb.LazyDB):
 
     def init(self):
-        self.filesdb = {}
-        self.__check_filesdb()
+        self.loaded = False
+        self.index = None
+        self.journal = None
+        self.added = {}
+        self.removed = set()
+        self.__check_index()
 
     def has_file(self, path):
-        return self.filesdb.has_key(hashlib.md5(path).digest())
+        return self.__lookup(_encode(path)) is not None
 
     def get_file(self, path):
-        return self.filesdb[hashlib.md5(path).digest()], path
+        path = _encode(path)
+        pkg = self.__lookup(path)
+        if pkg is None:
+            raise KeyError(path)
+        return pkg, path
 
     def search_file(self, term):
         if self.has_file(term):
             pkg, path = self.get_file(term)
             return [(pkg,[path])]
 
-        installdb = pisi.db.installdb.InstallDB()
-        found = []
-        for pkg in installdb.list_installed():
-            files_xml = open(os.path.join(installdb.package_path(pkg), ctx.const.files_xml)).read()
-            paths = re.compile('<Path>(.*?%s.*?)</Path>' % re.escape(term), re.I).findall(files_xml)
-            if paths:
-                found.append((pkg, paths))
+        term = _encode(term).lower()
+        found = {}
+        for path, pkg in self.__index_search(term):
+            if path not in self.added and path not in self.removed:
+                found.setdefault(pkg, []).append(path)
+
+        for path, pkg in self.added.iteritems():
+            if term in path.lower():
+                found.setdefault(pkg, []).append(path)
+
+        return [(pkg, sorted(paths)) for pkg, paths in sorted(found.items())]
+
+    def search_prefix(self, prefix):
+        """Returns the sorted list of (path, package) tuples of the files
+        whose path starts with prefix"""
+        prefix = _encode(prefix)
+        found = [(path, pkg) for path, pkg in self.__index_prefix(prefix)
+                    if path not in self.added and path not in self.removed]
+        found.extend((path, pkg) for path, pkg in self.added.iteritems()
+                        if path.startswith(prefix))
+        found.sort()
         return found
 
     def add_files(self, pkg, files):
 
-        self.__check_filesdb()
+        self.__check_index()
 
+        records = []
         for f in files.list:
-            self.filesdb[hashlib.md5(f.path).digest()] = pkg
+            path = _encode(f.path)
+            self.removed.discard(path)
+            self.added[path] = pkg
+            records.append("+%s\0%s\n" % (path, pkg))
+
+        self.__write_journal(records)
 
     def remove_files(self, files):
+
+        self.__check_index()
+
+        records = []
         for f in files:
-            if self.filesdb.has_key(hashlib.md5(f.path).digest()):
-                del self.filesdb[hashlib.md5(f.path).digest()]
+            path = _encode(f.path)
+            if self.__lookup(path) is not None:
+                self.added.pop(path, None)
+                self.removed.add(path)
+                records.append("-%s\n" % path)
+
+        self.__write_journal(records)
+
+    def rebuild(self, incremental=False):
+        """Builds the files index from the files.xml of installed
+        packages. In incremental mode only the packages added, changed
+        or removed since the last build are read again."""
+        if self.is_initialized():
+            self.close()
+        self.__build_index(incremental)
 
     def destroy(self):
-        files_db = os.path.join(ctx.config.info_dir(), ctx.const.files_db)
-        if os.path.exists(files_db):
-            os.unlink(files_db)
+        for db in (self.__index_file(), self.__journal_file(), self.__manifest_file(),
+                   os.path.join(ctx.config.info_dir(), ctx.const.files_db)):
+            if os.path.exists(db):
+                os.unlink(db)
 
     def close(self):
-        if isinstance(self.filesdb, shelve.DbfilenameShelf):
-            self.filesdb.close()
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+        if (self.added or self.removed) and os.access(ctx.config.info_dir(), os.W_OK):
+            self.__compact()
+
+        if self.index:
+            self.index.close()
+            self.index = None
+
+        self.added = {}
+        self.removed = set()
+        self.loaded = False
+
+    def __index_file(self):
+        return os.path.join(ctx.config.info_dir(), ctx.const.files_index)
+
+    def __journal_file(self):
+        return "%s.journal" % self.__index_file()
+
+    def __manifest_file(self):
+        return "%s.manifest" % self.__index_file()
+
+    def __check_index(self):
+        if self.loaded:
+            return
+
+        index_file = self.__index_file()
+        use_index = True
+        if not os.path.exists(index_file) or self.__is_old_index(index_file):
+            self.added.update(self.__build_index())
+            # An index that could not be written is kept in memory
+            use_index = os.access(ctx.config.info_dir(), os.W_OK)
+
+        if use_index and os.path.exists(index_file):
+            with open(index_file, "rb") as f:
+                self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.index[:len(INDEX_FORMAT)] != INDEX_FORMAT:
+                self.index.close()
+                self.index = None
+                raise pisi.Error(_("Files index %s is corrupted. Run 'pisi rebuild-db'.") % index_file)
 
-    def __check_filesdb(self):
-        if isinstance(self.filesdb, shelve.DbfilenameShelf):
+        self.__read_journal()
+        self.loaded = True
+
+    def __build_index(self, incremental=False):
+        """Writes the index of installed files. Returns the records
+        instead if the index can not be written."""
+        manifest = {}
+        records = {}
+        # A left over journal means the index is not up to date
+        if incremental and not os.path.exists(self.__journal_file()):
+            records = self.__read_index_records()
+            if records is not None:
+                manifest = self.__read_manifest()
+            else:
+                records = {}
+
+        installdb = pisi.db.installdb.InstallDB()
+        state = {}
+        changed = []
+        for pkg in installdb.list_installed():
+            package_dir = installdb.package_path(pkg)
+            state[pkg] = _package_state(package_dir)
+            if manifest.get(pkg) != state[pkg]:
+                changed.append((pkg, os.path.join(package_dir, ctx.const.files_xml)))
+
+        # Keep the records of installed packages that are up to date
+        stale = set(pkg for pkg, files_xml in changed)
+        records = dict((path, pkg) for path, pkg in records.iteritems()
+                            if pkg in state and pkg not in stale)
+
+        ctx.ui.debug(_("Reading files of %d packages, %d packages are up to date.")
+                        % (len(changed), len(state) - len(changed)))
+
+        # Before calling pool.map check if list is empty or not: python#12157
+        if changed:
+            pool = multiprocessing.Pool()
+            try:
+                package_files = pool.map(_read_package_files, changed)
+            except:
+                pool.terminate()
+                pool.join()
+                ctx.ui.info("")
+                raise
+            pool.close()
+            pool.join()
+            ctx.ui.info("")
+
+            for pkg, paths in package_files:
+                for path in paths:
+                    records[path] = pkg
+
+        if not os.access(ctx.config.info_dir(), os.W_OK):
+            # Can't write the index, keep it in memory for this session.
+            return records
+
+        self.__write_index("".join(_index_record(path, pkg) for path, pkg in sorted(records.iteritems())))
+        if os.path.exists(self.__journal_file()):
+            os.unlink(self.__journal_file())
+
+        manifest_file = self.__manifest_file()
+        with open("%s.tmp" % manifest_file, "wb") as f:
+            for pkg, fields in sorted(state.iteritems()):
+                f.write("%s\n" % "\t".join((pkg,) + fields))
+        os.rename("%s.tmp" % manifest_file, manifest_file)
+
+        return {}
+
+    def __read_index_records(self):
+        """Returns the records of the index on disk as a dictionary,
+        or None if there is no usable index"""
+        try:
+            data = open(self.__index_file(), "rb").read()
+        except IOError:
+            return None
+        if not data.startswith(INDEX_FORMAT):
+            return None
+        return dict(line.split("\0")[:2] for line in data[len(INDEX_FORMAT):].splitlines())
+
+    def __is_old_index(self, index_file):
+        """Returns True if the index was written in an older format"""
+        with open(index_file, "rb") as f:
+            header = f.readline()
+        return header != INDEX_FORMAT and header.startswith(INDEX_FORMAT_PREFIX)
+
+    def __read_manifest(self):
+        manifest = {}
+        try:
+            for line in open(self.__manifest_file(), "rb"):
+                fields = tuple(line.rstrip("\n").split("\t"))
+                manifest[fields[0]] = fields[1:]
+        except IOError:
+            pass
+        return manifest
+
+    def __write_index(self, *chunks):
+        index_file = self.__index_file()
+        tmp_file = "%s.tmp" % index_file
+        with open(tmp_file, "wb") as f:
+            f.write(INDEX_FORMAT)
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_file, index_file)
+
+    def __read_journal(self):
+        journal_file = self.__journal_file()
+        if not os.path.exists(journal_file):
+            return
+
+        for line in open(journal_file, "rb"):
+            # An interrupted write may leave a partial record behind
+            if not line.endswith("\n"):
+                break
+            if line.startswith("+"):
+                path, pkg = line[1:-1].split("\0", 1)
+                self.removed.discard(path)
+                self.added[path] = pkg
+            elif line.startswith("-"):
+                path = line[1:-1]
+                self.added.pop(path, None)
+                self.removed.add(path)
+
+    def __write_journal(self, records):
+        if not records:
             return
+        if not self.journal:
+            self.journal = open(self.__journal_file(), "ab")
+        self.journal.write("".join(records))
+        self.journal.flush()
+
+    def __compact(self):
+        # Changed paths are merged into the index in one pass, the
+        # untouched records in between are copied as they are.
+        chunks = []
+        offset = len(INDEX_FORMAT)
+        end = len(self.index) if self.index else offset
+        for path in sorted(set(self.added).union(self.removed)):
+            if self.index:
+                position = self.__bisect(path)
+                chunks.append(self.index[offset:position])
+                offset = position
+                if offset < end:
+                    indexed, pkg, following = self.__record(offset)
+                    if indexed == path:
+                        offset = following
+            if path in self.added:
+                chunks.append(_index_record(path, self.added[path]))
+        if self.index:
+            chunks.append(self.index[offset:])
+
+        self.__write_index(*chunks)
+        if os.path.exists(self.__journal_file()):
+            os.unlink(self.__journal_file())
+
+    def __lookup(self, path):
+        self.__check_index()
 
-        files_db = os.path.join(ctx.config.info_dir(), ctx.const.files_db)
+        if path in self.added:
+            return self.added[path]
+        if path in self.removed or not self.index:
+            return None
 
-        if not os.path.exists(files_db):
-            flag = "n"
-        elif os.access(files_db, os.W_OK):
-            flag = "w"
-        else:
-            flag = "r"
+        offset = self.__bisect(path)
+        if offset < len(self.index):
+            indexed, pkg, following = self.__record(offset)
+            if indexed == path:
+                return pkg
+        return None
+
+    def __record(self, offset):
+        end = self.index.find("\n", offset)
+        fields = self.index[offset:end].split("\0")
+        return fields[0], fields[1], end + 1
+
+    def __bisect(self, key):
+        """Returns the offset of the first record whose path is not less than key"""
+        low, high = len(INDEX_FORMAT), len(self.index)
+        while low < high:
+            start = self.index.rfind("\n", 0, (low + high) // 2) + 1
+            end = self.index.find("\n", start)
+            if self.index[start:self.index.find("\0", start, end)] < key:
+                low = end + 1
+            else:
+                high = start
+        return low
+
+    def __index_prefix(self, prefix):
+        self.__check_index()
+        if not self.index:
+            return
+
+        offset = self.__bisect(prefix)
+        while offset < len(self.index):
+            path, pkg, offset = self.__record(offset)
+            if not path.startswith(prefix):
+                break
+            yield path, pkg
+
+    def __index_search(self, term):
+        """Yields the records whose path contains the lower case term,
+        ignoring case"""
+        self.__check_index()
+        if not self.index:
+            return
 
-        self.filesdb = shelve.open(files_db, flag)
+        offset = len(INDEX_FORMAT)
+        while True:
+            found = self.index.find(term, offset)
+            if found == -1:
+                break
+            start = self.index.rfind("\n", 0, found) + 1
+            end = self.index.find("\n", found)
+            fields = self.index[start:end].split("\0")
+            # The term may be found in the package name, or in the path
+            # of a record that has a lower case copy of it
+            if term in fields[-1 if len(fields) == 3 else 0]:
+                yield fields[0], fields[1]
+            offset = end + 1
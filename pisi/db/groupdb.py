@@ -28,6 +28,9 @@ class GroupDB(lazydb.LazyDB):
     def __init__(self):
         lazydb.LazyDB.__init__(self, cacheable=True)
 
+    def cache_stamp(self):
+        return pisi.db.repodb.RepoDB().get_repo_stamps()
+
     def init(self):
         group_nodes = {}
         group_components = {}
@@ -14,11 +14,14 @@ import os
 
 import pisi.context as ctx
 import pisi.db.lazydb as lazydb
+import pisi.db.transaction
 import pisi.history
 
 class HistoryDB(lazydb.LazyDB):
 
     def init(self):
+        # Write the history left in the journal by an interrupted operation
+        pisi.db.transaction.recover()
         self.__logs = self.__generate_history()
         self.history = pisi.history.History()
 
@@ -33,7 +36,11 @@ class HistoryDB(lazydb.LazyDB):
 
     def add_and_update(self, pkgBefore=None, pkgAfter=None, operation=None, otype=None):
         self.add_package(pkgBefore, pkgAfter, operation, otype)
-        self.update_history()
+        transaction = pisi.db.transaction.active()
+        if transaction:
+            transaction.add_history(self.history, self.history.operation.packages[-1])
+        else:
+            self.update_history()
 
     def add_package(self, pkgBefore=None, pkgAfter=None, operation=None, otype=None):
         self.history.add(pkgBefore, pkgAfter, operation, otype)
@@ -15,6 +15,8 @@
 
 import os
 import re
+import time
+import collections
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
 _ = __trans.ugettext
@@ -25,13 +27,52 @@ import piksemel
 import pisi
 import pisi.context as ctx
 import pisi.dependency
+import pisi.version
 import pisi.files
 import pisi.util
 import pisi.db.lazydb as lazydb
+import pisi.db.transaction
 
 class InstallDBError(pisi.Error):
     pass
 
+# The fields of metadata.xml that queries on installed packages need,
+# read once when the package is added to the database, with the parsed
+# versions to compare
+PackageInfo = collections.namedtuple("PackageInfo",
+        ("version", "release", "build", "distribution", "distribution_release",
+         "isa", "build_host", "summary", "description", "install_time",
+         "version_key", "distribution_release_key"))
+
+def _local_texts(node, tag):
+    texts = {}
+    for text in node.tags(tag):
+        data = text.firstChild()
+        texts[text.getAttribute("xml:lang")] = data and data.data() or ""
+    return texts
+
+def _package_info(pkg, files_xml):
+    update = pkg.getTag("History").getTag("Update")
+    try:
+        install_time = os.stat(files_xml).st_ctime
+    except OSError:
+        install_time = None
+
+    version = update.getTagData("Version")
+    distribution_release = pkg.getTagData("DistributionRelease")
+    return PackageInfo(version,
+                       update.getAttribute("release"),
+                       pkg.getTagData("Build"),
+                       pkg.getTagData("Distribution"),
+                       distribution_release,
+                       tuple(isa.firstChild().data() for isa in pkg.tags("IsA")),
+                       pkg.getTagData("BuildHost"),
+                       _local_texts(pkg, "Summary"),
+                       _local_texts(pkg, "Description"),
+                       install_time,
+                       pisi.version.version_key(version),
+                       pisi.version.version_key(distribution_release))
+
 class InstallInfo:
 
     state_map = { 'i': _('installed'), 'ip':_('installed-pending') }
@@ -44,7 +85,6 @@ class InstallInfo:
         self.time = time
 
     def one_liner(self):
-        import time
         time_str = time.strftime("%d %b %Y %H:%M", self.time)
         s = '%2s|%15s|%6s|%8s|%12s' % (self.state, self.version, self.release,
                                        self.distribution, time_str)
@@ -53,7 +93,6 @@ class InstallInfo:
     def __str__(self):
         s = _("State: %s\nVersion: %s, Release: %s\n") % \
             (InstallInfo.state_map[self.state], self.version, self.release)
-        import time
         time_str = time.strftime("%d %b %Y %H:%M", self.time)
         s += _('Distribution: %s, Install Time: %s\n') % (self.distribution,
                                                           time_str)
@@ -61,11 +100,15 @@ class InstallInfo:
 
 class InstallDB(lazydb.LazyDB):
 
+    # Versions of the installed packages, built when first needed
+    transient_attrs = ("installed_versions",)
+
     def __init__(self):
         lazydb.LazyDB.__init__(self, cacheable=True, cachedir=ctx.config.packages_dir())
 
     def init(self):
         self.installed_db = self.__generate_installed_pkgs()
+        self.metadata_db = {}
         self.rev_deps_db = self.__generate_revdeps()
 
     def __generate_installed_pkgs(self):
@@ -76,13 +119,18 @@ class InstallDB(lazydb.LazyDB):
         return dict(map(split_name, os.listdir(ctx.config.packages_dir())))
 
     def __get_marked_packages(self, _type):
+        transaction = pisi.db.transaction.active()
+        if transaction and transaction.has_marked_packages(_type):
+            return transaction.marked_packages(_type)
+
         info_path = os.path.join(ctx.config.info_dir(), _type)
         if os.path.exists(info_path):
             return open(info_path, "r").read().split()
         return []
 
     def __add_to_revdeps(self, package, revdeps):
-        metadata_xml = os.path.join(self.package_path(package), ctx.const.metadata_xml)
+        package_dir = self.package_path(package)
+        metadata_xml = os.path.join(package_dir, ctx.const.metadata_xml)
         try:
             meta_doc = piksemel.parse(metadata_xml)
             pkg = meta_doc.getTag("Package")
@@ -96,15 +144,20 @@ class InstallDB(lazydb.LazyDB):
             del self.installed_db[package]
             return
 
+        # The metadata is parsed here anyway, keep what queries need
+        files_xml = os.path.join(package_dir, ctx.const.files_xml)
+        self.metadata_db[package] = _package_info(pkg, files_xml)
+
         deps = pkg.getTag('RuntimeDependencies')
         if deps:
             for dep in deps.tags("Dependency"):
                 revdep = revdeps.setdefault(dep.firstChild().data(), {})
-                revdep[package] = dep.toString()
+                revdep[package] = pisi.dependency.dependency_tuple(dep)
             for anydep in deps.tags("AnyDependency"):
+                anydep_tuple = pisi.dependency.dependency_tuple(anydep)
                 for dep in anydep.tags("Dependency"):
                     revdep = revdeps.setdefault(dep.firstChild().data(), {})
-                    revdep[package] = anydep.toString()
+                    revdep[package] = anydep_tuple
 
     def __generate_revdeps(self):
         revdeps = {}
@@ -119,13 +172,11 @@ class InstallDB(lazydb.LazyDB):
         return self.installed_db.has_key(package)
 
     def list_installed_with_build_host(self, build_host):
-        build_host_re = re.compile("<BuildHost>(.*?)</BuildHost>")
         found = []
         for name in self.list_installed():
-            xml = open(os.path.join(self.package_path(name), ctx.const.metadata_xml)).read()
-            matched = build_host_re.search(xml)
-            if matched:
-                if build_host != matched.groups()[0]:
+            host = self.get_package_info(name).build_host
+            if host:
+                if build_host != host:
                     continue
             elif build_host:
                 continue
@@ -134,29 +185,32 @@ class InstallDB(lazydb.LazyDB):
 
         return found
 
-    def __get_version(self, meta_doc):
-        history = meta_doc.getTag("Package").getTag("History")
-        version = history.getTag("Update").getTagData("Version")
-        release = history.getTag("Update").getAttribute("release")
-
-        # TODO Remove None
-        return version, release, None
-
-    def __get_distro_release(self, meta_doc):
-        distro = meta_doc.getTag("Package").getTagData("Distribution")
-        release = meta_doc.getTag("Package").getTagData("DistributionRelease")
-
-        return distro, release
+    def get_package_info(self, package):
+        """Returns the PackageInfo of an installed package"""
+        info = self.metadata_db.get(package)
+        if info is None:
+            raise Exception(_('Package %s is not installed') % package)
+        return info
 
     def get_version_and_distro_release(self, package):
-        metadata_xml = os.path.join(self.package_path(package), ctx.const.metadata_xml)
-        meta_doc = piksemel.parse(metadata_xml)
-        return self.__get_version(meta_doc) + self.__get_distro_release(meta_doc)
+        info = self.get_package_info(package)
+        # TODO Remove None
+        return info.version, info.release, None, info.distribution, info.distribution_release
 
     def get_version(self, package):
-        metadata_xml = os.path.join(self.package_path(package), ctx.const.metadata_xml)
-        meta_doc = piksemel.parse(metadata_xml)
-        return self.__get_version(meta_doc)
+        info = self.get_package_info(package)
+        # TODO Remove None
+        return info.version, info.release, None
+
+    def get_installed_versions(self):
+        """Returns a dictionary of the (version, release) pairs of the
+        installed packages"""
+        versions = self.__dict__.get("installed_versions")
+        if versions is None:
+            versions = dict((name, tuple(version.rsplit("-", 1)))
+                                for name, version in self.installed_db.iteritems())
+            self.__dict__["installed_versions"] = versions
+        return versions
 
     def get_files(self, package):
         files = pisi.files.Files()
@@ -178,39 +232,44 @@ class InstallDB(lazydb.LazyDB):
         This method will return only package that contents terms in the package
         name or summary
         """
-        resum = '<Summary xml:lang=.(%s|en).>.*?%s.*?</Summary>'
-        redesc = '<Description xml:lang=.(%s|en).>.*?%s.*?</Description>'
         if not fields:
             fields = {'name': True, 'summary': True, 'desc': True}
         if not lang:
             lang = pisi.pxml.autoxml.LocalText.get_lang()
+
+        def local_texts(texts):
+            return [texts[l] for l in (lang, 'en') if texts.has_key(l)]
+
+        terms_re = [re.compile(term, re.I) for term in terms]
         found = []
         for name in self.list_installed():
-            xml = open(os.path.join(self.package_path(name), ctx.const.metadata_xml)).read()
-            if terms == filter(lambda term: (fields['name'] and \
-                    re.compile(term, re.I).search(name)) or \
-                    (fields['summary'] and \
-                    re.compile(resum % (lang, term), re.I).search(xml)) or \
-                    (fields['desc'] and \
-                    re.compile(redesc % (lang, term), re.I).search(xml)), terms):
+            info = self.get_package_info(name)
+            texts = []
+            if fields['name']:
+                texts.append(name)
+            if fields['summary']:
+                texts.extend(local_texts(info.summary))
+            if fields['desc']:
+                texts.extend(local_texts(info.description))
+            if all(filter(term_re.search, texts) for term_re in terms_re):
                 found.append(name)
         return found
 
     def get_isa_packages(self, isa):
-        risa = '<IsA>%s</IsA>' % isa
+        risa = re.compile('%s$' % isa)
         packages = []
         for name in self.list_installed():
-            xml = open(os.path.join(self.package_path(name), ctx.const.metadata_xml)).read()
-            if re.compile(risa).search(xml):
+            if filter(risa.match, self.get_package_info(name).isa):
                 packages.append(name)
         return packages
 
     def get_info(self, package):
-        files_xml = os.path.join(self.package_path(package), ctx.const.files_xml)
-        ctime = pisi.util.creation_time(files_xml)
-        pkg = self.get_package(package)
+        pkg = self.get_package_info(package)
+        ctime = pkg.install_time
+        if ctime is not None:
+            ctime = time.localtime(ctime)
         state = "i"
-        if pkg.name in self.list_pending():
+        if package in self.list_pending():
             state = "ip"
 
         info = InstallInfo(state,
@@ -220,34 +279,12 @@ class InstallDB(lazydb.LazyDB):
                            ctime)
         return info
 
-    def __make_dependency(self, depStr):
-        node = piksemel.parseString(depStr)
-        dependency = pisi.dependency.Dependency()
-        dependency.package = node.firstChild().data()
-        if node.attributes():
-            attr = node.attributes()[0]
-            dependency.__dict__[attr] = node.getAttribute(attr)
-        return dependency
-
-    def __create_dependency(self, depStr):
-        if "<AnyDependency>" in depStr:
-            anydependency = pisi.specfile.AnyDependency()
-            for dep in re.compile('(<Dependency .*?>.*?</Dependency>)').findall(depStr):
-                anydependency.dependencies.append(self.__make_dependency(dep))
-            return anydependency
-        else:
-            return self.__make_dependency(depStr)
-
     def get_rev_deps(self, name):
-        rev_deps = []
-
         package_revdeps = self.rev_deps_db.get(name)
-        if package_revdeps:
-            for pkg, dep in package_revdeps.items():
-                dependency = self.__create_dependency(dep)
-                rev_deps.append((pkg, dependency))
+        if not package_revdeps:
+            return []
 
-        return rev_deps
+        return [(pkg, pisi.dependency.from_tuple(dep)) for pkg, dep in package_revdeps.iteritems()]
 
     def pkg_dir(self, pkg, version, release):
         return pisi.util.join_path(ctx.config.packages_dir(), pkg + '-' + version + '-' + release)
@@ -280,17 +317,23 @@ class InstallDB(lazydb.LazyDB):
                 del revdep_info[pkginfo.name]
 
         self.installed_db[pkginfo.name] = "%s-%s" % (pkginfo.version, pkginfo.release)
+        self.metadata_db.pop(pkginfo.name, None)
+        self.__dict__.pop("installed_versions", None)
         self.__add_to_revdeps(pkginfo.name, self.rev_deps_db)
+        self.mark_dirty("installed_db", "metadata_db", "rev_deps_db")
 
     def remove_package(self, package_name):
         if self.installed_db.has_key(package_name):
             del self.installed_db[package_name]
+        self.metadata_db.pop(package_name, None)
+        self.__dict__.pop("installed_versions", None)
 
         # Cleanup revdep info
         for revdep_info in self.rev_deps_db.values():
             if package_name in revdep_info:
                 del revdep_info[package_name]
 
+        self.mark_dirty("installed_db", "metadata_db", "rev_deps_db")
         self.clear_pending(package_name)
 
     def list_pending(self):
@@ -303,11 +346,11 @@ class InstallDB(lazydb.LazyDB):
         return self.__get_marked_packages(ctx.const.needs_reboot)
 
     def __write_marked_packages(self, _type, packages):
-        info_file = os.path.join(ctx.config.info_dir(), _type)
-        config = open(info_file, "w")
-        for pkg in set(packages):
-            config.write("%s\n" % pkg)
-        config.close()
+        transaction = pisi.db.transaction.active()
+        if transaction:
+            transaction.mark_packages(_type, packages)
+        else:
+            pisi.db.transaction.write_marked_packages(_type, packages)
 
     def __clear_marked_packages(self, _type, package):
         if package == "*":
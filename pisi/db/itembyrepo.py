@@ -75,6 +75,16 @@ class ItemByRepo:
 
         return list(set(items))
 
+    def get_repo_tables(self, repo=None):
+        tables = []
+        for r in self.item_repos(repo):
+            if not self.has_repo(r):
+                raise Exception(_('Repository %s does not exist.') % repo)
+
+            tables.append(self.dbobj[r])
+
+        return tables
+
     def get_items_iter(self, repo=None):
         for r in self.item_repos(repo):
             if not self.has_repo(r):
@@ -11,8 +11,12 @@
 #
 
 import os
+import mmap
+import struct
 import cPickle
+import shutil
 import time
+import zlib
 import pisi.context as ctx
 import pisi.util as util
 
@@ -20,6 +24,258 @@ import string
 # lower borks for international locales. What we want is ascii lower.
 lower_map = string.maketrans(string.ascii_uppercase, string.ascii_lowercase)
 
+# A cache file is a sequence of segments followed by a pickled directory
+# of the database attributes and the offset and length of the directory.
+#
+# Each attribute is a segment of its own and is only read when it is
+# first accessed. The tables of ItemByRepo attributes are stored per
+# repository, with an index of their items, so that looking up an item
+# only reads the pages of the index and of that item.
+#
+# When a database changes, the new segments of its changed attributes
+# and a new directory are appended to a copy of the file, which then
+# replaces it. The directory refers to the unchanged segments where they
+# are. The file is written again from scratch when it grows to twice its
+# compacted size.
+#
+# The trailer holds the checksum of the directory and ends with a magic
+# of its own, so that a file cut short is not read as a cache.
+CACHE_MAGIC = "PISICACHE\n"
+CACHE_END_MAGIC = "PISIEND\n"
+CACHE_TRAILER = struct.Struct("!QQl8s")
+
+class CachedTable(object):
+    """Read only mapping of a table in a cache file. Items are read from
+    the file when they are accessed."""
+
+    def __init__(self, data, offset, length, raw):
+        self.__data = data
+        self.__segment = (offset, length)
+        self.__raw = raw
+        self.__items = None
+
+    def is_raw(self):
+        return self.__raw
+
+    def __index(self):
+        if self.__items is None:
+            offset, length = self.__segment
+            self.__items = cPickle.loads(self.__data[offset:offset + length])
+        return self.__items
+
+    def __load(self, segment):
+        data = self.__data[segment[0]:segment[0] + segment[1]]
+        if self.__raw:
+            return data
+        return cPickle.loads(data)
+
+    def __getitem__(self, key):
+        return self.__load(self.__index()[key])
+
+    def get(self, key, default=None):
+        segment = self.__index().get(key)
+        if segment is None:
+            return default
+        return self.__load(segment)
+
+    def has_key(self, key):
+        return self.__index().has_key(key)
+
+    __contains__ = has_key
+
+    def __len__(self):
+        return len(self.__index())
+
+    def __iter__(self):
+        return iter(self.__index())
+
+    def keys(self):
+        return self.__index().keys()
+
+    def iteritems(self):
+        for key, segment in self.__index().iteritems():
+            yield key, self.__load(segment)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return [value for key, value in self.iteritems()]
+
+class CacheFile(object):
+    """Memory mapped cache file of a database"""
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, "rb")
+        try:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        if self.data[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+            raise cPickle.UnpicklingError("%s is not a cache file" % path)
+
+        if len(self.data) < len(CACHE_MAGIC) + CACHE_TRAILER.size:
+            raise cPickle.UnpicklingError("%s is truncated" % path)
+
+        offset, length, checksum, end = CACHE_TRAILER.unpack(self.data[-CACHE_TRAILER.size:])
+        data = self.data[offset:offset + length]
+        if end != CACHE_END_MAGIC or zlib.crc32(data) != checksum:
+            raise cPickle.UnpicklingError("%s is truncated" % path)
+
+        directory = cPickle.loads(data)
+        self.entries = directory["attrs"]
+        self.stamp = directory["stamp"]
+        self.compacted_size = directory["compacted_size"]
+        # Size of the segments, the directory is written after them
+        self.size = offset
+
+        # Objects read from the file and their entries, unchanged ones
+        # are not written again when appending to the file
+        self.__loaded = {}
+
+    def has_attr(self, attr):
+        return self.entries.has_key(attr)
+
+    def attrs(self):
+        return self.entries.keys()
+
+    def in_use(self):
+        return bool(self.__loaded)
+
+    def entry_of(self, value):
+        """Returns the entry of an object read from the file, or None"""
+        loaded = self.__loaded.get(id(value))
+        if loaded and loaded[0] is value:
+            return loaded[1]
+        return None
+
+    def load(self, attr, db):
+        entry = self.entries[attr]
+        kind = entry[0]
+
+        if kind == "alias":
+            return getattr(db, entry[1]).dbobj
+
+        if kind == "itembyrepo":
+            import pisi.db.itembyrepo
+            kind, compressed, tables = entry
+            dbobj = dict((repo, self.__load_table(table)) for repo, table in tables.iteritems())
+            value = pisi.db.itembyrepo.ItemByRepo(dbobj, compressed)
+        else:
+            value = self.__unpickle(entry[1], entry[2])
+
+        self.__loaded[id(value)] = (value, entry)
+        return value
+
+    def has_table(self, attr, repo):
+        entry = self.entries.get(attr)
+        return entry is not None and entry[0] == "itembyrepo" and entry[2].has_key(repo)
+
+    def load_table(self, attr, repo):
+        """Returns the table of an ItemByRepo attribute for a repository"""
+        return self.__load_table(self.entries[attr][2][repo])
+
+    def __load_table(self, table):
+        kind, offset, length = table
+        if kind == "pickle":
+            value = self.__unpickle(offset, length)
+        else:
+            value = CachedTable(self.data, offset, length, kind == "raw")
+        self.__loaded[id(value)] = (value, table)
+        return value
+
+    def __unpickle(self, offset, length):
+        return cPickle.loads(self.data[offset:offset + length])
+
+def write_cache(path, attrs, stamp, base=None, dirty=()):
+    """Writes the attributes of a database to a cache file. If base is
+    given, only the attributes marked dirty and the objects that were not
+    read from it are appended to a copy of it."""
+    import pisi.db.itembyrepo
+
+    tmp_path = "%s.tmp" % path
+    if base is None:
+        out = open(tmp_path, "wb")
+        out.write(CACHE_MAGIC)
+    else:
+        # The base file is mapped by readers and left as it is, a process
+        # killed while appending leaves only the copy behind
+        shutil.copyfile(base.path, tmp_path)
+        out = open(tmp_path, "r+b")
+        out.seek(base.size)
+
+    def segment(data):
+        offset = out.tell()
+        out.write(data)
+        return offset, len(data)
+
+    def pickled(value):
+        return segment(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+
+    def unchanged(value):
+        if base is None:
+            return None
+        return base.entry_of(value)
+
+    def table(value):
+        entry = unchanged(value)
+        if entry:
+            return entry
+
+        if isinstance(value, CachedTable):
+            raw = value.is_raw()
+        elif isinstance(value, dict):
+            raw = all(type(item) is str for item in value.itervalues())
+        else:
+            return ("pickle",) + pickled(value)
+
+        index = {}
+        for key, item in value.iteritems():
+            index[key] = segment(item) if raw else pickled(item)
+        return ("raw" if raw else "items",) + pickled(index)
+
+    shared = {}
+    for attr, value in attrs.iteritems():
+        if isinstance(value, pisi.db.itembyrepo.ItemByRepo):
+            shared[id(value.dbobj)] = attr
+
+    entries = {}
+    if base is not None:
+        # Attributes that have not been read are left as they are
+        for attr in base.attrs():
+            if attr not in attrs and attr not in dirty:
+                entries[attr] = base.entries[attr]
+
+    for attr, value in attrs.iteritems():
+        if attr not in dirty and unchanged(value):
+            entries[attr] = unchanged(value)
+        elif isinstance(value, pisi.db.itembyrepo.ItemByRepo):
+            tables = dict((repo, table(items)) for repo, items in value.dbobj.iteritems())
+            entries[attr] = ("itembyrepo", value.compressed, tables)
+        elif id(value) in shared:
+            # Same object as the tables of an ItemByRepo attribute
+            entries[attr] = ("alias", shared[id(value)])
+        else:
+            entries[attr] = ("pickle",) + pickled(value)
+
+    if base is None:
+        compacted_size = out.tell()
+    else:
+        compacted_size = base.compacted_size
+
+    directory = {"attrs": entries, "stamp": stamp, "compacted_size": compacted_size}
+    data = cPickle.dumps(directory, cPickle.HIGHEST_PROTOCOL)
+    offset, length = segment(data)
+    out.write(CACHE_TRAILER.pack(offset, length, zlib.crc32(data), CACHE_END_MAGIC))
+    out.truncate()
+    out.flush()
+    os.fsync(out.fileno())
+    out.close()
+
+    os.rename(tmp_path, path)
+
 class Singleton(object):
     _the_instances = {}
     def __new__(type):
@@ -36,7 +292,10 @@ class Singleton(object):
 
 class LazyDB(Singleton):
 
-    cache_version = "2.4"
+    cache_version = "3.1"
+
+    # Attributes that are not written to the cache file
+    transient_attrs = ()
 
     def __init__(self, cacheable=False, cachedir=None):
         if not self.__dict__.has_key("initialized"):
@@ -59,14 +318,72 @@ class LazyDB(Singleton):
         except IOError:
             return "2.2"
 
+    def __cached_attrs(self):
+        return dict((attr, value) for attr, value in self._instance().__dict__.iteritems()
+                        if attr not in ("initialized", "cacheable", "cachedir") and
+                           attr not in self.transient_attrs and
+                           not attr.startswith("_LazyDB__"))
+
+    def cache_stamp(self):
+        """Returns the state of the data the database is built from. A
+        cache with another stamp is out of date."""
+        if self.cachedir and os.path.exists(self.cachedir):
+            return repr(os.stat(self.cachedir).st_mtime)
+        return None
+
+    def is_stale(self):
+        """Returns False if the database is known to be up to date with
+        the data it is built from"""
+        stamp = self.__dict__.get("_LazyDB__stamp")
+        return not self.initialized or stamp is None or stamp != self.cache_stamp()
+
+    def mark_dirty(self, *attrs):
+        """Marks attributes changed after initialization to be written
+        on the next cache_save"""
+        self.__dict__.setdefault("_LazyDB__dirty", set()).update(attrs)
+
+    def previous_cache(self):
+        """Returns the out of date cache file of the database, if any, so
+        that init can reuse its parts that are still valid"""
+        return self.__dict__.get("_LazyDB__previous")
+
     def cache_save(self):
-        if os.access(ctx.config.cache_root_dir(), os.W_OK) and self.cacheable:
-            with open(self.__cache_version_file(), "w") as f:
-                f.write(LazyDB.cache_version)
-                f.flush()
-                os.fsync(f.fileno())
-            cPickle.dump(self._instance().__dict__,
-                         file(self.__cache_file(), 'wb'), 1)
+        if not os.access(ctx.config.cache_root_dir(), os.W_OK) or not self.cacheable:
+            return
+
+        cache = self.__dict__.get("_LazyDB__cache")
+        dirty = self.__dict__.get("_LazyDB__dirty", set())
+        if cache and not dirty:
+            # Loaded from an up to date cache and not changed since
+            return
+
+        cache_file = self.__cache_file()
+        base = cache or self.previous_cache()
+        if base and (not base.in_use() or base.size >= 2 * base.compacted_size):
+            base = None
+
+        if base is None and cache:
+            # Writing the cache from scratch, read everything
+            for attr in cache.attrs():
+                getattr(self, attr)
+
+        with open(self.__cache_version_file(), "w") as f:
+            f.write(LazyDB.cache_version)
+            f.flush()
+            os.fsync(f.fileno())
+
+        stamp = self.cache_stamp()
+        attrs = self.__cached_attrs()
+        write_cache(cache_file, attrs, stamp, base, dirty)
+
+        # Go on with the new cache file, attributes are read from it
+        # again when they are needed
+        for attr in attrs:
+            del self.__dict__[attr]
+        self.__cache = CacheFile(cache_file)
+        self.__stamp = stamp
+        self.__dirty = set()
+        self.__dict__.pop("_LazyDB__previous", None)
 
     def cache_valid(self):
         if not self.cachedir:
@@ -83,12 +400,24 @@ class LazyDB(Singleton):
     def cache_load(self):
         if os.path.exists(self.__cache_file()) and self.cache_valid():
             try:
-                self._instance().__dict__ = cPickle.load(file(self.__cache_file(), 'rb'))
-                return True
-            except (cPickle.UnpicklingError, EOFError):
+                cache = CacheFile(self.__cache_file())
+            except Exception:
+                # Any broken cache file is built again
                 if os.access(ctx.config.cache_root_dir(), os.W_OK):
-                    os.unlink(self.__cache_file())
+                    try:
+                        os.unlink(self.__cache_file())
+                    except OSError:
+                        pass
                 return False
+
+            if cache.stamp != self.cache_stamp():
+                # Out of date, init may still reuse parts of it
+                self.__previous = cache
+                return False
+
+            self.__cache = cache
+            self.__stamp = cache.stamp
+            return True
         return False
 
     def cache_flush(self):
@@ -106,7 +435,9 @@ class LazyDB(Singleton):
 
     def __init(self):
         if not self.cache_load():
+            stamp = self.cache_stamp()
             self.init()
+            self.__stamp = stamp
 
     def __getattr__(self, attr):
         if not attr == "__setstate__" and not self.initialized:
@@ -117,6 +448,11 @@ class LazyDB(Singleton):
             self.initialized = True
 
         if not self.__dict__.has_key(attr):
+            # Attributes are read from the cache file when first used
+            cache = self.__dict__.get("_LazyDB__cache")
+            if cache and cache.has_attr(attr):
+                self.__dict__[attr] = cache.load(attr, self)
+                return self.__dict__[attr]
             raise AttributeError, attr
 
         return self.__dict__[attr]
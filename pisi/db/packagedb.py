@@ -10,72 +10,280 @@
 # Please read the COPYING file.
 #
 
-import re
 import time
 import gzip
 import gettext
 import datetime
+import collections
 __trans = gettext.translation('pisi', fallback=True)
 _ = __trans.ugettext
 
 import piksemel
+from xml.parsers import expat
 
 import pisi.db
+import pisi.util
+import pisi.context as ctx
 import pisi.metadata
 import pisi.dependency
+import pisi.version
+import pisi.solver
 import pisi.db.itembyrepo
+import pisi.db.searchindex as searchindex
 import pisi.db.lazydb as lazydb
 
+# The fields of a package that dependency resolution needs. Dependencies
+# and conflicts are tuples of the package name and the constraints, as in
+# the reverse dependency tables, updates are the releases of the history
+# with their (action, package, target) requirements. The version keys
+# are the parsed versions to compare, None if a version is not valid.
+PackageEntry = collections.namedtuple("PackageEntry",
+        ("version", "release", "distribution", "distribution_release",
+         "dependencies", "components", "conflicts", "updates",
+         "version_key", "distribution_release_key"))
+
+def parse_index(index_path, search_index=None, entries=None):
+    """Reads the packages, reverse dependencies, obsoletes and replaces
+    tables of a repository index in one pass. The document tree is never
+    built, package and dependency nodes are copied from the index as they
+    are. If search_index is given, the names, summaries and descriptions
+    of the packages are added to it. If entries is given, the
+    PackageEntry of each package is added to it."""
+
+    packages = {}
+    revdeps = {}
+    obsoletes = []
+    replaces = []
+
+    if index_path is None:
+        return packages, revdeps, obsoletes, replaces
+
+    index = open(index_path, "rb")
+    source = open(index_path, "rb")
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.returns_unicode = False
+
+    tags = []        # open elements
+    offsets = []     # their start offsets
+    text = []        # character data of the current element
+    package = {}     # state of the current top level package
+    state = {"src_repo": False, "lang": None}
+
+    def find_in_source(offset, token):
+        source.seek(offset)
+        chunk = ""
+        while True:
+            data = source.read(256)
+            if not data:
+                raise expat.ExpatError("unexpected end of file")
+            chunk += data
+            found = chunk.find(token)
+            if found != -1:
+                return offset + found
+
+    def node_string(start):
+        # The parser stops at the end tag, or at the start tag of
+        # an empty element
+        end = parser.CurrentByteIndex
+        if end == start:
+            end = find_in_source(start, "/>") + 2
+        else:
+            end = find_in_source(end, ">") + 1
+        source.seek(start)
+        return source.read(end - start)
+
+    def constraints():
+        return tuple(sorted(state["attrs"].items()))
+
+    def start_element(tag, attrs):
+        tags.append(tag)
+        offsets.append(parser.CurrentByteIndex)
+        del text[:]
+
+        depth = len(tags)
+        if depth == 2:
+            if tag == "Package":
+                package.clear()
+                package["deps"] = []
+                package["texts"] = []
+                package["anydeps"] = []
+                package["components"] = []
+                package["conflicts"] = []
+                package["updates"] = []
+            elif tag == "SpecFile":
+                state["src_repo"] = True
+        elif depth == 3 and tags[1] == "Package" and tag == "Replaces":
+            package["replaces"] = True
+        elif depth == 3:
+            state["lang"] = attrs.get("xml:lang") or "en"
+        elif depth == 4 and tags[1:3] == ["Package", "RuntimeDependencies"] \
+                and tag == "AnyDependency":
+            package["anydep"] = []
+        elif depth == 4 and tags[1:3] == ["Package", "History"] and tag == "Update":
+            package["updates"].append((attrs.get("release"), []))
+
+        # Attributes of the dependency, conflict or action being read
+        state["attrs"] = attrs
+
+    def end_element(tag):
+        depth = len(tags)
+        start = offsets.pop()
+        data = "".join(text)
+        del text[:]
+
+        if depth == 2 and tag == "Package":
+            name = package.get("name")
+            packages[name] = gzip.zlib.compress(node_string(start))
+            if package.get("replaces"):
+                replaces.append(name)
+            for dep_name, dep in package["deps"]:
+                revdeps.setdefault(dep_name, set()).add((name, dep))
+            if entries is not None:
+                updates = package["updates"]
+                version, release = package.get("version"), updates and updates[0][0]
+                entries[name] = PackageEntry(version, release,
+                                             package.get("distribution"),
+                                             package.get("distribution_release"),
+                                             tuple(dep for dep_name, dep in package["deps"]) +
+                                                tuple(package["anydeps"]),
+                                             tuple(package["components"]),
+                                             tuple(package["conflicts"]),
+                                             tuple((update_release, tuple(actions))
+                                                     for update_release, actions in updates),
+                                             pisi.version.version_key(version),
+                                             pisi.version.version_key(package.get("distribution_release")))
+            if search_index is not None:
+                search_index.add(name, "name", name)
+                for field, lang, value in package["texts"]:
+                    search_index.add(name, field, value, lang)
+
+        elif depth == 3 and tags[1] == "Package" and tag == "Name":
+            package["name"] = data
+
+        elif depth == 3 and tags[1] == "Package" and tag in ("Summary", "Description"):
+            field = "summary" if tag == "Summary" else "desc"
+            package["texts"].append((field, state["lang"], data))
+
+        elif depth == 3 and tags[1] == "Package" and tag == "Distribution":
+            package["distribution"] = data
+
+        elif depth == 3 and tags[1] == "Package" and tag == "DistributionRelease":
+            package["distribution_release"] = data
+
+        elif depth == 4 and tags[1:3] == ["Package", "RuntimeDependencies"] \
+                and tag == "Dependency":
+            package["deps"].append((data, (data, constraints())))
+
+        elif depth == 5 and tags[1:4] == ["Package", "RuntimeDependencies", "AnyDependency"] \
+                and tag == "Dependency":
+            package["anydep"].append((data, constraints()))
+
+        elif depth == 4 and tags[1:3] == ["Package", "RuntimeDependencies"] \
+                and tag == "AnyDependency":
+            package["anydeps"].append(tuple(package["anydep"]))
+
+        elif depth == 4 and tags[1:3] == ["Package", "RuntimeDependencies"] \
+                and tag == "Component":
+            package["components"].append(data)
+
+        elif depth == 4 and tags[1:3] == ["Package", "Conflicts"] and tag == "Package":
+            package["conflicts"].append((data, constraints()))
+
+        elif depth == 5 and tags[1:4] == ["Package", "History", "Update"] \
+                and tag == "Version" and "version" not in package:
+            # The first update is the current version of the package
+            package["version"] = data
+
+        elif depth == 6 and tags[1:5] == ["Package", "History", "Update", "Requires"] \
+                and tag == "Action":
+            attrs = state["attrs"]
+            package["updates"][-1][1].append((data, attrs.get("package"), attrs.get("target")))
+
+        elif depth == 4 and tags[1:3] == ["Distribution", "Obsoletes"] \
+                and tag == "Package":
+            obsoletes.append(data)
+
+        tags.pop()
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = text.append
+
+    try:
+        parser.ParseFile(index)
+    except expat.ExpatError:
+        raise pisi.db.repodb.RepoError(_("Error parsing repository index information. Index file does not exist or is malformed."))
+    finally:
+        index.close()
+        source.close()
+
+    if state["src_repo"]:
+        obsoletes = []
+
+    return packages, revdeps, obsoletes, replaces
+
 class PackageDB(lazydb.LazyDB):
 
+    # Packages decoded by get_package_repo, the graph of the solver and
+    # the conflicts index, dropped with the database when it is invalidated
+    transient_attrs = ("decoded_packages", "package_graph", "conflicts_index")
+
     def __init__(self):
         lazydb.LazyDB.__init__(self, cacheable=True)
 
+    def cache_stamp(self):
+        return pisi.db.repodb.RepoDB().get_repo_stamps()
+
     def init(self):
         self.__package_nodes = {} # Packages
         self.__revdeps = {}       # Reverse dependencies
         self.__obsoletes = {}     # Obsoletes
         self.__replaces = {}      # Replaces
+        self.__search = {}        # Search tables
+        self.__entries = {}       # Package entries
+        self.__conflicts = {}     # Conflicts by conflicted package
 
         repodb = pisi.db.repodb.RepoDB()
+        stamps = repodb.get_repo_stamps()
+        previous = self.previous_cache()
 
         for repo in repodb.list_repos():
-            doc = repodb.get_repo_doc(repo)
-            self.__package_nodes[repo] = self.__generate_packages(doc)
-            self.__revdeps[repo] = self.__generate_revdeps(doc)
-            self.__obsoletes[repo] = self.__generate_obsoletes(doc)
-            self.__replaces[repo] = self.__generate_replaces(doc)
+            if previous and previous.stamp.get(repo) == stamps[repo] and \
+                    previous.has_table("cfdb", repo):
+                # The index of the repository has not changed since
+                # the cache was written, reuse its tables.
+                self.__package_nodes[repo] = previous.load_table("pdb", repo)
+                self.__revdeps[repo] = previous.load_table("rvdb", repo)
+                self.__obsoletes[repo] = previous.load_table("odb", repo)
+                self.__replaces[repo] = previous.load_table("rpdb", repo)
+                self.__search[repo] = previous.load_table("sidb", repo)
+                self.__entries[repo] = previous.load_table("gdb", repo)
+                self.__conflicts[repo] = previous.load_table("cfdb", repo)
+            else:
+                search_index = searchindex.SearchIndex()
+                self.__entries[repo] = {}
+                (self.__package_nodes[repo], self.__revdeps[repo],
+                 self.__obsoletes[repo], self.__replaces[repo]) = parse_index(repodb.get_repo_index(repo),
+                                                                              search_index,
+                                                                              self.__entries[repo])
+                self.__search[repo] = search_index.table
+                self.__conflicts[repo] = self.__generate_conflicts(self.__entries[repo])
 
         self.pdb = pisi.db.itembyrepo.ItemByRepo(self.__package_nodes, compressed=True)
         self.rvdb = pisi.db.itembyrepo.ItemByRepo(self.__revdeps)
         self.odb = pisi.db.itembyrepo.ItemByRepo(self.__obsoletes)
         self.rpdb = pisi.db.itembyrepo.ItemByRepo(self.__replaces)
+        self.sidb = pisi.db.itembyrepo.ItemByRepo(self.__search)
+        self.gdb = pisi.db.itembyrepo.ItemByRepo(self.__entries)
+        self.cfdb = pisi.db.itembyrepo.ItemByRepo(self.__conflicts)
 
-    def __generate_replaces(self, doc):
-        return [x.getTagData("Name") for x in doc.tags("Package") if x.getTagData("Replaces")]
-
-    def __generate_obsoletes(self, doc):
-        distribution = doc.getTag("Distribution")
-        obsoletes = distribution and distribution.getTag("Obsoletes")
-        src_repo = doc.getTag("SpecFile") is not None
-
-        if not obsoletes or src_repo:
-            return []
-
-        return map(lambda x: x.firstChild().data(), obsoletes.tags("Package"))
-
-    def __generate_packages(self, doc):
-        return dict(map(lambda x: (x.getTagData("Name"), gzip.zlib.compress(x.toString())), doc.tags("Package")))
-
-    def __generate_revdeps(self, doc):
-        revdeps = {}
-        for node in doc.tags("Package"):
-            name = node.getTagData('Name')
-            deps = node.getTag('RuntimeDependencies')
-            if deps:
-                for dep in deps.tags("Dependency"):
-                    revdeps.setdefault(dep.firstChild().data(), set()).add((name, dep.toString()))
-        return revdeps
+    def __generate_conflicts(self, entries):
+        conflicts = {}
+        for name, entry in entries.iteritems():
+            for conflicted, constraints in entry.conflicts:
+                conflicts.setdefault(conflicted, []).append((name, constraints))
+        return conflicts
 
     def has_package(self, name, repo=None):
         return self.pdb.has_item(name, repo)
@@ -85,18 +293,8 @@ class PackageDB(lazydb.LazyDB):
         return pkg
 
     def search_in_packages(self, packages, terms, lang=None):
-        resum = '<Summary xml:lang=.(%s|en).>.*?%s.*?</Summary>'
-        redesc = '<Description xml:lang=.(%s|en).>.*?%s.*?</Description>'
-        if not lang:
-            lang = pisi.pxml.autoxml.LocalText.get_lang()
-        found = []
-        for name in packages:
-            xml = self.pdb.get_item(name)
-            if terms == filter(lambda term: re.compile(term, re.I).search(name) or \
-                                            re.compile(resum % (lang, term), re.I).search(xml) or \
-                                            re.compile(redesc % (lang, term), re.I).search(xml), terms):
-                found.append(name)
-        return found
+        packages = set(packages)
+        return [name for name in self.search_package(terms, lang) if name in packages]
 
     def search_package(self, terms, lang=None, repo=None, fields=None):
         """
@@ -108,56 +306,97 @@ class PackageDB(lazydb.LazyDB):
         This method will return only package that contents terms in the package
         name or summary
         """
-        resum = '<Summary xml:lang=.(%s|en).>.*?%s.*?</Summary>'
-        redesc = '<Description xml:lang=.(%s|en).>.*?%s.*?</Description>'
         if not lang:
             lang = pisi.pxml.autoxml.LocalText.get_lang()
         if not fields:
             fields = {'name': True, 'summary': True, 'desc': True}
-        found = []
-        for name, xml in self.pdb.get_items_iter(repo):
-            if terms == filter(lambda term: (fields['name'] and \
-                    re.compile(term, re.I).search(name)) or \
-                    (fields['summary'] and \
-                    re.compile(resum % (lang, term), re.I).search(xml)) or \
-                    (fields['desc'] and \
-                    re.compile(redesc % (lang, term), re.I).search(xml)), terms):
-                found.append(name)
-        return found
-
-    def __get_version(self, meta_doc):
-        history = meta_doc.getTag("History")
-        version = history.getTag("Update").getTagData("Version")
-        release = history.getTag("Update").getAttribute("release")
-
-        # TODO Remove None
-        return version, release, None
+        return searchindex.search(self.sidb.get_repo_tables(repo), terms, lang, fields)
 
-    def __get_distro_release(self, meta_doc):
-        distro = meta_doc.getTagData("Distribution")
-        release = meta_doc.getTagData("DistributionRelease")
-
-        return distro, release
+    def get_entry(self, name, repo=None):
+        """Returns the PackageEntry of a package"""
+        return self.gdb.get_item(name, repo)
 
     def get_version_and_distro_release(self, name, repo):
         if not self.has_package(name, repo):
             raise Exception(_('Package %s not found.') % name)
 
-        pkg_doc = piksemel.parseString(self.pdb.get_item(name, repo))
-        return self.__get_version(pkg_doc) + self.__get_distro_release(pkg_doc)
+        entry = self.get_entry(name, repo)
+        # TODO Remove None
+        return entry.version, entry.release, None, entry.distribution, entry.distribution_release
 
     def get_version(self, name, repo):
         if not self.has_package(name, repo):
             raise Exception(_('Package %s not found.') % name)
 
-        pkg_doc = piksemel.parseString(self.pdb.get_item(name, repo))
-        return self.__get_version(pkg_doc)
+        entry = self.get_entry(name, repo)
+        # TODO Remove None
+        return entry.version, entry.release, None
 
     def get_package_repo(self, name, repo=None):
-        pkg, repo = self.pdb.get_item_repo(name, repo)
-        package = pisi.metadata.Package()
-        package.parse(pkg)
-        return package, repo
+        """Returns the package and the repository it is found in. Decoded
+        packages are shared between calls and must not be modified."""
+        decoded = self.__decoded_packages()
+        found = decoded.get((repo, name))
+        if found is None:
+            pkg, pkg_repo = self.pdb.get_item_repo(name, repo)
+            package = pisi.metadata.Package()
+            package.parse(pkg)
+            found = (package, pkg_repo)
+            # The size of the metadata is a fair measure of the
+            # memory a decoded package uses
+            decoded.put((repo, name), found, len(pkg))
+        return found
+
+    def __decoded_packages(self):
+        decoded = self.__dict__.get("decoded_packages")
+        if decoded is None:
+            limit = int(ctx.config.values.general.package_metadata_cache_limit)
+            decoded = pisi.util.LRUCache(limit * 1024 * 1024)
+            self.__dict__["decoded_packages"] = decoded
+        return decoded
+
+    def get_package_graph(self):
+        """Returns the dependency graph of the solver, built once for
+        the database"""
+        graph = self.__dict__.get("package_graph")
+        if graph is None:
+            graph = pisi.solver.PackageGraph(self)
+            self.__dict__["package_graph"] = graph
+        return graph
+
+    def get_conflicts_index(self):
+        """Returns a dictionary mapping package names to the (package,
+        constraints) pairs of the repository packages conflicting with
+        them, built once for the database"""
+        index = self.__dict__.get("conflicts_index")
+        if index is None:
+            index = {}
+            # Only the packages of the first repository having them
+            # are taken into account, as everywhere else
+            for repo in pisi.db.repodb.RepoDB().list_repos():
+                table = self.cfdb.dbobj.get(repo)
+                if not table:
+                    continue
+                for conflicted, conflicts in table.iteritems():
+                    for name, constraints in conflicts:
+                        if self.which_repo(name) == repo:
+                            index.setdefault(conflicted, []).append((name, constraints))
+            self.__dict__["conflicts_index"] = index
+        return index
+
+    def __log_decoded_packages(self):
+        decoded = self.__dict__.get("decoded_packages")
+        if decoded is not None:
+            ctx.ui.debug("Decoded package cache: %d hits, %d misses, %d packages in %d bytes."
+                            % (decoded.hits, decoded.misses, len(decoded), decoded.size))
+
+    def cache_save(self):
+        self.__log_decoded_packages()
+        lazydb.LazyDB.cache_save(self)
+
+    def invalidate(self):
+        self.__log_decoded_packages()
+        lazydb.LazyDB.invalidate(self)
 
     def which_repo(self, name):
         return self.pdb.which_repo(name)
@@ -184,16 +423,7 @@ class PackageDB(lazydb.LazyDB):
         except Exception: #FIXME: what exception could we catch here, replace with that.
             return []
 
-        rev_deps = []
-        for pkg, dep in rvdb:
-            node = piksemel.parseString(dep)
-            dependency = pisi.dependency.Dependency()
-            dependency.package = node.firstChild().data()
-            if node.attributes():
-                attr = node.attributes()[0]
-                dependency.__dict__[attr] = node.getAttribute(attr)
-            rev_deps.append((pkg, dependency))
-        return rev_deps
+        return [(pkg, pisi.dependency.from_tuple(dep)) for pkg, dep in rvdb]
 
     # replacesdb holds the info about the replaced packages (ex. gaim -> pidgin)
     def get_replaces(self, repo=None):
@@ -150,10 +150,7 @@ class RepoDB(lazydb.LazyDB):
     def has_repo_url(self, url, only_active = True):
         return url in self.list_repo_urls(only_active)
 
-    def get_repo_doc(self, repo_name):
-        if not self.has_repo(repo_name):
-            raise RepoError(_("Repository %s does not exist.") % repo)
-
+    def __index_path(self, repo_name):
         repo = self.get_repo(repo_name)
 
         index_path = repo.indexuri.get_uri()
@@ -167,8 +164,37 @@ class RepoDB(lazydb.LazyDB):
             if File.is_compressed(index_path):
                 index_path = os.path.splitext(index_path)[0]
 
+        return index_path
+
+    def get_repo_index(self, repo_name):
+        """Returns the path of the local copy of the repository index or
+        None if the repository has not been updated yet"""
+        if not self.has_repo(repo_name):
+            raise RepoError(_("Repository %s does not exist.") % repo)
+
+        index_path = self.__index_path(repo_name)
         if not os.path.exists(index_path):
             ctx.ui.warning(_("%s repository needs to be updated") % repo_name)
+            return None
+
+        return index_path
+
+    def get_repo_stamps(self):
+        """Returns the paths, modification times and sizes of the local
+        indexes of active repositories"""
+        stamps = {}
+        for repo in self.list_repos():
+            index_path = self.__index_path(repo)
+            try:
+                st = os.stat(index_path)
+                stamps[repo] = (index_path, repr(st.st_mtime), st.st_size)
+            except OSError:
+                stamps[repo] = None
+        return stamps
+
+    def get_repo_doc(self, repo_name):
+        index_path = self.get_repo_index(repo_name)
+        if index_path is None:
             return piksemel.newDocument("PISI")
 
         try:
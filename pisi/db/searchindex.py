@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Inverted index of the searchable fields of repository items"""
+
+import re
+
+# A search table maps (field, language) pairs to the words found in that
+# field of the items, and each word to the items it is found in. Names
+# are indexed as a single word, texts are split at white space.
+#
+# Search terms are regular expressions matched against the words of the
+# table instead of the items, so a query reads neither the items nor the
+# languages and fields it does not look in.
+
+# Weights of the fields when ranking the results, a term matching a
+# whole word counts twice
+FIELD_WEIGHTS = {"name": 8, "localname": 4, "summary": 2, "desc": 1}
+
+class SearchIndex(object):
+    """Builds the search table of a repository"""
+
+    def __init__(self):
+        self.table = {}
+
+    def add(self, item, field, text, lang=None):
+        if not text:
+            return
+
+        text = text.lower()
+        if field == "name":
+            tokens = [text]
+        else:
+            tokens = set(text.split())
+
+        words = self.table.setdefault((field, lang), {})
+        for token in tokens:
+            words.setdefault(token, []).append(item)
+
+    def add_texts(self, item, field, node, tag):
+        """Adds the local texts of the tags of a piksemel node"""
+        for text in node.tags(tag):
+            data = text.firstChild()
+            if data:
+                self.add(item, field, data.data(), text.getAttribute("xml:lang") or "en")
+
+def search(tables, terms, lang, fields):
+    """Returns the items of the search tables that match all terms in the
+    fields marked True, best matches first. Texts are searched in lang
+    and in English."""
+
+    words = []
+    for term in terms:
+        words.extend(re.compile(word, re.I) for word in term.split())
+
+    scores = {}
+    for table in tables:
+        postings = [(field, table[(field, l)]) for field, l in table.keys()
+                        if fields.get(field) and l in (None, lang, "en")]
+
+        found = None
+        for word in words:
+            # Best score of the word in each field of the items
+            field_scores = {}
+            for field, index in postings:
+                weight = FIELD_WEIGHTS[field]
+                best = field_scores.setdefault(field, {})
+                for token, items in index.iteritems():
+                    match = word.search(token)
+                    if match:
+                        score = weight * 2 if match.group() == token else weight
+                        for item in items:
+                            if best.get(item, 0) < score:
+                                best[item] = score
+
+            matches = {}
+            for best in field_scores.itervalues():
+                for item, score in best.iteritems():
+                    matches[item] = matches.get(item, 0) + score
+
+            if found is None:
+                found = matches
+            else:
+                found = dict((item, score + matches[item])
+                                for item, score in found.iteritems() if item in matches)
+            if not found:
+                break
+
+        for item, score in (found or {}).iteritems():
+            scores[item] = max(score, scores.get(item, 0))
+
+    return sorted(scores, key=lambda item: (-scores[item], item))
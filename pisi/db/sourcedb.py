@@ -10,13 +10,12 @@
 # Please read the COPYING file.
 #
 
-import re
 import gzip
 
-import piksemel
-
 import pisi
+import pisi.dependency
 import pisi.specfile
+import pisi.db.searchindex as searchindex
 import pisi.db.lazydb as lazydb
 
 class SourceDB(lazydb.LazyDB):
@@ -24,33 +23,45 @@ class SourceDB(lazydb.LazyDB):
     def __init__(self):
         lazydb.LazyDB.__init__(self, cacheable=True)
 
+    def cache_stamp(self):
+        return pisi.db.repodb.RepoDB().get_repo_stamps()
+
     def init(self):
         self.__source_nodes = {}
         self.__pkgstosrc = {}
         self.__revdeps = {}
+        self.__search = {}
 
         repodb = pisi.db.repodb.RepoDB()
 
         for repo in repodb.list_repos():
             doc = repodb.get_repo_doc(repo)
-            self.__source_nodes[repo], self.__pkgstosrc[repo] = self.__generate_sources(doc)
+            (self.__source_nodes[repo], self.__pkgstosrc[repo],
+             self.__search[repo]) = self.__generate_sources(doc)
             self.__revdeps[repo] = self.__generate_revdeps(doc)
 
         self.sdb = pisi.db.itembyrepo.ItemByRepo(self.__source_nodes, compressed=True)
         self.psdb = pisi.db.itembyrepo.ItemByRepo(self.__pkgstosrc)
         self.rvdb = pisi.db.itembyrepo.ItemByRepo(self.__revdeps)
+        self.sidb = pisi.db.itembyrepo.ItemByRepo(self.__search)
 
     def __generate_sources(self, doc):
         sources = {}
         pkgstosrc = {}
+        search_index = searchindex.SearchIndex()
 
         for spec in doc.tags("SpecFile"):
-            src_name = spec.getTag("Source").getTagData("Name")
+            src = spec.getTag("Source")
+            src_name = src.getTagData("Name")
             sources[src_name] = gzip.zlib.compress(spec.toString())
             for package in spec.tags("Package"):
                 pkgstosrc[package.getTagData("Name")] = src_name
 
-        return sources, pkgstosrc
+            search_index.add(src_name, "name", src_name)
+            search_index.add_texts(src_name, "summary", src, "Summary")
+            search_index.add_texts(src_name, "desc", src, "Description")
+
+        return sources, pkgstosrc, search_index.table
 
     def __generate_revdeps(self, doc):
         revdeps = {}
@@ -59,7 +70,7 @@ class SourceDB(lazydb.LazyDB):
             deps = spec.getTag("Source").getTag("BuildDependencies")
             if deps:
                 for dep in deps.tags("Dependency"):
-                    revdeps.setdefault(dep.firstChild().data(), set()).add((name, dep.toString()))
+                    revdeps.setdefault(dep.firstChild().data(), set()).add((name, pisi.dependency.dependency_tuple(dep)))
         return revdeps
 
     def list_sources(self, repo=None):
@@ -89,22 +100,11 @@ class SourceDB(lazydb.LazyDB):
         This method will return only package that contents terms in the package
         name or summary
         """
-        resum = '<Summary xml:lang=.(%s|en).>.*?%s.*?</Summary>'
-        redesc = '<Description xml:lang=.(%s|en).>.*?%s.*?</Description>'
         if not fields:
             fields = {'name': True, 'summary': True, 'desc': True}
         if not lang:
             lang = pisi.pxml.autoxml.LocalText.get_lang()
-        found = []
-        for name, xml in self.sdb.get_items_iter(repo):
-            if terms == filter(lambda term: (fields['name'] and \
-                    re.compile(term, re.I).search(name)) or \
-                    (fields['summary'] and \
-                    re.compile(resum % (lang, term), re.I).search(xml)) or \
-                    (fields['desc'] and \
-                    re.compile(redesc % (lang, term), re.I).search(xml)), terms):
-                found.append(name)
-        return found
+        return searchindex.search(self.sidb.get_repo_tables(repo), terms, lang, fields)
 
     def get_spec_repo(self, name, repo=None):
         src, repo = self.sdb.get_item_repo(name, repo)
@@ -121,13 +121,4 @@ class SourceDB(lazydb.LazyDB):
         except Exception: #FIXME: what exception could we catch here, replace with that.
             return []
 
-        rev_deps = []
-        for pkg, dep in rvdb:
-            node = piksemel.parseString(dep)
-            dependency = pisi.dependency.Dependency()
-            dependency.package = node.firstChild().data()
-            if node.attributes():
-                attr = node.attributes()[0]
-                dependency.__dict__[attr] = node.getAttribute(attr)
-            rev_deps.append((pkg, dependency))
-        return rev_deps
+        return [(pkg, pisi.dependency.from_tuple(dep)) for pkg, dep in rvdb]
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Batched database updates of package operations"""
+
+import os
+
+import pisi
+import pisi.context as ctx
+import pisi.history
+
+# While a transaction is active, the history records of the packages of
+# an operation and the changes of the lists of marked packages are kept
+# in memory and written to the disk once, when the transaction ends or
+# at checkpoints, instead of after every package. The files index keeps
+# a journal of its own, see pisi.db.filesdb.
+#
+# Every change is appended to a journal before it is applied in memory.
+# If PiSi dies before the changes are written, the journal is replayed
+# the next time the history is read. Journal records are lines of tab
+# separated fields:
+#
+#   H histfile type date time count   history file the following package
+#                                     records belong to, and the number
+#                                     of packages already written to it
+#   P operation type name before_version before_release
+#     after_version after_release     a package record of the history
+#   M list package...                 new contents of a marked package list
+#
+# A journal is removed after its changes are written, so the count of
+# the H record tells the package records that were written but not
+# removed from the journal by an interrupted checkpoint.
+
+# Number of packages after which the changes are written
+CHECKPOINT_INTERVAL = 50
+
+_active = None
+
+def active():
+    """Returns the active transaction, or None"""
+    return _active
+
+def _journal_file():
+    return os.path.join(ctx.config.info_dir(), ctx.const.transaction_journal)
+
+def _field(value):
+    return "" if value is None else str(value)
+
+def _value(field):
+    return field or None
+
+def write_marked_packages(_type, packages):
+    info_file = os.path.join(ctx.config.info_dir(), _type)
+    config = open(info_file, "w")
+    for pkg in set(packages):
+        config.write("%s\n" % pkg)
+    config.close()
+
+def _history_package(fields):
+    operation, otype, name, before_version, before_release, \
+            after_version, after_release = fields
+
+    package = pisi.history.Package()
+    package.operation = operation
+    package.type = _value(otype)
+    package.name = name
+    package.before = None
+    package.after = None
+    if before_version:
+        package.before = pisi.history.PackageInfo()
+        package.before.version = before_version
+        package.before.release = before_release
+    if after_version:
+        package.after = pisi.history.PackageInfo()
+        package.after.version = after_version
+        package.after.release = after_release
+    return package
+
+def recover():
+    """Writes the changes of an interrupted transaction recorded in the
+    journal and removes the journal"""
+    # The journal of an active transaction is still being written,
+    # it is not left behind by an interrupted one
+    if _active:
+        return
+
+    journal_file = _journal_file()
+    if not os.path.exists(journal_file) or \
+            not os.access(ctx.config.info_dir(), os.W_OK):
+        return
+
+    history = None
+    skip = 0
+    marks = {}
+    for line in open(journal_file, "rb"):
+        # An interrupted write may leave a partial record behind
+        if not line.endswith("\n"):
+            break
+
+        fields = line[:-1].split("\t")
+        if fields[0] == "H":
+            histfile, optype, date, time, count = fields[1:]
+            path = os.path.join(ctx.config.history_dir(), histfile)
+            if os.path.exists(path):
+                history = pisi.history.History(path)
+                skip = len(history.operation.packages) - int(count)
+            else:
+                history = pisi.history.History()
+                history.operation.type = optype
+                history.operation.date = date
+                history.operation.time = time
+                skip = 0
+            history.histfile = histfile
+            history.operation.no = histfile.split("_")[0]
+        elif fields[0] == "P" and history is not None:
+            if skip > 0:
+                skip -= 1
+            else:
+                history.operation.packages.append(_history_package(fields[1:]))
+        elif fields[0] == "M":
+            marks[fields[1]] = fields[2:]
+
+    if history is not None:
+        history.update()
+
+    for _type, packages in marks.iteritems():
+        write_marked_packages(_type, packages)
+
+    os.unlink(journal_file)
+
+class Transaction(object):
+    """Collects the database changes of a package operation. Transactions
+    are used as context managers, a transaction started while another one
+    is active joins it. The changes are written when the outermost one
+    ends, whether the operation succeeds or not."""
+
+    def __init__(self):
+        self.outer = None
+        self.history = None
+        self.written = 0
+        self.pending = 0
+        self.marks = {}
+        self.journal = None
+
+    def __enter__(self):
+        global _active
+        if _active:
+            self.outer = _active
+            return _active
+
+        recover()
+        _active = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active
+        if self.outer:
+            return False
+
+        _active = None
+        self.commit()
+        return False
+
+    def __write_journal(self, *records):
+        if not self.journal:
+            self.journal = open(_journal_file(), "ab")
+        self.journal.write("".join("%s\n" % "\t".join(record) for record in records))
+        self.journal.flush()
+
+    def add_history(self, history, package):
+        """Records a package added to the history of the operation"""
+        records = []
+        if history is not self.history or not self.journal:
+            if history is not self.history:
+                # Operations that start a new history, like takeback,
+                # write the changes of the previous one first
+                self.commit()
+                self.history = history
+                self.written = 0
+            records.append(("H", history.histfile, history.operation.type,
+                            history.operation.date, history.operation.time,
+                            str(self.written)))
+
+        before = package.before or None
+        after = package.after or None
+        records.append(("P", package.operation, _field(package.type), package.name,
+                        _field(before and before.version), _field(before and before.release),
+                        _field(after and after.version), _field(after and after.release)))
+        self.__write_journal(*records)
+
+        self.pending += 1
+        if self.pending >= CHECKPOINT_INTERVAL:
+            self.commit()
+
+    def has_marked_packages(self, _type):
+        return self.marks.has_key(_type)
+
+    def marked_packages(self, _type):
+        return list(self.marks[_type])
+
+    def mark_packages(self, _type, packages):
+        """Records the new contents of a marked package list"""
+        packages = sorted(set(packages))
+        self.__write_journal(("M", _type) + tuple(packages))
+        self.marks[_type] = packages
+
+    def commit(self):
+        """Writes the changes recorded so far and removes the journal"""
+        if self.history is not None and self.pending:
+            self.history.update()
+            self.written += self.pending
+            self.pending = 0
+
+        for _type, packages in self.marks.iteritems():
+            write_marked_packages(_type, packages)
+        self.marks = {}
+
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+            try:
+                os.unlink(_journal_file())
+            except OSError:
+                pass
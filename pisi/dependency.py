@@ -60,3 +60,30 @@ class Dependency(pisi.relation.Relation):
     # Added for AnyDependency, single Dependency always returns False
     def satisfied_by_any_installed_other_than(self, package):
         return False
+
+# The dependency tables of the databases keep dependencies as tuples of
+# the package name and the (attribute, value) pairs of its version and
+# release constraints. An AnyDependency is a tuple of such tuples.
+
+def dependency_tuple(node):
+    """Returns the table tuple of a Dependency or AnyDependency node"""
+    if node.name() == "AnyDependency":
+        return tuple(map(dependency_tuple, node.tags("Dependency")))
+
+    constraints = [(attr, node.getAttribute(attr)) for attr in node.attributes()]
+    return node.firstChild().data(), tuple(sorted(constraints))
+
+def from_tuple(value):
+    """Returns the Dependency or AnyDependency of a table tuple"""
+    if isinstance(value[0], tuple):
+        anydependency = pisi.specfile.AnyDependency()
+        anydependency.dependencies = map(from_tuple, value)
+        anydependency.package = anydependency.dependencies[0].package
+        return anydependency
+
+    package, constraints = value
+    dependency = Dependency()
+    dependency.package = package
+    for attr, attr_value in constraints:
+        setattr(dependency, attr, attr_value)
+    return dependency
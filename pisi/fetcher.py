@@ -20,6 +20,12 @@ import os
 import time
 import base64
 import shutil
+import socket
+import hashlib
+import httplib
+import urllib
+import urlparse
+import threading
 
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
@@ -102,10 +108,299 @@ class UIHandler:
         self.last_updated = self.now()
 
 
+class DigestHandler:
+    """Progress object that computes the sha1 hash of a file while it is
+    downloaded and passes the progress on to a UIHandler, if any. The
+    file is read while its data is still in the page cache, as soon as
+    the transfer is reported."""
+
+    def __init__(self, path, ui_handler=None):
+        self.path = path
+        self.ui_handler = ui_handler
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+        self.file = None
+
+    def __read_new_data(self):
+        if self.file is None:
+            try:
+                self.file = open(self.path, "rb")
+            except IOError:
+                return
+
+        while True:
+            block = self.file.read(256 * 1024)
+            if not block:
+                break
+            self.sha1.update(block)
+            self.size += len(block)
+
+    def start(self, *args, **kwargs):
+        if self.ui_handler:
+            self.ui_handler.start(*args, **kwargs)
+
+    def update(self, size):
+        self.__read_new_data()
+        if self.ui_handler:
+            self.ui_handler.update(size)
+
+    def end(self, read):
+        if self.ui_handler:
+            self.ui_handler.end(read)
+
+    def digest(self):
+        """Return the sha1 hash of the downloaded file, or None if the
+        file was rewritten while it was read"""
+        self.__read_new_data()
+        if self.file is None:
+            return None
+
+        try:
+            same_file = os.path.samestat(os.fstat(self.file.fileno()),
+                                         os.stat(self.path))
+        finally:
+            self.file.close()
+            self.file = None
+
+        if not same_file or self.size != os.path.getsize(self.path):
+            return None
+
+        return self.sha1.hexdigest()
+
+
+class FetchSession(object):
+    """Keeps the HTTP connections of the fetchers open, so that the files
+    fetched from the same host reuse a connection instead of opening a
+    new one for each file. Connections are taken from the pool while a
+    response is read and given back when it is closed, so a session can
+    be shared by the fetchers of several threads.
+
+    Connections time out after the given number of seconds, or after the
+    fetch_timeout of the configuration if no timeout is given."""
+
+    max_redirects = 5
+    max_idle_per_host = 4
+
+    def __init__(self, timeout=None):
+        if timeout is None:
+            timeout = ctx.config.values.general.fetch_timeout
+        # A timeout of 0 waits forever
+        self.timeout = float(timeout or 0) or None
+        self.__idle = {}
+        self.__lock = threading.Lock()
+
+    def __connection(self, key):
+        with self.__lock:
+            idle = self.__idle.get(key)
+            if idle:
+                return idle.pop(), True
+
+        scheme, host, port, tunnel = key
+        if scheme == "https":
+            conn = httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+        if tunnel:
+            tunnel_host, tunnel_port, auth = tunnel
+            conn.set_tunnel(tunnel_host, tunnel_port,
+                            auth and {"Proxy-Authorization": auth})
+
+        return conn, False
+
+    def release(self, key, conn):
+        conn.timeout = self.timeout
+        if conn.sock:
+            conn.sock.settimeout(self.timeout)
+
+        with self.__lock:
+            idle = self.__idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close the idle connections"""
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = {}
+
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    @staticmethod
+    def __proxy_auth(proxy):
+        if proxy.username is None:
+            return None
+        credentials = "%s:%s" % (urllib.unquote(proxy.username),
+                                 urllib.unquote(proxy.password or ""))
+        return "Basic %s" % base64.b64encode(credentials)
+
+    @staticmethod
+    def __route(url, proxy, headers):
+        parts = urlparse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        if not proxy:
+            return (parts.scheme, parts.hostname, parts.port, None), path, headers
+
+        proxy = urlparse.urlsplit(proxy)
+        auth = FetchSession.__proxy_auth(proxy)
+        if parts.scheme == "https":
+            # Tunnel through the proxy, the credentials of the proxy
+            # are sent with the CONNECT request
+            tunnel = (parts.hostname, parts.port or httplib.HTTPS_PORT, auth)
+            return ("https", proxy.hostname, proxy.port, tunnel), path, headers
+
+        # Plain HTTP proxies get the whole URL
+        if auth:
+            headers = dict(headers)
+            headers["Proxy-Authorization"] = auth
+        return ("http", proxy.hostname, proxy.port, None), url, headers
+
+    def __send(self, method, url, headers, proxy, timeout):
+        key, path, headers = self.__route(url, proxy, headers)
+        conn, reused = self.__connection(key)
+        while True:
+            if timeout is not None:
+                conn.timeout = timeout
+                if conn.sock:
+                    conn.sock.settimeout(timeout)
+
+            try:
+                conn.request(method, path, headers=headers)
+                return FetchResponse(self, key, conn, conn.getresponse())
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if not reused:
+                    raise
+
+            # The server has closed the idle connection. The other idle
+            # connections to it are probably closed as well.
+            with self.__lock:
+                idle = self.__idle.pop(key, [])
+            for stale in idle:
+                stale.close()
+            conn, reused = self.__connection(key)
+
+    def request(self, method, url, headers=None, proxy=None, timeout=None):
+        """Send a request following the redirections and return the
+        response. The response must be closed after it is read."""
+
+        headers = dict(headers or {})
+        for redirect in range(self.max_redirects + 1):
+            response = self.__send(method, url, headers, proxy, timeout)
+            location = response.getheader("location")
+            if response.status not in (301, 302, 303, 307, 308) or not location:
+                return response
+
+            response.close()
+            url = urlparse.urljoin(url, location)
+            if response.status == 303 and method != "HEAD":
+                method = "GET"
+
+        raise FetchError(_("Too many redirections while fetching %s") % url)
+
+
+class FetchResponse(object):
+    """Response of a FetchSession request"""
+
+    # Short bodies that are not read, e.g. of redirections, are skipped
+    # to keep the connection
+    drain_limit = 64 * 1024
+
+    def __init__(self, session, key, conn, response):
+        self.session = session
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, size=None):
+        return self.response.read(size)
+
+    def close(self):
+        """Give the connection back to the session if it can be reused"""
+        if self.conn is None:
+            return
+
+        conn = self.conn
+        self.conn = None
+        response = self.response
+        try:
+            if not response.isclosed() and response.length is not None and \
+                    response.length <= self.drain_limit:
+                response.read()
+        except (httplib.HTTPException, socket.error):
+            pass
+
+        if response.isclosed() and not response.will_close:
+            self.session.release(self.key, conn)
+        else:
+            # The rest of the response is not read
+            self.response.close()
+            conn.close()
+
+
+class Throttle(object):
+    """Limits the combined rate of the transfers that share it. Each
+    transfer reports the data it receives and waits until the data of
+    all the transfers fits in the rate."""
+
+    def __init__(self, rate, shares=1):
+        # Rate in bytes per second
+        self.rate = rate
+        # Transfers that can not report their data, e.g. of urlgrabber,
+        # are limited to an equal share of the rate
+        self.share = max(1, rate / max(1, shares))
+        self.__lock = threading.Lock()
+        self.__next = 0
+
+    def consume(self, size):
+        with self.__lock:
+            now = time.time()
+            self.__next = max(self.__next, now) + float(size) / self.rate
+            delay = self.__next - now
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def bandwidth_limit():
+    """Return the configured bandwidth limit in bytes per second, or 0"""
+    limit = ctx.config.options.bandwidth_limit or ctx.config.values.general.bandwidth_limit
+    if limit and limit != "0":
+        return 1024 * int(limit)
+    return 0
+
+
+_session = None
+_session_lock = threading.Lock()
+
+def session():
+    """Return the fetch session shared by the fetchers of the process"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = FetchSession()
+        return _session
+
+
 class Fetcher:
     """Fetcher can fetch a file from various sources using various
     protocols."""
-    def __init__(self, url, destdir="/tmp", destfile=None):
+    # Size of the blocks read from HTTP responses
+    blocksize = 64 * 1024
+
+    def __init__(self, url, destdir="/tmp", destfile=None, session=None):
         if not isinstance(url, pisi.uri.URI):
             url = pisi.uri.URI(url)
 
@@ -116,13 +411,26 @@ class Fetcher:
         self.destdir = destdir
         self.destfile = destfile
         self.progress = None
+        self.session = session
+        # Throttle shared with other fetchers, see PackageFetcher
+        self.throttle = None
 
         self.archive_file = os.path.join(destdir, destfile or url.filename())
         self.partial_file = os.path.join(self.destdir, self.url.filename()) + ctx.const.partial_suffix
+        self.validator_file = self.partial_file + ctx.const.validator_suffix
 
         util.ensure_dirs(self.destdir)
 
     def test(self, timeout=3):
+        if self.__is_http():
+            try:
+                response = self.__request("HEAD", {}, timeout)
+            except (httplib.HTTPException, socket.error, FetchError):
+                return False
+
+            response.close()
+            return response.status < 400
+
         import urlgrabber
 
         try:
@@ -140,12 +448,6 @@ class Fetcher:
     def fetch (self):
         """Return value: Fetched file's full path.."""
 
-        # import urlgrabber module
-        try:
-            import urlgrabber
-        except ImportError:
-            raise FetchError(_('Urlgrabber needs to be installed to run this command'))
-
         if not self.url.filename():
             raise FetchError(_('Filename error'))
 
@@ -155,27 +457,194 @@ class Fetcher:
         if os.path.exists(self.archive_file) and not os.access(self.archive_file, os.W_OK):
             raise FetchError(_('Access denied to destination file: "%s"') % (self.archive_file))
 
+        if self.__is_http():
+            try:
+                digest = self.__fetch_http()
+            except (httplib.HTTPException, socket.error), e:
+                raise FetchError(_('Could not fetch destination file "%s": %s') % (self.url.get_uri(), e))
+        else:
+            digest = self.__fetch_urlgrabber()
+
+        if os.stat(self.partial_file).st_size == 0:
+            os.remove(self.partial_file)
+            raise FetchError(_('A problem occurred. Please check the archive address and/or permissions again.'))
+
+        shutil.move(self.partial_file, self.archive_file)
+        if os.path.exists(self.validator_file):
+            os.remove(self.validator_file)
+        if digest:
+            util.record_digest(self.archive_file, digest)
+
+        return self.archive_file
+
+    def __fetch_urlgrabber(self):
+        # import urlgrabber module
+        try:
+            import urlgrabber
+        except ImportError:
+            raise FetchError(_('Urlgrabber needs to be installed to run this command'))
+
+        # No progress is shown if no progress class is given, e.g. while
+        # fetching several files at the same time
+        progress_obj = DigestHandler(self.partial_file,
+                                     self.progress and UIHandler(self.progress))
+
         try:
             urlgrabber.urlgrab(self.url.get_uri(),
                            self.partial_file,
-                           progress_obj = UIHandler(self.progress),
+                           progress_obj = progress_obj,
                            http_headers = self._get_http_headers(),
                            ftp_headers  = self._get_ftp_headers(),
                            proxies      = self._get_proxies(),
-                           throttle     = self._get_bandwith_limit(),
+                           throttle     = self.throttle and self.throttle.share or
+                                          self._get_bandwith_limit(),
                            reget        = self._test_range_support(),
                            copy_local   = 1,
                            user_agent   = 'PiSi Fetcher/' + pisi.__version__)
         except urlgrabber.grabber.URLGrabError, e:
             raise FetchError(_('Could not fetch destination file "%s": %s') % (self.url.get_uri(), e))
 
-        if os.stat(self.partial_file).st_size == 0:
-            os.remove(self.partial_file)
-            raise FetchError(_('A problem occurred. Please check the archive address and/or permissions again.'))
+        return progress_obj.digest()
+
+    # HTTP and HTTPS files are fetched with a FetchSession. A previously
+    # downloaded part of a file is resumed with a conditional range request:
+    # the server sends the rest of the file only if the file still has the
+    # ETag or the modification time it had when the part was downloaded,
+    # and the whole file otherwise.
+
+    def __is_http(self):
+        return self.url.scheme() in ("http", "https")
+
+    def __request(self, method, headers, timeout=None):
+        headers = dict(headers)
+        for name, value in self._get_http_headers():
+            # Encoded credentials end with a newline
+            headers[name] = value.strip()
+        headers["User-Agent"] = 'PiSi Fetcher/' + pisi.__version__
+
+        proxies = self._get_proxies()
+        proxy = proxies.values()[0] if proxies else None
+
+        return (self.session or session()).request(method, self.url.get_uri(),
+                                                   headers, proxy, timeout)
+
+    def __fetch_http(self):
+        headers = {}
+        offset = 0
+        if os.path.exists(self.partial_file):
+            offset = os.path.getsize(self.partial_file)
+            validator = None
+            if os.path.exists(self.validator_file):
+                validator = open(self.validator_file).read().strip()
+
+            if offset and validator:
+                headers["Range"] = "bytes=%d-" % offset
+                headers["If-Range"] = validator
+            else:
+                ctx.ui.debug(_("Previously downloaded part of the file can not be checked. It will be over-written."))
+                offset = 0
+
+        response = self.__request("GET", headers)
+        try:
+            content_range = response.getheader("content-range", "")
+            if response.status == 206 and offset:
+                if not content_range.startswith("bytes %d-" % offset):
+                    raise FetchError(_('Could not fetch destination file "%s": %s')
+                                     % (self.url.get_uri(), _("Invalid range in the response")))
+                return self.__receive(response, offset)
+
+            if response.status == 416 and offset:
+                if content_range == "bytes */%d" % offset:
+                    # The previously downloaded part is the whole file
+                    return self.__receive(None, offset)
+
+                os.remove(self.partial_file)
+                response.close()
+                return self.__fetch_http()
+
+            if response.status == 200:
+                return self.__receive(response, 0)
+
+            raise FetchError(_('Could not fetch destination file "%s": %s')
+                             % (self.url.get_uri(),
+                                "HTTP Error %d: %s" % (response.status, response.reason)))
+        finally:
+            response.close()
+
+    def __receive(self, response, offset):
+        """Write the response after the first offset bytes of the partial
+        file and return the sha1 hash of the file"""
+
+        sha1 = hashlib.sha1()
+        if offset:
+            partial = open(self.partial_file, "rb")
+            try:
+                while partial.tell() < offset:
+                    block = partial.read(min(self.blocksize, offset - partial.tell()))
+                    if not block:
+                        break
+                    sha1.update(block)
+            finally:
+                partial.close()
+
+        if response is None:
+            return sha1.hexdigest()
+
+        if not offset:
+            # Keep the validator of the file for resuming the download
+            validator = response.getheader("etag")
+            if not validator or validator.startswith("W/"):
+                validator = response.getheader("last-modified")
+
+            if validator:
+                open(self.validator_file, "w").write(validator)
+            elif os.path.exists(self.validator_file):
+                os.remove(self.validator_file)
+
+        length = response.getheader("content-length")
+        length = int(length) if length else None
+
+        # No progress is shown if no progress class is given, e.g. while
+        # fetching several files at the same time
+        ui_handler = self.progress and UIHandler(self.progress)
+        if ui_handler:
+            ui_handler.start(self.partial_file, self.url.get_uri(),
+                             os.path.basename(self.partial_file),
+                             length and offset + length, None)
+
+        throttle = self.throttle
+        if throttle is None:
+            limit = self._get_bandwith_limit()
+            throttle = limit and Throttle(limit)
+        received = 0
+
+        output = open(self.partial_file, "ab" if offset else "wb")
+        try:
+            while True:
+                block = response.read(self.blocksize)
+                if not block:
+                    break
 
-        shutil.move(self.partial_file, self.archive_file)
+                output.write(block)
+                sha1.update(block)
+                received += len(block)
 
-        return self.archive_file
+                if ui_handler:
+                    ui_handler.update(offset + received)
+
+                if throttle:
+                    throttle.consume(len(block))
+        finally:
+            output.close()
+
+        if ui_handler:
+            ui_handler.end(offset + received)
+
+        if length is not None and received != length:
+            raise FetchError(_('Could not fetch destination file "%s": %s')
+                             % (self.url.get_uri(), _("Connection closed before the whole file is received")))
+
+        return sha1.hexdigest()
 
     def _get_http_headers(self):
         headers = []
@@ -209,12 +678,10 @@ class Fetcher:
         return proxies
 
     def _get_bandwith_limit(self):
-        bandwidth_limit = ctx.config.options.bandwidth_limit or ctx.config.values.general.bandwidth_limit
-        if bandwidth_limit and bandwidth_limit != "0":
-            ctx.ui.warning(_("Bandwidth usage is limited to %s KB/s") % bandwidth_limit)
-            return 1024 * int(bandwidth_limit)
-        else:
-            return 0
+        limit = bandwidth_limit()
+        if limit:
+            ctx.ui.warning(_("Bandwidth usage is limited to %s KB/s") % (limit / 1024))
+        return limit
 
     def _test_range_support(self):
         if not os.path.exists(self.partial_file):
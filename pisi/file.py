@@ -18,7 +18,9 @@ like all pisi classes, it has been programmed in a non-restrictive way
 """
 
 import os
+import sys
 import shutil
+import hashlib
 
 import gettext
 __trans = gettext.translation('pisi', fallback=True)
@@ -57,6 +59,9 @@ class File:
     COMPRESSION_TYPE_BZ2 = 1
     COMPRESSION_TYPE_XZ = 2
 
+    # Size of the blocks files are processed in
+    blocksize = 256 * 1024
+
     (read, write) = range(2)            # modes
     (detached, whatelse) = range(2)
 
@@ -88,17 +93,86 @@ class File:
         return filename.endswith(tuple(File.__compressed_file_extensions))
 
     @staticmethod
-    def decompress(localfile, compress):
+    def decompress(localfile, compress, sha1sum=None, source=None):
+        """Decompress localfile into the file named without its compression
+        suffix and return the name of that file. The data is decompressed
+        in blocks, so repository indexes are never read into memory.
+
+        If sha1sum is given, the compressed data is verified in the same
+        pass and Error is raised if it does not match. The compressed data
+        is read from source instead of localfile if it is given."""
+
         compress = File.choose_method(localfile, compress)
         if compress == File.COMPRESSION_TYPE_XZ:
             import lzma
-            open(localfile[:-3], "w").write(lzma.LZMAFile(localfile).read())
-            localfile = localfile[:-3]
+            decompressor = lzma.LZMADecompressor()
+            target = localfile[:-3]
         elif compress == File.COMPRESSION_TYPE_BZ2:
             import bz2
-            open(localfile[:-4], "w").write(bz2.BZ2File(localfile).read())
-            localfile = localfile[:-4]
-        return localfile
+            decompressor = bz2.BZ2Decompressor()
+            target = localfile[:-4]
+        else:
+            return localfile
+
+        sha1 = hashlib.sha1()
+        tmpfile = target + ctx.const.temporary_suffix
+        ended = False
+        error = None
+
+        input_file = open(source or localfile, "rb")
+        output = open(tmpfile, "wb")
+        try:
+            try:
+                while True:
+                    raw = input_file.read(File.blocksize)
+                    if not raw:
+                        break
+
+                    sha1.update(raw)
+                    if ended:
+                        continue
+
+                    try:
+                        output.write(decompressor.decompress(raw))
+                    except EOFError:
+                        # Data after the end of the compressed stream
+                        ended = True
+                    except Exception:
+                        # A corrupted file is reported as an integrity
+                        # error if its hash is known
+                        if not sha1sum:
+                            raise
+                        error = sys.exc_info()
+                        ended = True
+
+                if not ended:
+                    # Decompressors refuse more input only after the end
+                    # of the stream, a file cut short is not one
+                    try:
+                        decompressor.decompress("")
+                    except EOFError:
+                        ended = True
+            finally:
+                input_file.close()
+                output.close()
+        except:
+            os.unlink(tmpfile)
+            raise
+
+        if sha1sum and sha1.hexdigest() != sha1sum:
+            os.unlink(tmpfile)
+            raise Error(_("File integrity of %s compromised.") % localfile)
+
+        if error:
+            os.unlink(tmpfile)
+            raise error[0], error[1], error[2]
+
+        if not ended:
+            os.unlink(tmpfile)
+            raise Error(_("%s is truncated.") % localfile)
+
+        os.rename(tmpfile, target)
+        return target
 
     @staticmethod
     def download(uri, transfer_dir = "/tmp", sha1sum = False,
@@ -127,7 +201,7 @@ class File:
             #if os.exists(oldsha1fn):
                 #oldsha1 = file(oldsha1fn).readlines()[0]
             if sha1sum and os.path.exists(origfile):
-                oldsha1 = pisi.util.sha1_file(origfile)
+                oldsha1 = pisi.util.file_digest(origfile)
                 if (newsha1 == oldsha1):
                     # early terminate, we already got it ;)
                     raise AlreadyHaveException(uri, origfile)
@@ -160,13 +234,29 @@ class File:
                 except OSError:
                     pass
 
+        # The hash of a fetched file is computed while it is downloaded
+        digest = pisi.util.recorded_digest(localfile)
+
+        if sha1sum and not digest and File.choose_method(origfile, compress):
+            # Compressed files are verified while they are decompressed
+            try:
+                decompressed = File.decompress(origfile, compress,
+                                               sha1sum=newsha1, source=localfile)
+            except Error:
+                clean_temporary()
+                raise Error(_("File integrity of %s compromised.") % uri)
+
+            shutil.move(localfile, origfile)
+            pisi.util.record_digest(origfile, newsha1)
+            return decompressed
+
         if sha1sum:
-            if (pisi.util.sha1_file(localfile) != newsha1):
+            if ((digest or pisi.util.sha1_file(localfile)) != newsha1):
                 clean_temporary()
                 raise Error(_("File integrity of %s compromised.") % uri)
 
         if check_integrity:
-            shutil.move(localfile, origfile)
+            pisi.util.move_file(localfile, origfile)
             localfile = origfile
 
         localfile = File.decompress(localfile, compress)
@@ -13,38 +13,165 @@
 '''Files module provides access to files.xml. files.xml is generated
 during the build process of a package and used in installation.'''
 
+from xml.parsers import expat
 
-import pisi.pxml.autoxml as autoxml
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.ugettext
 
-class FileInfo:
+import pisi
+import pisi.pxml.xmlfile as xmlfile
+
+# Packages may have tens of thousands of files and the files of the old
+# and the new version of a package are both kept while it is upgraded,
+# so file entries are plain objects with slots instead of autoxml
+# objects, and files.xml is read with expat without building a document.
+# The few distinct types, owners and modes are shared between entries.
+
+class Error(pisi.Error):
+    pass
+
+# Tags of a File node and the FileInfo attributes they are read into,
+# in the order they are written
+FILE_TAGS = (("Path", "path"),
+             ("Type", "type"),
+             ("Size", "size"),
+             ("Uid", "uid"),
+             ("Gid", "gid"),
+             ("Mode", "mode"),
+             ("SHA1Sum", "hash"),
+             ("Permanent", "permanent"))
+
+_attributes = dict(FILE_TAGS)
+_shared = frozenset(("type", "uid", "gid", "mode", "permanent"))
+
+class FileInfo(object):
     """File holds the information for a File node/tag in files.xml"""
 
-    __metaclass__ = autoxml.autoxml
+    __slots__ = tuple(attr for tag, attr in FILE_TAGS)
 
-    t_Path = [ autoxml.String, autoxml.mandatory ]
-    t_Type = [ autoxml.String, autoxml.mandatory ]
-    t_Size = [ autoxml.Long, autoxml.optional ]
-    t_Uid = [ autoxml.String, autoxml.optional ]
-    t_Gid = [ autoxml.String, autoxml.optional ]
-    t_Mode = [ autoxml.String, autoxml.optional ]
-    t_Hash = [ autoxml.String, autoxml.optional, "SHA1Sum" ]
-    t_Permanent = [ autoxml.String, autoxml.optional ]
+    def __init__(self, path=None, type=None, size=None, uid=None, gid=None,
+                 mode=None, hash=None, permanent=None):
+        self.path = path
+        self.type = type
+        self.size = size
+        self.uid = uid
+        self.gid = gid
+        self.mode = mode
+        self.hash = hash
+        self.permanent = permanent
 
     def __str__(self):
         s = "/%s, type: %s, size: %s, sha1sum: %s" %  (self.path, self.type,
                                                       self.size, self.hash)
         return s
 
+    def __eq__(self, other):
+        if not isinstance(other, FileInfo):
+            return False
+        for attr in self.__slots__:
+            if getattr(self, attr) != getattr(other, attr):
+                return False
+        return True
 
-class Files(autoxml.xmlfile.XmlFile):
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
-    __metaclass__ = autoxml.autoxml
+
+class Files(xmlfile.XmlFile):
 
     tag = "Files"
 
-    t_List = [ [FileInfo], autoxml.optional, "File"]
+    def __init__(self, uri=None):
+        xmlfile.XmlFile.__init__(self, self.tag)
+        self.list = []
+        if uri:
+            self.read(uri)
 
     def append(self, fileinfo):
         self.list.append(fileinfo)
 
+    def __decode(self, feed, where):
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.returns_unicode = False
+
+        files = self.list
+        shared = {}
+        tags = []
+        text = []
+        state = {"file": None}
+
+        def start_element(tag, attrs):
+            tags.append(tag)
+            del text[:]
+            if len(tags) == 2 and tag == "File":
+                state["file"] = FileInfo()
+
+        def end_element(tag):
+            depth = len(tags)
+            tags.pop()
+            fileinfo = state["file"]
+            if fileinfo is None:
+                return
+
+            if depth == 3 and tag in _attributes:
+                attr = _attributes[tag]
+                value = "".join(text).strip()
+                if not value:
+                    return
+                if attr == "size":
+                    value = long(value)
+                elif attr in _shared:
+                    value = shared.setdefault(value, value)
+                setattr(fileinfo, attr, value)
+
+            elif depth == 2:
+                if fileinfo.path is None or fileinfo.type is None:
+                    raise Error(_("File '%s' has errors: missing path or type in file entry %d")
+                                    % (where, len(files) + 1))
+                files.append(fileinfo)
+                state["file"] = None
+
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = text.append
+
+        try:
+            feed(parser)
+        except (expat.ExpatError, ValueError):
+            raise Error(_("File '%s' has invalid XML") % where)
+
+    def read(self, path):
+        "read files.xml and decode it into a list of FileInfo objects"
+        try:
+            f = open(path, "rb")
+        except IOError, e:
+            raise Error(_("Unable to read file (%s): %s") % (path, e))
+
+        try:
+            self.__decode(lambda parser: parser.ParseFile(f), path)
+        finally:
+            f.close()
+
+    def parse(self, xml):
+        "parse files.xml string and decode it into a list of FileInfo objects"
+        self.__decode(lambda parser: parser.Parse(xml, True), "files.xml")
+
+    def write(self, uri, tmpDir = '/tmp', sha1sum = False, compress = None, sign = None):
+        "encode the list of FileInfo objects into an XML file"
+        self.newDocument()
+        doc = self.rootNode()
+        for ix, fileinfo in enumerate(self.list):
+            if fileinfo.path is None or fileinfo.type is None:
+                raise Error(_("File '%s' has errors: missing path or type in file entry %d")
+                                % (uri, ix + 1))
+
+            node = doc.insertTag("File")
+            for tag, attr in FILE_TAGS:
+                value = getattr(fileinfo, attr)
+                if value is not None:
+                    node.insertTag(tag).insertData(unicode(value))
 
+        self.writexml(uri, tmpDir, sha1sum=sha1sum, compress=compress, sign=sign)
+        self.unlink()
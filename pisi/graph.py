@@ -103,25 +103,36 @@ class Digraph(object):
                 self.dfs_visit(u, finish_hook)
 
     def dfs_visit(self, u, finish_hook):
+        # The vertices being explored are kept on a stack with their
+        # unexplored adjacent vertices, deep graphs would exceed the
+        # recursion limit otherwise
         self.color[u] = 'g'             # mark green (discovered)
         self.d[u] = self.time = self.time + 1
-        for v in self.adj(u):
-            if self.color[v] == 'w':    # explore unexplored vertices
-                self.p[v] = u
-                self.dfs_visit(v, finish_hook)
-            elif self.color[v] == 'g':  # cycle detected
-                cycle = [u]
-                while self.p[u]:
-                    u = self.p[u]
-                    cycle.append(u)
-                    if self.has_edge(cycle[0], u):
-                        break
-                cycle.reverse()
-                raise CycleException(cycle)
-        self.color[u] = 'b'             # mark black (completed)
-        if finish_hook:
-            finish_hook(u)
-        self.f[u] = self.time = self.time + 1
+        stack = [(u, iter(self.adj(u)))]
+        while stack:
+            u, adjacent = stack[-1]
+            for v in adjacent:
+                if self.color[v] == 'w':    # explore unexplored vertices
+                    self.p[v] = u
+                    self.color[v] = 'g'
+                    self.d[v] = self.time = self.time + 1
+                    stack.append((v, iter(self.adj(v))))
+                    break
+                elif self.color[v] == 'g':  # cycle detected
+                    cycle = [u]
+                    while self.p[u]:
+                        u = self.p[u]
+                        cycle.append(u)
+                        if self.has_edge(cycle[0], u):
+                            break
+                    cycle.reverse()
+                    raise CycleException(cycle)
+            else:
+                stack.pop()
+                self.color[u] = 'b'             # mark black (completed)
+                if finish_hook:
+                    finish_hook(u)
+                self.f[u] = self.time = self.time + 1
 
     def cycle_free(self):
         try:
@@ -131,10 +142,38 @@ class Digraph(object):
             return False
 
     def topological_sort(self):
-        list = []
-        self.dfs(lambda u: list.append(u))
-        list.reverse()
-        return list
+        order = []
+        self.dfs(order.append)
+        order.reverse()
+        return order
+
+    def levels(self):
+        """Returns the vertices in the order of topological_sort grouped
+        in levels. There are no edges between the vertices of a level,
+        and edges only lead to the vertices of the following levels."""
+        indegree = dict((u, 0) for u in self.__v)
+        for u in self.__v:
+            for v in self.__adj[u]:
+                indegree[v] += 1
+
+        levels = []
+        level = [u for u, degree in indegree.iteritems() if degree == 0]
+        count = 0
+        while level:
+            levels.append(level)
+            count += len(level)
+            next_level = []
+            for u in level:
+                for v in self.__adj[u]:
+                    indegree[v] -= 1
+                    if indegree[v] == 0:
+                        next_level.append(v)
+            level = next_level
+
+        if count != len(self.__v):
+            # Report the cycle the way topological_sort does
+            self.dfs()
+        return levels
 
     def id_str(self, u):
         # Graph format only accepts underscores as key values
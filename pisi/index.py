@@ -84,7 +84,11 @@ class Index(xmlfile.XmlFile):
         tmpdir = os.path.join(ctx.config.index_dir(), repo)
         pisi.file.File.check_signature(filename, tmpdir)
 
-    def index(self, repo_uri, skip_sources=False):
+    def index(self, repo_uri, skip_sources=False, previous=None):
+        """Adds the PiSi files under repo_uri to the index. If previous,
+        the result of read_previous_index, is given, the entries of the
+        package and delta files that have not changed since it was
+        written are taken from it."""
         self.repo_dir = repo_uri
 
         packages = []
@@ -140,6 +144,11 @@ class Index(xmlfile.XmlFile):
         except AttributeError:
             obsoletes_list = []
 
+        if previous:
+            previous_packages, index_time = previous
+        else:
+            previous_packages, index_time = {}, None
+
         latest_packages = []
 
         for pkg in util.filter_latest_packages(packages):
@@ -152,72 +161,148 @@ class Index(xmlfile.XmlFile):
                 # with single parameters only. So we have to send our
                 # parameters as a tuple to workaround that
 
-                latest_packages.append((pkg, deltas, repo_uri))
+                latest_packages.append((pkg, deltas, repo_uri,
+                                        previous_packages.get(package_uri(pkg, repo_uri)),
+                                        index_time))
 
         # Before calling pool.map check if list is empty or not: python#12157
         if latest_packages:
-            try:
-                # Add binary packages to index using a process pool
-                self.packages = pool.map(add_package, latest_packages)
-            except:
-                pool.terminate()
-                pool.join()
-                ctx.ui.info("")
-                raise
+            # Only the changed packages are read again
+            reused = map(reuse_package, latest_packages)
+            changed = [params for params, package in zip(latest_packages, reused)
+                            if package is None]
+            if previous:
+                ctx.ui.info(_('%d packages are unchanged since the previous index.')
+                                % (len(latest_packages) - len(changed)))
+
+            added = []
+            if changed:
+                try:
+                    # Add binary packages to index using a process pool
+                    added = pool.map(add_package, changed)
+                except:
+                    pool.terminate()
+                    pool.join()
+                    ctx.ui.info("")
+                    raise
+
+            added = iter(added)
+            self.packages = [added.next() if package is None else package
+                                for package in reused]
 
         ctx.ui.info("")
         pool.close()
         pool.join()
 
+def read_previous_index(path):
+    """Reads an index written before for an incremental run. Returns its
+    package entries by package URI and the time it was written."""
+    index = Index()
+    index.read(path)
+    packages = dict((package.packageURI, package) for package in index.packages)
+    return packages, os.path.getmtime(path)
+
+def package_uri(path, repo_uri):
+    if ctx.config.options and ctx.config.options.absolute_urls:
+        return os.path.realpath(path)
+    return util.removepathprefix(repo_uri, path)
+
+def package_deltas(path, release, deltas):
+    """Yields the paths and source releases of the deltas to the given
+    package"""
+    name, version, pkg_release, distro_id, arch = util.split_package_filename(path)
+
+    for delta_path in deltas:
+        src_release, dst_release, delta_distro_id, delta_arch = \
+                util.split_delta_package_filename(delta_path)[1:]
+
+        # Add only delta to latest build of the package
+        if dst_release != release or \
+                (delta_distro_id, delta_arch) != (distro_id, arch):
+            continue
+
+        yield delta_path, src_release
+
+def unchanged_entry(entry, path, index_time):
+    """Returns the entry of a package or delta in the previous index if
+    its file has the same size and has not been modified since"""
+    if entry is not None:
+        st = os.stat(path)
+        if st.st_size == entry.packageSize and st.st_mtime <= index_time:
+            return entry
+    return None
+
+def previous_delta(package, delta_path, repo_uri, index_time):
+    if package is not None:
+        delta_uri = util.removepathprefix(repo_uri, delta_path)
+        for delta in package.deltaPackages:
+            if delta.packageURI == delta_uri:
+                return unchanged_entry(delta, delta_path, index_time)
+    return None
+
+def reuse_package(params):
+    """Returns the entry of the package in the previous index if neither
+    the package nor its deltas have changed since, None otherwise"""
+    path, deltas, repo_uri, previous, index_time = params
+
+    package = unchanged_entry(previous, path, index_time)
+    if package is None:
+        return None
+
+    delta_entries = []
+    for delta_path, src_release in package_deltas(path, package.release,
+                                                  deltas.get(package.name, [])):
+        delta = previous_delta(package, delta_path, repo_uri, index_time)
+        if delta is None:
+            return None
+        delta_entries.append(delta)
+
+    package.deltaPackages = delta_entries
+    return package
+
 def add_package(params):
     try:
-        path, deltas, repo_uri = params
+        path, deltas, repo_uri, previous, index_time = params
 
         ctx.ui.info("%-80.80s\r" % (_('Adding package to index: %s') %
             os.path.basename(path)), noln = True)
 
-        package = pisi.package.Package(path, 'r')
-        md = package.get_metadata()
-        md.package.packageSize = long(os.path.getsize(path))
-        md.package.packageHash = util.sha1_file(path)
-        if ctx.config.options and ctx.config.options.absolute_urls:
-            md.package.packageURI = os.path.realpath(path)
-        else:
-            md.package.packageURI = util.removepathprefix(repo_uri, path)
-
-        # check package semantics
-        errs = md.errors()
-        if md.errors():
-            ctx.ui.info("")
-            ctx.ui.error(_('Package %s: metadata corrupt, skipping...') % md.package.name)
-            ctx.ui.error(unicode(Error(*errs)))
-        else:
+        package = unchanged_entry(previous, path, index_time)
+        if package is None:
+            md = pisi.package.Package(path, 'r').get_metadata()
+            md.package.packageSize = long(os.path.getsize(path))
+            md.package.packageHash = util.sha1_file(path)
+            md.package.packageURI = package_uri(path, repo_uri)
+
+            # check package semantics
+            errs = md.errors()
+            if md.errors():
+                ctx.ui.info("")
+                ctx.ui.error(_('Package %s: metadata corrupt, skipping...') % md.package.name)
+                ctx.ui.error(unicode(Error(*errs)))
+                return md.package
+
             # No need to carry these with index (#3965)
             md.package.files = None
             md.package.additionalFiles = None
-
-            if md.package.name in deltas:
-                name, version, release, distro_id, arch = \
-                        util.split_package_filename(path)
-
-                for delta_path in deltas[md.package.name]:
-                    src_release, dst_release, delta_distro_id, delta_arch = \
-                            util.split_delta_package_filename(delta_path)[1:]
-
-                    # Add only delta to latest build of the package
-                    if dst_release != md.package.release or \
-                            (delta_distro_id, delta_arch) != (distro_id, arch):
-                        continue
-
-                    delta = metadata.Delta()
-                    delta.packageURI = util.removepathprefix(repo_uri, delta_path)
-                    delta.packageSize = long(os.path.getsize(delta_path))
-                    delta.packageHash = util.sha1_file(delta_path)
-                    delta.releaseFrom = src_release
-
-                    md.package.deltaPackages.append(delta)
-
-        return md.package
+            package = md.package
+
+        delta_entries = []
+        for delta_path, src_release in package_deltas(path, package.release,
+                                                      deltas.get(package.name, [])):
+            # Only the deltas that changed since the previous index are read
+            delta = previous_delta(previous, delta_path, repo_uri, index_time)
+            if delta is None:
+                delta = metadata.Delta()
+                delta.packageURI = util.removepathprefix(repo_uri, delta_path)
+                delta.packageSize = long(os.path.getsize(delta_path))
+                delta.packageHash = util.sha1_file(delta_path)
+                delta.releaseFrom = src_release
+
+            delta_entries.append(delta)
+
+        package.deltaPackages = delta_entries
+        return package
 
     except KeyboardInterrupt:
         # Handle KeyboardInterrupt exception to prevent ugly backtrace of all
@@ -148,61 +148,73 @@ def create_delta_package(old_package, new_package):
 #  Hash not equals                      (these are the deltas)
 #  Hash equal but path different ones   (these are the relocations)
 #  Hash and also path equal ones        (do nothing)
+#
+# Packages may have tens of thousands of files, so the files are indexed
+# by path and by hash once and compared in a single pass over the lists.
+
+class FilesDiff(object):
+    """Differences between the file lists of an old and a new package
+
+    added:              new files with paths not in the old package
+    removed:            old files with paths not in the new package
+    deltas:             new files with contents not in the old package and
+                        directories, the files a delta package has to carry
+    relocations:        (old file, new file) pairs of files that have the
+                        same contents but the new path is not one of the
+                        old paths of these contents
+    permission_changes: new files that have the same contents as an old
+                        file but a different mode"""
+
+    def __init__(self, old_files, new_files):
+        self.added = []
+        self.removed = []
+        self.deltas = []
+        self.relocations = []
+        self.permission_changes = []
+
+        new_paths = set()
+        for f in new_files.list:
+            new_paths.add(f.path)
+
+        old_paths = set()
+        old_by_hash = {}
+        for f in old_files.list:
+            old_paths.add(f.path)
+            old = old_by_hash.get(f.hash)
+            if old is None:
+                old_by_hash[f.hash] = (f, set([f.path]), set([f.mode]))
+            else:
+                old[1].add(f.path)
+                old[2].add(f.mode)
+            if f.path not in new_paths:
+                self.removed.append(f)
+
+        for f in new_files.list:
+            if f.path not in old_paths:
+                self.added.append(f)
+
+            # Directory hashes are None. There was a bug with PolicyKit that
+            # should have an empty directory.
+            old = old_by_hash.get(f.hash)
+            if old is None or f.hash is None:
+                self.deltas.append(f)
+            if old is None:
+                continue
 
-def find_delta(old_files, new_files):
-
-    hashto_files = {}
-    for f in new_files.list:
-        hashto_files.setdefault(f.hash, []).append(f)
-
-    new_hashes = set([f.hash for f in new_files.list])
-    old_hashes = set([f.hash for f in old_files.list])
-    hashes_delta = new_hashes - old_hashes
-
-    deltas = []
-    for h in hashes_delta:
-        deltas.extend(hashto_files[h])
-
-    # Directory hashes are None. There was a bug with PolicyKit that
-    # should have an empty directory.
-    if None in hashto_files:
-        deltas.extend(hashto_files[None])
+            first, paths, modes = old
+            if f.hash and f.path not in paths:
+                self.relocations.append((first, f))
+            if len(modes) > 1 or f.mode not in modes:
+                self.permission_changes.append(f)
 
-    return deltas
+def find_delta(old_files, new_files):
+    return FilesDiff(old_files, new_files).deltas
 
 def find_relocations(oldfiles, newfiles):
-
-    files_new = {}
-    for f in newfiles.list:
-        files_new.setdefault(f.hash, []).append(f)
-
-    files_old = {}
-    for f in oldfiles.list:
-        files_old.setdefault(f.hash, []).append(f)
-
-    relocations = []
-    for h in files_new.keys():
-        if h and h in files_old:
-            old_paths = [x.path for x in files_old[h]]
-            for i in range(len(files_new[h])):
-                if files_new[h][i].path not in old_paths:
-                    relocations.append((files_old[h][0], files_new[h][i]))
-
-    return relocations
+    return FilesDiff(oldfiles, newfiles).relocations
 
 def find_permission_changes(oldfiles, newfiles):
-
-    files_new = {}
-    for f in newfiles.list:
-        files_new.setdefault(f.hash, []).append(f)
-
-    for old_file in oldfiles.list:
-        files = files_new.get(old_file.hash, [])
-
-        for _file in files:
-            if old_file.mode == _file.mode:
-                continue
-
-            path = os.path.join(ctx.config.dest_dir(), _file.path)
-            if os.path.exists(path):
-                yield path, int(_file.mode, 8)
+    for _file in FilesDiff(oldfiles, newfiles).permission_changes:
+        path = os.path.join(ctx.config.dest_dir(), _file.path)
+        if os.path.exists(path):
+            yield path, int(_file.mode, 8)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Concurrent extraction stage of install and upgrade operations"""
+
+import sys
+import Queue
+import threading
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.ugettext
+
+import pisi
+import pisi.context as ctx
+import pisi.util as util
+import pisi.atomicoperations as atomicoperations
+import pisi.db
+
+# Packages are installed in waves of consecutive packages of the order
+# that do not depend on each other. Everything but unpacking the files
+# of the packages of a wave and storing their pisi files runs in the main
+# thread in the order of the packages: checks of all the packages, then
+# removing the replaced packages and the COMAR scripts of the old
+# packages before the wave, removing left over files, COMAR scripts and
+# database updates after it. If a package fails its checks, nothing is
+# changed for any package of the wave.
+#
+# A package starts a new wave if it depends on a package of the wave,
+# if they replace or conflict with each other or if they have common
+# files, old or new, so that extracting a package never touches the
+# files of another one of the same wave.
+
+class _Wave(object):
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.installs = []
+        self.names = set()
+        self.paths = set()
+
+    def __package_paths(self, install):
+        paths = set(f.path for f in install.files.list)
+        installdb = pisi.db.installdb.InstallDB()
+        if installdb.has_package(install.pkginfo.name):
+            paths.update(f.path for f in installdb.get_files(install.pkginfo.name).list)
+        return paths
+
+    def add(self, install, G_f):
+        """Adds the package to the wave if it is independent of the
+        packages of the wave and returns True"""
+        if len(self.installs) >= self.limit:
+            return False
+
+        pkg = install.pkginfo
+        paths = self.__package_paths(install)
+        if self.installs:
+            # Dependencies of packages out of the graph are not known
+            if not G_f.has_vertex(pkg.name):
+                return False
+
+            related = set(G_f.adj(pkg.name))
+            related.update(r.package for r in pkg.replaces)
+            related.update(c.package for c in pkg.conflicts)
+            if related & self.names or not self.paths.isdisjoint(paths):
+                return False
+
+            for name in self.names:
+                if G_f.has_edge(name, pkg.name):
+                    return False
+
+            for other in self.installs:
+                if pkg.name in [r.package for r in other.pkginfo.replaces] or \
+                        pkg.name in [c.package for c in other.pkginfo.conflicts]:
+                    return False
+
+        self.installs.append(install)
+        self.names.add(pkg.name)
+        self.paths.update(paths)
+        return True
+
+def _unpack_worker(queue, errors):
+    while True:
+        try:
+            install = queue.get_nowait()
+        except Queue.Empty:
+            return
+
+        try:
+            install.unpack()
+            install.store_pisi_files()
+        except:
+            errors.append((install, sys.exc_info()))
+
+def install_wave(installs, ask_reinstall, workers):
+    """Install the packages of a wave, extracting them concurrently"""
+
+    if len(installs) == 1:
+        installs[0].install(ask_reinstall)
+        return
+
+    # Nothing is changed unless all the packages of the wave pass
+    # their checks
+    for install in installs:
+        install.check(ask_reinstall)
+
+    for install in installs:
+        install.check_replaces()
+        install.run_old_remove_scripts()
+
+    failed = []
+    ctx.disable_keyboard_interrupts()
+    try:
+        for install in installs:
+            install.prepare_extract()
+
+        queue = Queue.Queue()
+        for install in installs:
+            queue.put(install)
+
+        errors = []
+        threads = []
+        for i in range(min(workers, len(installs))):
+            thread = threading.Thread(target=_unpack_worker, args=(queue, errors))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        # The packages of the wave that were extracted are registered
+        # before an error of another one is raised
+        failed = [install for install, error in errors]
+        for install in installs:
+            if install not in failed:
+                install.finish_extract()
+                install.configure()
+    finally:
+        ctx.enable_keyboard_interrupts()
+
+    for install in installs:
+        if install not in failed:
+            install.notify_installed()
+
+    if errors:
+        exc_type, exc_value, exc_tb = errors[0][1]
+        raise exc_type, exc_value, exc_tb
+
+def install_packages(order, G_f, fetcher, ask_reinstall=False, ignore_file_conflicts=None):
+    """Install the packages in order as soon as they are downloaded.
+    If more than one install worker is configured and the dependency
+    graph G_f is known, independent packages are extracted concurrently."""
+
+    workers = max(1, int(ctx.config.values.general.install_workers))
+
+    def make_install(index):
+        path = fetcher.get(index)
+        ctx.ui.info(util.colorize(_("Installing %d / %d") % (index+1, len(order)), "yellow"))
+        return atomicoperations.Install(path, ignore_file_conflicts = ignore_file_conflicts)
+
+    if workers == 1 or G_f is None:
+        for index in range(len(order)):
+            make_install(index).install(ask_reinstall)
+        return
+
+    # Waves are limited to keep the file lists in memory bounded
+    limit = workers * 4
+    wave = _Wave(limit)
+    for index in range(len(order)):
+        install = make_install(index)
+        if not wave.add(install, G_f):
+            install_wave(wave.installs, ask_reinstall, workers)
+            wave = _Wave(limit)
+            wave.add(install, G_f)
+
+    if wave.installs:
+        install_wave(wave.installs, ask_reinstall, workers)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Concurrent download stage of install and upgrade operations"""
+
+import os
+import sys
+import Queue
+import threading
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.ugettext
+
+import pisi
+import pisi.context as ctx
+import pisi.util as util
+import pisi.uri
+import pisi.package
+import pisi.fetcher
+import pisi.atomicoperations as atomicoperations
+
+class Error(pisi.Error):
+    pass
+
+class _FetchJob(object):
+
+    def __init__(self, index, name, uri, hash):
+        self.index = index
+        self.name = name
+        self.uri = uri
+        self.hash = hash
+        self.path = None
+        self.error = None
+        self.done = threading.Event()
+
+class PackageFetcher(object):
+    """Downloads the packages of an operation with a bounded pool of
+    worker threads and verifies them against the repository hashes.
+
+    Package locations are resolved in the calling thread, workers only
+    deal with the network and the package cache. Packages are fetched
+    in the given order, so a consumer can start working on the first
+    packages with get() while the rest are still being downloaded."""
+
+    def __init__(self, workers=None, connections_per_host=None):
+        general = ctx.config.values.general
+        self.workers = max(1, int(workers or general.fetch_workers))
+        self.connections_per_host = max(1, int(connections_per_host or
+                                               general.fetch_connections_per_host))
+        self.__lock = threading.Lock()
+        self.__host_slots = {}
+        self.__jobs = []
+        self.__queue = Queue.Queue()
+        self.__failure = None
+
+        # The workers share the configured bandwidth
+        limit = pisi.fetcher.bandwidth_limit()
+        self.throttle = None
+        if limit:
+            ctx.ui.warning(_("Bandwidth usage is limited to %s KB/s") % (limit / 1024))
+            self.throttle = pisi.fetcher.Throttle(limit, self.workers)
+
+    def fetch(self, order):
+        """Download the packages in order and return the paths of
+        the verified package files in the same order."""
+
+        if self.workers > 1 and len(order) > 1:
+            self.start(order)
+            return self.get_all()
+
+        self.__jobs = self.__make_jobs(order)
+        for job in self.__jobs:
+            job.path = self.__fetch_job(job, len(self.__jobs))
+            job.done.set()
+
+        return [job.path for job in self.__jobs]
+
+    def start(self, order):
+        """Start downloading the packages in order in the background"""
+
+        self.__jobs = self.__make_jobs(order)
+        for job in self.__jobs:
+            self.__queue.put(job)
+
+        for i in range(min(self.workers, len(self.__jobs))):
+            thread = threading.Thread(target=self.__worker)
+            thread.daemon = True
+            thread.start()
+
+    def get(self, index):
+        """Wait until the package at the given position of the order
+        is downloaded and return its path"""
+
+        job = self.__jobs[index]
+        # Waiting with a timeout keeps the main thread responsive to
+        # keyboard interrupts.
+        while not job.done.isSet():
+            job.done.wait(0.5)
+
+        if job.error:
+            exc_type, exc_value, exc_tb = job.error
+            raise exc_type, exc_value, exc_tb
+
+        return job.path
+
+    def get_all(self):
+        return [self.get(index) for index in range(len(self.__jobs))]
+
+    def cancel(self):
+        """Do not start downloading the packages still waiting in queue"""
+        self.__failure = self.__failure or (Error, Error(_("Download cancelled.")), None)
+
+    def __make_jobs(self, order):
+        return [_FetchJob(index, name, *atomicoperations.Install.locate(name))
+                    for index, name in enumerate(order)]
+
+    def __worker(self):
+        while True:
+            try:
+                job = self.__queue.get_nowait()
+            except Queue.Empty:
+                return
+
+            if self.__failure:
+                # Something went wrong with a previous package. The
+                # consumer can't proceed beyond it, so don't bother.
+                job.error = self.__failure
+            else:
+                try:
+                    job.path = self.__fetch_job(job, len(self.__jobs), False)
+                except:
+                    job.error = sys.exc_info()
+                    self.__failure = job.error
+
+            job.done.set()
+
+    def __host_slot(self, uri):
+        host = uri.location() if uri.is_remote_file() else None
+        with self.__lock:
+            if host not in self.__host_slots:
+                self.__host_slots[host] = threading.BoundedSemaphore(self.connections_per_host)
+            return self.__host_slots[host]
+
+    def __fetch_job(self, job, total, show_progress=True):
+        pkg_path, pkg_hash = job.uri, job.hash
+
+        ctx.ui.info(util.colorize(_("Downloading %d / %d") % (job.index + 1, total), "yellow"))
+
+        # Bug 4113
+        cached_file = pisi.package.Package.is_cached(pkg_path)
+        if cached_file and os.path.exists(cached_file):
+            if util.file_digest(cached_file) == pkg_hash:
+                if cached_file != pkg_path:
+                    ctx.ui.info(_('%s [cached]') % os.path.basename(cached_file))
+                return cached_file
+
+        uri = pisi.uri.URI(pkg_path)
+        if not uri.is_remote_file():
+            raise Error(_("Download Error: Package does not match the repository package."))
+
+        if cached_file:
+            os.unlink(cached_file)
+
+        slot = self.__host_slot(uri)
+        slot.acquire()
+        try:
+            fetcher = pisi.fetcher.Fetcher(uri, ctx.config.cached_packages_dir())
+            fetcher.throttle = self.throttle
+            if show_progress:
+                fetcher.progress = ctx.ui.Progress
+            downloaded_file = fetcher.fetch()
+        finally:
+            slot.release()
+
+        if util.file_digest(downloaded_file) != pkg_hash:
+            raise Error(_("Download Error: Package does not match the repository package."))
+
+        return downloaded_file
+
+def fetch_packages(order):
+    """Start downloading packages of the given order and return the
+    fetcher. Unless pipelined installation is enabled, all packages
+    are downloaded before returning."""
+    fetcher = PackageFetcher()
+    if ctx.config.values.general.pipelined_install and \
+            not ctx.get_option('fetch_only'):
+        fetcher.start(order)
+    else:
+        fetcher.fetch(order)
+    return fetcher
@@ -109,7 +109,7 @@ def calculate_download_sizes(order):
         if cached_packages_dir:
             path = util.join_path(cached_packages_dir, fn)
             # check the file and sha1sum to be sure it _is_ the cached package
-            if os.path.exists(path) and util.sha1_file(path) == pkg_hash:
+            if os.path.exists(path) and util.file_digest(path) == pkg_hash:
                 cached_size += pkg_size
             elif os.path.exists("%s.part" % path):
                 cached_size += os.stat("%s.part" % path).st_size
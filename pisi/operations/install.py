@@ -24,6 +24,7 @@ import pisi.util as util
 import pisi.atomicoperations as atomicoperations
 import pisi.operations as operations
 import pisi.pgraph as pgraph
+import pisi.solver
 import pisi.ui as ui
 import pisi.db
 
@@ -90,23 +91,22 @@ def install_pkg_names(A, reinstall = False):
     if not ctx.get_option('ignore_package_conflicts'):
         conflicts = operations.helper.check_conflicts(order, packagedb)
 
-    paths = []
-    for x in order:
-        ctx.ui.info(util.colorize(_("Downloading %d / %d") % (order.index(x)+1, len(order)), "yellow"))
-        install_op = atomicoperations.Install.from_name(x)
-        paths.append(install_op.package_fname)
+    fetcher = operations.fetch.fetch_packages(order)
 
     # fetch to be installed packages but do not install them.
     if ctx.get_option('fetch_only'):
         return
 
-    if conflicts:
-        operations.remove.remove_conflicting_packages(conflicts)
+    try:
+        if conflicts:
+            # Nothing is removed unless all packages could be downloaded
+            fetcher.get_all()
+            operations.remove.remove_conflicting_packages(conflicts)
 
-    for path in paths:
-        ctx.ui.info(util.colorize(_("Installing %d / %d") % (paths.index(path)+1, len(paths)), "yellow"))
-        install_op = atomicoperations.Install(path)
-        install_op.install(False)
+        # packages are installed as soon as they are downloaded
+        operations.extract.install_packages(order, G_f, fetcher, False)
+    finally:
+        fetcher.cancel()
 
     return True
 
@@ -254,35 +254,9 @@ def install_pkg_files(package_URIs, reinstall = False):
     return True
 
 def plan_install_pkg_names(A):
-    # try to construct a pisi graph of packages to
-    # install / reinstall
-
-    packagedb = pisi.db.packagedb.PackageDB()
-
-    G_f = pgraph.PGraph(packagedb)               # construct G_f
-
-    # find the "install closure" graph of G_f by package
-    # set A using packagedb
-    for x in A:
-        G_f.add_package(x)
-    B = A
-
-    while len(B) > 0:
-        Bp = set()
-        for x in B:
-            pkg = packagedb.get_package(x)
-            for dep in pkg.runtimeDependencies():
-                ctx.ui.debug('checking %s' % str(dep))
-                # we don't deal with already *satisfied* dependencies
-                if not dep.satisfied_by_installed():
-                    if not dep.satisfied_by_repo():
-                        raise pisi.Error(_('%s dependency of package %s is not satisfied') % (dep, pkg.name))
-                    if not dep.package in G_f.vertices():
-                        Bp.add(str(dep.package))
-                    G_f.add_dep(x, dep)
-        B = Bp
+    # construct a pisi graph of packages to install / reinstall and
+    # find the "install closure" of package set A on the package graph
+    G_f, order = pisi.solver.Solver().plan_install(A)
     if ctx.config.get_option('debug'):
         G_f.write_graphviz(sys.stdout)
-    order = G_f.topological_sort()
-    order.reverse()
     return G_f, order
@@ -19,7 +19,7 @@ _ = __trans.ugettext
 import pisi
 import pisi.context as ctx
 import pisi.atomicoperations as atomicoperations
-import pisi.pgraph as pgraph
+import pisi.solver
 import pisi.util as util
 import pisi.ui as ui
 import pisi.db
@@ -85,44 +85,24 @@ in the respective order to satisfy dependencies:
             ctx.ui.info(_('Package %s is not installed. Cannot remove.') % x)
 
 def plan_remove(A):
-    # try to construct a pisi graph of packages to
-    # install / reinstall
-
-    installdb = pisi.db.installdb.InstallDB()
-
-    G_f = pgraph.PGraph(installdb)               # construct G_f
-
-    # find the (install closure) graph of G_f by package
-    # set A using packagedb
-    for x in A:
-        G_f.add_package(x)
-    B = A
-    while len(B) > 0:
-        Bp = set()
-        for x in B:
-            rev_deps = installdb.get_rev_deps(x)
-            for (rev_dep, depinfo) in rev_deps:
-                # we don't deal with uninstalled rev deps
-                # and unsatisfied dependencies (this is important, too)
-                # satisfied_by_any_installed_other_than is for AnyDependency
-                if installdb.has_package(rev_dep) and depinfo.satisfied_by_installed() and not depinfo.satisfied_by_any_installed_other_than(x):
-                    if not rev_dep in G_f.vertices():
-                        Bp.add(rev_dep)
-                        G_f.add_plain_dep(rev_dep, x)
-        B = Bp
+    # construct a pisi graph of packages to remove and find the
+    # closure of package set A on the installed packages
+    G_f, order = pisi.solver.Solver().plan_remove(A)
     if ctx.config.get_option('debug'):
         G_f.write_graphviz(sys.stdout)
-    order = G_f.topological_sort()
     return G_f, order
 
 def remove_conflicting_packages(conflicts):
     if remove(conflicts, ignore_dep=True, ignore_safety=True):
         raise Exception(_("Conflicts remain"))
 
-def remove_obsoleted_packages():
+def get_obsoleted_packages():
     installdb = pisi.db.installdb.InstallDB()
     packagedb = pisi.db.packagedb.PackageDB()
-    obsoletes = filter(installdb.has_package, packagedb.get_obsoletes())
+    return filter(installdb.has_package, packagedb.get_obsoletes())
+
+def remove_obsoleted_packages():
+    obsoletes = get_obsoleted_packages()
     if obsoletes:
         if remove(obsoletes, ignore_dep=True, ignore_safety=True):
             raise Exception(_("Obsoleted packages remaining"))
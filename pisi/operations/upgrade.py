@@ -19,7 +19,7 @@ _ = __trans.ugettext
 import pisi
 import pisi.ui as ui
 import pisi.context as ctx
-import pisi.pgraph as pgraph
+import pisi.solver
 import pisi.atomicoperations as atomicoperations
 import pisi.operations as operations
 import pisi.util as util
@@ -88,22 +88,26 @@ def find_upgrades(packages, replaces):
             ctx.ui.info(_('Package %s is not available in repositories.') % i_pkg, True)
             continue
 
-        pkg = packagedb.get_package(i_pkg)
-        (version, release, build, distro, distro_release) = installdb.get_version_and_distro_release(i_pkg)
+        # The entries hold the parsed versions, packages are only decoded
+        # to look for security updates
+        entry = packagedb.get_entry(i_pkg)
+        info = installdb.get_package_info(i_pkg)
+        release = info.release
 
-        if security_only and not pkg.has_update_type("security", release):
+        if security_only and not packagedb.get_package(i_pkg).has_update_type("security", release):
             continue
 
-        if pkg.distribution == distro and \
-                pisi.version.make_version(pkg.distributionRelease) > pisi.version.make_version(distro_release):
+        if entry.distribution == info.distribution and \
+                (entry.distribution_release_key or pisi.version.make_version(entry.distribution_release)) > \
+                (info.distribution_release_key or pisi.version.make_version(info.distribution_release)):
             Ap.append(i_pkg)
 
         else:
-            if int(release) < int(pkg.release):
+            if int(release) < int(entry.release):
                 Ap.append(i_pkg)
             else:
                 ctx.ui.info(_('Package %s is already at the latest release %s.')
-                            % (pkg.name, pkg.release), True)
+                            % (i_pkg, entry.release), True)
 
     return Ap
 
@@ -187,25 +191,27 @@ def upgrade(A=[], repo=None):
     if not ctx.get_option('ignore_package_conflicts'):
         conflicts = operations.helper.check_conflicts(order, packagedb)
 
-    paths = []
-    for x in order:
-        ctx.ui.info(util.colorize(_("Downloading %d / %d") % (order.index(x)+1, len(order)), "yellow"))
-        install_op = atomicoperations.Install.from_name(x)
-        paths.append(install_op.package_fname)
+    fetcher = operations.fetch.fetch_packages(order)
 
     # fetch to be upgraded packages but do not install them.
     if ctx.get_option('fetch_only'):
         return
 
-    if conflicts:
-        operations.remove.remove_conflicting_packages(conflicts)
+    try:
+        if conflicts or operations.remove.get_obsoleted_packages():
+            # Nothing is removed unless all packages could be downloaded
+            fetcher.get_all()
+
+        if conflicts:
+            operations.remove.remove_conflicting_packages(conflicts)
 
-    operations.remove.remove_obsoleted_packages()
+        operations.remove.remove_obsoleted_packages()
 
-    for path in paths:
-        ctx.ui.info(util.colorize(_("Installing %d / %d") % (paths.index(path)+1, len(paths)), "yellow"))
-        install_op = atomicoperations.Install(path, ignore_file_conflicts = True)
-        install_op.install(True)
+        # packages are installed as soon as they are downloaded
+        operations.extract.install_packages(order, G_f, fetcher, True,
+                                            ignore_file_conflicts = True)
+    finally:
+        fetcher.cancel()
 
 def plan_upgrade(A, force_replaced=True, replaces=None):
     # FIXME: remove force_replaced
@@ -214,8 +220,6 @@ def plan_upgrade(A, force_replaced=True, replaces=None):
 
     packagedb = pisi.db.packagedb.PackageDB()
 
-    G_f = pgraph.PGraph(packagedb)               # construct G_f
-
     A = set(A)
 
     # Force upgrading of installed but replaced packages or else they will be removed (they are obsoleted also).
@@ -228,113 +232,13 @@ def plan_upgrade(A, force_replaced=True, replaces=None):
             replaces = packagedb.get_replaces()
         A |= set(pisi.util.flatten_list(replaces.values()))
 
-    # find the "install closure" graph of G_f by package
-    # set A using packagedb
-    for x in A:
-        G_f.add_package(x)
-
-    installdb = pisi.db.installdb.InstallDB()
-
-    def add_runtime_deps(pkg, Bp):
-        for dep in pkg.runtimeDependencies():
-            # add packages that can be upgraded
-            if installdb.has_package(dep.package) and dep.satisfied_by_installed():
-                continue
-
-            if dep.satisfied_by_repo():
-                if not dep.package in G_f.vertices():
-                    Bp.add(str(dep.package))
-
-                # Always add the dependency info although the dependant
-                # package is already a member of this graph. Upgrade order
-                # might change if the dependency info differs from the
-                # previous ones.
-                G_f.add_dep(pkg.name, dep)
-            else:
-                ctx.ui.error(_('Dependency %s of %s cannot be satisfied') % (dep, pkg.name))
-                raise Exception(_("Upgrade is not possible."))
-
-    def add_resolvable_conflicts(pkg, Bp):
-        """Try to resolve conflicts by upgrading
-
-        If a package B conflicts with an old version of package A and
-        does not conflict with the new version of A, add A to the upgrade list.
-        """
-        for conflict in pkg.conflicts:
-            if conflict.package in G_f.vertices():
-                # Conflicting package is already in the upgrade list.
-                continue
-
-            if not pisi.conflict.installed_package_conflicts(conflict):
-                # Conflicting package is not installed.
-                # No need to deal with it.
-                continue
-
-            if not packagedb.has_package(conflict.package):
-                # Conflicting package is not available in repo.
-                # Installed package will be removed.
-                continue
-
-            new_pkg = packagedb.get_package(conflict.package)
-            if conflict.satisfies_relation(new_pkg.version, new_pkg.release):
-                # Package still conflicts with the repo package.
-                # Installed package will be removed.
-                continue
-
-            # Upgrading the package will resolve conflict.
-            # Add it to the upgrade list.
-            Bp.add(conflict.package)
-            G_f.add_package(conflict.package)
-
-    def add_broken_revdeps(pkg, Bp):
-        # Search reverse dependencies to see if anything
-        # should be upgraded
-        rev_deps = installdb.get_rev_deps(pkg.name)
-        for rev_dep, depinfo in rev_deps:
-            # add only installed but unsatisfied reverse dependencies
-            if rev_dep in G_f.vertices() or depinfo.satisfied_by_repo():
-                continue
-
-            if is_upgradable(rev_dep):
-                Bp.add(rev_dep)
-                G_f.add_plain_dep(rev_dep, pkg.name)
-
-    def add_needed_revdeps(pkg, Bp):
-        # Search for reverse dependency update needs of to be upgraded packages
-        # check only the installed ones.
-        version, release, build = installdb.get_version(pkg.name)
-        actions = pkg.get_update_actions(release)
-
-        packages = actions.get("reverseDependencyUpdate")
-        if packages:
-            for target_package in packages:
-                for name, dep in installdb.get_rev_deps(target_package):
-                    if name in G_f.vertices() or not is_upgradable(name):
-                        continue
-
-                    Bp.add(name)
-                    G_f.add_plain_dep(name, target_package)
-
-    while A:
-        Bp = set()
-
-        for x in A:
-            pkg = packagedb.get_package(x)
-
-            add_runtime_deps(pkg, Bp)
-            add_resolvable_conflicts(pkg, Bp)
-
-            if installdb.has_package(x):
-                add_broken_revdeps(pkg, Bp)
-                add_needed_revdeps(pkg, Bp)
-
-        A = Bp
+    # find the "install closure" graph of G_f by package set A on the
+    # package graph
+    G_f, order = pisi.solver.Solver().plan_upgrade(A)
 
     if ctx.config.get_option('debug'):
         G_f.write_graphviz(sys.stdout)
 
-    order = G_f.topological_sort()
-    order.reverse()
     return G_f, order
 
 def upgrade_base(A = set()):
@@ -373,25 +277,5 @@ def upgrade_base(A = set()):
     return set()
 
 def is_upgradable(name):
-
-    installdb = pisi.db.installdb.InstallDB()
-
-    if not installdb.has_package(name):
-        return False
-
-    (i_version, i_release, i_build, i_distro, i_distro_release) = installdb.get_version_and_distro_release(name)
-
-    packagedb = pisi.db.packagedb.PackageDB()
-
-    try:
-        version, release, build, distro, distro_release = packagedb.get_version_and_distro_release(name, packagedb.which_repo(name))
-    except KeyboardInterrupt:
-        raise
-    except Exception: #FIXME: what exception could we catch here, replace with that.
-        return False
-
-    if distro == i_distro and \
-            pisi.version.make_version(distro_release) > pisi.version.make_version(i_distro_release):
-        return True
-
-    return int(i_release) < int(release)
+    solver = pisi.solver.Solver()
+    return solver.is_upgradable(solver.graph.vertex(str(name)))
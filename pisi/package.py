@@ -214,9 +214,10 @@ class Package:
                 # 
                 # Also, tar.extract() doesn't write on symlinks... Not any
                 # more :).
-                if os.path.isfile(tarinfo.name) or os.path.islink(tarinfo.name):
+                path = os.path.join(outdir, tarinfo.name)
+                if os.path.isfile(path) or os.path.islink(path):
                     try:
-                        os.unlink(tarinfo.name)
+                        os.unlink(path)
                     except OSError, e:
                         ctx.ui.warning(e)
 
@@ -54,11 +54,43 @@ class Relation:
 
         return True
 
+def satisfies_constraints(constraints, version, release, version_key=None):
+    """Relation.satisfies_relation for the (attribute, value) constraint
+    pairs of a dependency tuple. version_key is the parsed version, if
+    it is known."""
+    constraints = dict(constraints)
+
+    if constraints.get("version"):
+        if version != constraints["version"]:
+            return False
+    elif constraints.get("versionFrom") or constraints.get("versionTo"):
+        v = version_key or pisi.version.make_version(version)
+
+        if constraints.get("versionFrom") and \
+                v < pisi.version.make_version(constraints["versionFrom"]):
+            return False
+
+        if constraints.get("versionTo") and \
+                v > pisi.version.make_version(constraints["versionTo"]):
+            return False
+
+    if constraints.get("release"):
+        if release != constraints["release"]:
+            return False
+    else:
+        if constraints.get("releaseFrom") and int(release) < int(constraints["releaseFrom"]):
+            return False
+
+        if constraints.get("releaseTo") and int(release) > int(constraints["releaseTo"]):
+            return False
+
+    return True
+
 def installed_package_satisfies(relation):
     installdb = pisi.db.installdb.InstallDB()
     pkg_name = relation.package
     if not installdb.has_package(pkg_name):
         return False
     else:
-        pkg = installdb.get_package(pkg_name)
-        return relation.satisfies_relation(pkg.version, pkg.release)
+        version, release, build = installdb.get_version(pkg_name)
+        return relation.satisfies_relation(version, release)
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+"""Dependency solver working on a numbered graph of the repository packages"""
+
+import gettext
+__trans = gettext.translation('pisi', fallback=True)
+_ = __trans.ugettext
+
+import pisi
+import pisi.context as ctx
+import pisi.pgraph as pgraph
+import pisi.version
+import pisi.relation
+import pisi.dependency
+import pisi.db
+
+# The vertices of the graph are the packages of the repositories and the
+# packages their dependencies name, numbered in the order they are met.
+# The graph is built from the PackageEntry tables of PackageDB once for
+# the database, the installed packages are looked up in InstallDB by the
+# solver of each operation.
+#
+# Dependencies are kept as the tuples of the database tables, a tuple of
+# tuples is an AnyDependency. Like the package graphs the planners used
+# to build, an AnyDependency leads to its first alternative.
+
+def is_any_dependency(dep):
+    return isinstance(dep[0], tuple)
+
+def dependency_package(dep):
+    if is_any_dependency(dep):
+        return dep[0][0]
+    return dep[0]
+
+class PackageGraph(object):
+    """Numbered dependency graph of the repository packages"""
+
+    def __init__(self, packagedb):
+        self.names = []
+        self.ids = {}
+        self.entries = []
+        self.__adjacency = []
+        self.__reverse = None
+        self.__satisfied = {}
+
+        # Repositories are in the order of their priority, the package of
+        # the first one having it is used as everywhere else.
+        for table in packagedb.gdb.get_repo_tables():
+            for name, entry in table.iteritems():
+                vertex = self.vertex(name)
+                if self.entries[vertex] is None:
+                    self.entries[vertex] = entry
+
+    def vertex(self, name):
+        """Returns the number of a package, numbering it if it is new"""
+        vertex = self.ids.get(name)
+        if vertex is None:
+            vertex = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.entries.append(None)
+            self.__adjacency.append(None)
+        return vertex
+
+    def has_package(self, vertex):
+        return self.entries[vertex] is not None
+
+    def entry(self, vertex):
+        entry = self.entries[vertex]
+        if entry is None:
+            raise Exception(_("Repo item %s not found") % self.names[vertex])
+        return entry
+
+    def dependencies(self, vertex):
+        """Returns the runtime dependencies of a repository package as
+        (dependency, vertex) pairs"""
+        adjacency = self.__adjacency[vertex]
+        if adjacency is None:
+            entry = self.entry(vertex)
+            deps = list(entry.dependencies)
+            if entry.components:
+                componentdb = pisi.db.componentdb.ComponentDB()
+                for component in entry.components:
+                    for name in componentdb.get_component(component).packages:
+                        deps.append((name, ()))
+
+            adjacency = [(dep, self.vertex(dependency_package(dep))) for dep in deps]
+            self.__adjacency[vertex] = adjacency
+        return adjacency
+
+    def reverse_dependencies(self, vertex):
+        """Returns the repository packages depending on a package as
+        (vertex, dependency) pairs. AnyDependencies are left out as in
+        the reverse dependency tables of PackageDB."""
+        if self.__reverse is None:
+            self.__reverse = {}
+            for dependant in xrange(len(self.entries)):
+                if self.entries[dependant] is None:
+                    continue
+                for dep, target in self.dependencies(dependant):
+                    if not is_any_dependency(dep):
+                        self.__reverse.setdefault(target, []).append((dependant, dep))
+        return self.__reverse.get(vertex, [])
+
+    def satisfied_by_repo(self, dep):
+        satisfied = self.__satisfied.get(dep)
+        if satisfied is None:
+            if is_any_dependency(dep):
+                satisfied = any(map(self.satisfied_by_repo, dep))
+            else:
+                name, constraints = dep
+                entry = self.entries[self.vertex(name)]
+                satisfied = entry is not None and \
+                    pisi.relation.satisfies_constraints(constraints, entry.version,
+                                                        entry.release, entry.version_key)
+            self.__satisfied[dep] = satisfied
+        return satisfied
+
+    def update_actions(self, vertex, old_release):
+        """Package.get_update_actions of a repository package"""
+        name = self.names[vertex]
+        actions = {}
+        for release, requires in self.entry(vertex).updates:
+            if release == old_release:
+                break
+
+            for action, package, target in requires:
+                if package and package != name:
+                    continue
+                actions.setdefault(action, set()).add(target or name)
+
+        return actions
+
+class Solver(object):
+    """Plans the install, upgrade and remove operations on the package
+    graph and the installed packages. A solver is for one operation, the
+    installed packages are not expected to change while it is used."""
+
+    def __init__(self):
+        self.packagedb = pisi.db.packagedb.PackageDB()
+        self.installdb = pisi.db.installdb.InstallDB()
+        self.graph = self.packagedb.get_package_graph()
+        self.__installed = {}
+        self.__satisfied = {}
+
+    def installed_version(self, name):
+        """Returns the version, release and version key of an installed
+        package, or None if it is not installed"""
+        try:
+            return self.__installed[name]
+        except KeyError:
+            version = None
+            if self.installdb.has_package(name):
+                info = self.installdb.get_package_info(name)
+                version = (info.version, info.release, info.version_key)
+            self.__installed[name] = version
+            return version
+
+    def satisfied_by_installed(self, dep):
+        satisfied = self.__satisfied.get(dep)
+        if satisfied is None:
+            if is_any_dependency(dep):
+                satisfied = any(map(self.satisfied_by_installed, dep))
+            else:
+                name, constraints = dep
+                version = self.installed_version(name)
+                satisfied = version is not None and \
+                    pisi.relation.satisfies_constraints(constraints, *version)
+            self.__satisfied[dep] = satisfied
+        return satisfied
+
+    def satisfied_by_any_installed_other_than(self, dep, package):
+        if not is_any_dependency(dep):
+            return False
+        return any(alternative[0] != package and self.satisfied_by_installed(alternative)
+                    for alternative in dep)
+
+    def is_upgradable(self, vertex):
+        """operations.upgrade.is_upgradable of a package"""
+        name = self.graph.names[vertex]
+        if not self.installdb.has_package(name) or not self.graph.has_package(vertex):
+            return False
+
+        info = self.installdb.get_package_info(name)
+        entry = self.graph.entries[vertex]
+        if entry.distribution == info.distribution and \
+                (entry.distribution_release_key or pisi.version.make_version(entry.distribution_release)) > \
+                (info.distribution_release_key or pisi.version.make_version(info.distribution_release)):
+            return True
+
+        return int(info.release) < int(entry.release)
+
+    def __add_repo_vertex(self, G_f, vertex):
+        name = self.graph.names[vertex]
+        if not G_f.has_vertex(name):
+            entry = self.graph.entry(vertex)
+            G_f.add_vertex(name, (entry.version, entry.release))
+
+    def __add_installed_vertex(self, G_f, name):
+        if not G_f.has_vertex(name):
+            info = self.installdb.get_package_info(name)
+            G_f.add_vertex(name, (info.version, info.release))
+
+    def __add_dep(self, G_f, vertex, dep, target):
+        self.__add_repo_vertex(G_f, vertex)
+        self.__add_repo_vertex(G_f, target)
+        G_f.add_edge(self.graph.names[vertex], self.graph.names[target],
+                     ('d', pisi.dependency.from_tuple(dep)))
+
+    def __add_plain_dep(self, G_f, vertex, target):
+        self.__add_repo_vertex(G_f, vertex)
+        self.__add_repo_vertex(G_f, target)
+        G_f.add_edge(self.graph.names[vertex], self.graph.names[target], ('d', None))
+
+    def __vertices(self, names):
+        return set(self.graph.vertex(str(name)) for name in names)
+
+    def plan_install(self, A):
+        """Returns the graph and order of the packages to install for
+        installing packages A"""
+        G_f = pgraph.PGraph(self.packagedb)
+        names = self.graph.names
+
+        B = self.__vertices(A)
+        for x in B:
+            self.__add_repo_vertex(G_f, x)
+
+        while B:
+            Bp = set()
+            for x in B:
+                for dep, target in self.graph.dependencies(x):
+                    # we don't deal with already *satisfied* dependencies
+                    if self.satisfied_by_installed(dep):
+                        continue
+                    if not self.graph.satisfied_by_repo(dep):
+                        raise pisi.Error(_('%s dependency of package %s is not satisfied') %
+                                         (pisi.dependency.from_tuple(dep), names[x]))
+                    if not G_f.has_vertex(names[target]):
+                        Bp.add(target)
+                    self.__add_dep(G_f, x, dep, target)
+            B = Bp
+
+        order = G_f.topological_sort()
+        order.reverse()
+        return G_f, order
+
+    def plan_upgrade(self, A):
+        """Returns the graph and order of the packages to install for
+        upgrading packages A"""
+        G_f = pgraph.PGraph(self.packagedb)
+        names = self.graph.names
+        revdeps = self.installdb.rev_deps_db
+
+        A = self.__vertices(A)
+        for x in A:
+            self.__add_repo_vertex(G_f, x)
+
+        def add_runtime_deps(x, Bp):
+            for dep, target in self.graph.dependencies(x):
+                # add packages that can be upgraded
+                if self.installdb.has_package(names[target]) and self.satisfied_by_installed(dep):
+                    continue
+
+                if self.graph.satisfied_by_repo(dep):
+                    if not G_f.has_vertex(names[target]):
+                        Bp.add(target)
+
+                    # Always add the dependency info although the dependant
+                    # package is already a member of this graph. Upgrade order
+                    # might change if the dependency info differs from the
+                    # previous ones.
+                    self.__add_dep(G_f, x, dep, target)
+                else:
+                    ctx.ui.error(_('Dependency %s of %s cannot be satisfied') %
+                                 (pisi.dependency.from_tuple(dep), names[x]))
+                    raise Exception(_("Upgrade is not possible."))
+
+        def add_resolvable_conflicts(x, Bp):
+            # If a package conflicts with an old version of package A and
+            # does not conflict with the new version of A, upgrade A.
+            for conflict in self.graph.entry(x).conflicts:
+                name, constraints = conflict
+                if G_f.has_vertex(name) or not self.satisfied_by_installed(conflict):
+                    continue
+
+                target = self.graph.vertex(name)
+                if not self.graph.has_package(target):
+                    # Installed package will be removed.
+                    continue
+
+                if self.graph.satisfied_by_repo(conflict):
+                    # Package still conflicts with the repo package.
+                    continue
+
+                Bp.add(target)
+                self.__add_repo_vertex(G_f, target)
+
+        def add_broken_revdeps(x, Bp):
+            # add only installed but unsatisfied reverse dependencies
+            for rev_dep, dep in revdeps.get(names[x], {}).iteritems():
+                if G_f.has_vertex(rev_dep) or self.graph.satisfied_by_repo(dep):
+                    continue
+
+                vertex = self.graph.vertex(rev_dep)
+                if self.is_upgradable(vertex):
+                    Bp.add(vertex)
+                    self.__add_plain_dep(G_f, vertex, x)
+
+        def add_needed_revdeps(x, Bp):
+            # Search for reverse dependency update needs of to be upgraded
+            # packages, check only the installed ones.
+            release = self.installed_version(names[x])[1]
+            actions = self.graph.update_actions(x, release)
+
+            for target_package in actions.get("reverseDependencyUpdate", ()):
+                for rev_dep in revdeps.get(target_package, {}):
+                    vertex = self.graph.vertex(rev_dep)
+                    if G_f.has_vertex(rev_dep) or not self.is_upgradable(vertex):
+                        continue
+
+                    Bp.add(vertex)
+                    self.__add_plain_dep(G_f, vertex, self.graph.vertex(target_package))
+
+        while A:
+            Bp = set()
+
+            for x in A:
+                add_runtime_deps(x, Bp)
+                add_resolvable_conflicts(x, Bp)
+
+                if self.installdb.has_package(names[x]):
+                    add_broken_revdeps(x, Bp)
+                    add_needed_revdeps(x, Bp)
+
+            A = Bp
+
+        order = G_f.topological_sort()
+        order.reverse()
+        return G_f, order
+
+    def plan_remove(self, A):
+        """Returns the graph and order of the packages to remove for
+        removing packages A"""
+        G_f = pgraph.PGraph(self.installdb)
+        revdeps = self.installdb.rev_deps_db
+
+        B = set(str(x) for x in A)
+        for x in B:
+            self.__add_installed_vertex(G_f, x)
+
+        while B:
+            Bp = set()
+            for x in B:
+                for rev_dep, dep in revdeps.get(x, {}).iteritems():
+                    # we don't deal with uninstalled rev deps and
+                    # unsatisfied dependencies (this is important, too)
+                    if G_f.has_vertex(rev_dep) or not self.installdb.has_package(rev_dep):
+                        continue
+
+                    if self.satisfied_by_installed(dep) and \
+                            not self.satisfied_by_any_installed_other_than(dep, x):
+                        Bp.add(rev_dep)
+                        self.__add_installed_vertex(G_f, rev_dep)
+                        G_f.add_edge(rev_dep, x, ('d', None))
+            B = Bp
+
+        order = G_f.topological_sort()
+        return G_f, order
+
+    def package_graph(self, A, ignore_installed=False, reverse=False):
+        """Returns the graph of the dependencies of packages A, or of the
+        packages depending on them if reverse is True"""
+        G_f = pgraph.PGraph(self.packagedb)
+        names = self.graph.names
+
+        B = self.__vertices(A)
+        for x in B:
+            self.__add_repo_vertex(G_f, x)
+
+        while B:
+            Bp = set()
+            for x in B:
+                if reverse:
+                    edges = [(dependant, dep, dependant, x)
+                                for dependant, dep in self.graph.reverse_dependencies(x)]
+                else:
+                    edges = [(target, dep, x, target)
+                                for dep, target in self.graph.dependencies(x)]
+
+                for vertex, dep, source, target in edges:
+                    if ignore_installed and self.satisfied_by_installed(dep):
+                        continue
+                    if not G_f.has_vertex(names[vertex]):
+                        Bp.add(vertex)
+                    self.__add_dep(G_f, source, dep, target)
+            B = Bp
+
+        return G_f
@@ -26,6 +26,7 @@ import statvfs
 import termios
 import operator
 import subprocess
+import collections
 import unicodedata
 
 import gettext
@@ -43,6 +44,49 @@ class Singleton(type):
 
         return cls.instance
 
+class LRUCache(object):
+    """Mapping of a limited total size that drops the least recently used
+    items first when it is full. The size of an item is given when it is
+    added."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.__items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.__items)
+
+    def get(self, key, default=None):
+        try:
+            item = self.__items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.__items[key] = item
+        self.hits += 1
+        return item[0]
+
+    def put(self, key, value, size=1):
+        if key in self.__items:
+            self.size -= self.__items.pop(key)[1]
+
+        if size > self.limit:
+            return
+
+        self.__items[key] = (value, size)
+        self.size += size
+        while self.size > self.limit:
+            old_value, old_size = self.__items.popitem(last=False)[1]
+            self.size -= old_size
+
+    def clear(self):
+        self.__items.clear()
+        self.size = 0
+
 # pisi modules
 import pisi
 import pisi.context as ctx
@@ -452,7 +496,187 @@ def get_file_hashes(top, excludePrefix=None, removePrefix=None):
 
 def check_file_hash(filename, hash):
     """Check the file's integrity with a given hash."""
-    return sha1_file(filename) == hash
+    return file_digest(filename) == hash
+
+# The sha1 hashes of downloaded files are computed while they are fetched
+# and kept in a digest cache, so that checking a cached package or source
+# archive does not read it again. The hashes are keyed by the device, the
+# inode, the size and the modification time of the files, so a record is
+# valid as long as the file is not changed or replaced. Hashes computed for
+# the files of the package and source archive caches are recorded as well.
+#
+# The digest cache is a text file of "device inode size mtime_ns sha1 path"
+# lines. It is read under a shared lock, and changes are appended to it
+# under an exclusive one; the last line of a name wins. Records of files
+# that were removed or changed are only dropped when the file is compacted,
+# by prune() or once it grows beyond compact_size (1 MB).
+
+class DigestCache(object):
+    """Persistent mapping of file identities to their sha1 hashes.
+
+    Changes are appended to the cache file as lines of the file identity,
+    the hash and the name of the file, or "-" in place of the hash to
+    forget the hash of a name. The last line of a name wins. Lines of
+    files that changed or were removed are dropped when the file is
+    compacted by prune, or when it grows beyond compact_size."""
+
+    compact_size = 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+        self.records = {}
+
+    @staticmethod
+    def key(filename):
+        st = os.stat(filename)
+        return (st.st_dev, st.st_ino, st.st_size, long(st.st_mtime * 1000000000))
+
+    def __parse(self, cache):
+        records = {}
+        for line in cache:
+            # Skip the partial line of an interrupted write
+            if not line.endswith("\n"):
+                continue
+            fields = line[:-1].split(" ", 5)
+            if len(fields) != 6:
+                continue
+            try:
+                key = tuple(long(field) for field in fields[:4])
+            except ValueError:
+                continue
+            if fields[4] == "-":
+                records.pop(fields[5], None)
+            else:
+                records[fields[5]] = (key, fields[4])
+        return records
+
+    def __load(self):
+        try:
+            cache = open(self.path)
+        except IOError:
+            self.stamp = None
+            self.records = {}
+            return
+
+        try:
+            fcntl.flock(cache, fcntl.LOCK_SH)
+            st = os.fstat(cache.fileno())
+            stamp = (st.st_ino, st.st_size, st.st_mtime)
+            if stamp != self.stamp:
+                self.records = dict(self.__parse(cache).itervalues())
+                self.stamp = stamp
+        finally:
+            cache.close()
+
+    def __compact(self, cache):
+        cache.seek(0)
+        lines = []
+        for filename, (key, digest) in self.__parse(cache).iteritems():
+            try:
+                if self.key(filename) != key:
+                    continue
+            except OSError:
+                continue
+            lines.append("%d %d %d %d %s %s\n" % (key + (digest, filename)))
+
+        cache.seek(0)
+        cache.truncate()
+        cache.writelines(lines)
+        cache.flush()
+
+    def get(self, filename):
+        self.__load()
+        return self.records.get(self.key(filename))
+
+    def update(self, changes):
+        """Apply a mapping of file names to sha1 hashes, or to None to
+        forget the hash recorded for the name"""
+        try:
+            cache = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0644), "r+")
+        except OSError:
+            # The hashes are computed again when they are needed
+            return
+
+        try:
+            fcntl.flock(cache, fcntl.LOCK_EX)
+            lines = []
+            for filename, digest in changes.iteritems():
+                if digest:
+                    key = self.key(filename)
+                else:
+                    key, digest = (0, 0, 0, 0), "-"
+                lines.append("%d %d %d %d %s %s\n" % (key + (digest, filename)))
+
+            cache.seek(0, os.SEEK_END)
+            size = cache.tell()
+            if size:
+                # Terminate the partial line of an interrupted write
+                cache.seek(size - 1)
+                if cache.read(1) != "\n":
+                    lines.insert(0, "\n")
+                cache.seek(0, os.SEEK_END)
+            cache.writelines(lines)
+            cache.flush()
+
+            if cache.tell() > self.compact_size:
+                self.__compact(cache)
+        finally:
+            cache.close()
+
+    def prune(self):
+        """Forget the hashes of the files that changed or were removed"""
+        try:
+            cache = open(self.path, "r+")
+        except IOError:
+            return
+
+        try:
+            fcntl.flock(cache, fcntl.LOCK_EX)
+            self.__compact(cache)
+        finally:
+            cache.close()
+
+_digest_cache = None
+
+def digest_cache():
+    global _digest_cache
+    path = join_path(ctx.config.cache_root_dir(), ctx.const.digest_cache)
+    if _digest_cache is None or _digest_cache.path != path:
+        _digest_cache = DigestCache(path)
+    return _digest_cache
+
+def record_digest(filename, digest):
+    """Record the sha1 hash of a file."""
+    digest_cache().update({os.path.abspath(filename): digest})
+
+def recorded_digest(filename):
+    """Return the recorded sha1 hash of a file, or None if no hash is
+    recorded or the file has changed since."""
+    try:
+        return digest_cache().get(filename)
+    except OSError:
+        return None
+
+def file_digest(filename):
+    """Return the sha1 hash of a file, using the recorded one if any."""
+    digest = recorded_digest(filename)
+    if digest:
+        return digest
+
+    digest = sha1_file(filename)
+    cache_dirs = (ctx.config.archives_dir(), ctx.config.cached_packages_dir())
+    if os.path.dirname(os.path.abspath(filename)) in map(os.path.abspath, cache_dirs):
+        record_digest(filename, digest)
+    return digest
+
+def move_file(src, dst):
+    """Move a file with its recorded sha1 hash."""
+    digest = recorded_digest(src)
+    shutil.move(src, dst)
+    if digest:
+        digest_cache().update({os.path.abspath(src): None,
+                               os.path.abspath(dst): digest})
 
 def sha1_file(filename):
     """Calculate sha1 hash of file."""
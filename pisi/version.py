@@ -40,7 +40,7 @@ def __make_version_item(v):
     except ValueError:
         return int(v[:-1]), v[-1]
 
-def make_version(version):
+def __parse_version(version):
     ver, sep, suffix = version.partition("_")
     try:
         if sep:
@@ -48,21 +48,47 @@ def make_version(version):
             if "a" <= suffix <= "s":
                 for keyword, value in __keywords:
                     if suffix.startswith(keyword):
-                        return map(__make_version_item, ver.split(".")), value, \
-                                map(__make_version_item, suffix[len(keyword):].split("."))
+                        return tuple(map(__make_version_item, ver.split("."))), value, \
+                                tuple(map(__make_version_item, suffix[len(keyword):].split(".")))
                 else:
                     # Probably an invalid version string. Reset ver string
                     # to raise an exception in __make_version_item function.
                     ver = ""
             else:
-                return map(__make_version_item, ver.split(".")), 0, \
-                        map(__make_version_item, suffix.split("."))
+                return tuple(map(__make_version_item, ver.split("."))), 0, \
+                        tuple(map(__make_version_item, suffix.split(".")))
 
-        return map(__make_version_item, ver.split(".")), 0, [(0, None)]
+        return tuple(map(__make_version_item, ver.split("."))), 0, ((0, None),)
 
     except ValueError:
         raise InvalidVersionError(_("Invalid version string: '%s'") % version)
 
+# Keys of the version strings parsed so far. The same few thousand
+# versions are compared over and over while planning an operation.
+# The cache is emptied when it is full.
+CACHE_LIMIT = 20000
+__versions = {}
+
+def make_version(version):
+    """Returns the comparison key of a version string. Keys are tuples
+    and must not be modified, they are shared between the callers."""
+    try:
+        return __versions[version]
+    except KeyError:
+        key = __parse_version(version)
+        if len(__versions) >= CACHE_LIMIT:
+            __versions.clear()
+        __versions[version] = key
+        return key
+
+def version_key(version):
+    """Returns the comparison key of a version string, or None if it is
+    not valid, to be stored with the version"""
+    try:
+        return make_version(version)
+    except (InvalidVersionError, AttributeError):
+        return None
+
 class Version(object):
 
     __slots__ = ("__version", "__version_string")
@@ -53,3 +53,68 @@ class ArchiveTestCase(unittest.TestCase):
         sourceDir = '/tmp/pisi-root'
         zip.add_to_archive(sourceDir)
         zip.close()
+
+    def testOpenStoredMember(self):
+        import zipfile
+        zipPath = '/tmp/tests/stored.zip'
+        util.ensure_dirs('/tmp/tests')
+        data = 'install archive ' * 10000
+        zip = zipfile.ZipFile(zipPath, 'w')
+        zip.writestr(zipfile.ZipInfo('install.tar.xz'), data)
+        zip.close()
+
+        zip = archive.ArchiveZip(zipPath)
+        member = zip.open('install.tar.xz')
+        assert member.read(7) == 'install'
+        assert member.read() == data[7:]
+        assert member.read() == ''
+        member.close()
+        zip.close()
+
+    def testLZMAProxy(self):
+        import sys
+        import tarfile
+        from StringIO import StringIO
+
+        data = ''.join('line %d\n' % i for i in range(20000))
+        try:
+            import lzma
+            compressed = lzma.compress(data)
+            fake = None
+        except ImportError:
+            # The proxy only needs a decompressor that raises EOFError
+            # on data after the end of the stream
+            import zlib
+            import types
+
+            class Decompressor(object):
+                def __init__(self):
+                    self.zlibobj = zlib.decompressobj()
+
+                def decompress(self, raw):
+                    if self.zlibobj.unused_data:
+                        raise EOFError
+                    return self.zlibobj.decompress(raw)
+
+            fake = types.ModuleType('lzma')
+            fake.LZMADecompressor = Decompressor
+            sys.modules['lzma'] = fake
+            compressed = zlib.compress(data)
+
+        try:
+            proxy = archive._LZMAProxy(StringIO(compressed + 'trailing'), 'r')
+            proxy.blocksize = 1000
+            assert proxy.read(0) == ''
+            assert proxy.read(5) == data[:5]
+            assert proxy.read(20000) == data[5:20005]
+            proxy.seek(50000)
+            assert proxy.tell() == 50000
+            assert proxy.read(10) == data[50000:50010]
+            self.assertRaises(tarfile.StreamError, proxy.seek, 100)
+            assert proxy.read() == data[50010:]
+            assert proxy.read() == ''
+            proxy.seek(len(data) + 100)
+            assert proxy.tell() == len(data)
+        finally:
+            if fake:
+                del sys.modules['lzma']
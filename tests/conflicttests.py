@@ -20,6 +20,27 @@ class ConflictTestCase(unittest.TestCase):
         packages = ["ethtool", "zlib", "ctorrent"]
         assert pisi.conflict.calculate_conflicts(packages, packagedb)
 
+    def testConflictsIndex(self):
+        # In our sample repo1, spam conflicts with bar.
+        pisi.api.add_repo("repo1", "repos/repo1-bin/pisi-index.xml")
+        pisi.api.update_repo("repo1")
+
+        packagedb = pisi.db.packagedb.PackageDB()
+        index = packagedb.get_conflicts_index()
+        assert "spam" in [name for name, constraints in index["bar"]]
+
+        C, D, pairs = pisi.conflict.calculate_conflicts(["spam", "bar"], packagedb)
+        assert not C and not pairs
+        assert "spam" in D
+
+        pisi.api.install(["bar"])
+        C, D, pairs = pisi.conflict.calculate_conflicts(["spam"], packagedb)
+        assert C == set(["bar"])
+        assert pairs.keys() == ["spam"]
+
+        pisi.api.remove(["bar"])
+        pisi.api.remove_repo("repo1")
+
     def testConflictCheck(self):
         # In our sample repo1, spam conflicts with bar.
         # If this fails, it may affect database test case results.
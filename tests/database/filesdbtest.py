@@ -10,8 +10,12 @@
 # Please read the COPYING file.
 #
 
+import os
+import time
+
 import testcase
 import pisi
+import pisi.context as ctx
 
 class FilesDBTestCase(testcase.TestCase):
 
@@ -66,3 +70,93 @@ class FilesDBTestCase(testcase.TestCase):
         pkg, files = found[0]
         assert set(files) == set(['usr/bin/ethtool'])
         pisi.api.remove(["ethtool"])
+
+    def testSearchFileCase(self):
+        fileinfo = pisi.files.FileInfo()
+        fileinfo.path = "usr/share/Pisi/README"
+        files = pisi.files.Files()
+        files.list.append(fileinfo)
+
+        self.filesdb.add_files("pisi-doc", files)
+        self.filesdb.close()
+
+        found = self.filesdb.search_file("pisi/readme")
+        assert found == [("pisi-doc", ["usr/share/Pisi/README"])]
+        found = self.filesdb.search_file("PISI/ReadMe")
+        assert found == [("pisi-doc", ["usr/share/Pisi/README"])]
+        # the package name is not part of the searched path
+        assert not self.filesdb.search_file("pisi-doc")
+
+        self.filesdb.remove_files(files.list)
+        self.filesdb.close()
+        assert not self.filesdb.search_file("pisi/readme")
+
+    def testSearchPrefix(self):
+        assert not self.filesdb.search_prefix("usr/bin/eth")
+        pisi.api.install(["ethtool"])
+        found = self.filesdb.search_prefix("usr/bin/eth")
+        assert found == [("usr/bin/ethtool", "ethtool")]
+        pisi.api.remove(["ethtool"])
+        assert not self.filesdb.search_prefix("usr/bin/eth")
+
+    def __files(self, *paths):
+        files = pisi.files.Files()
+        for path in paths:
+            fileinfo = pisi.files.FileInfo()
+            fileinfo.path = path
+            files.list.append(fileinfo)
+        return files
+
+    def __index_file(self, suffix=""):
+        return os.path.join(ctx.config.info_dir(), ctx.const.files_index) + suffix
+
+    def testIncrementalRebuildChanged(self):
+        pisi.api.install(["ethtool"])
+        self.filesdb.rebuild()
+
+        installdb = pisi.db.installdb.InstallDB()
+        files_xml = os.path.join(installdb.package_path("ethtool"), ctx.const.files_xml)
+        original = open(files_xml).read()
+        try:
+            files = pisi.files.Files()
+            files.read(files_xml)
+            files.list.extend(self.__files("usr/share/ethtool-test").list)
+            files.write(files_xml)
+            future = time.time() + 10
+            os.utime(files_xml, (future, future))
+
+            self.filesdb.rebuild(incremental=True)
+            assert self.filesdb.get_file("usr/share/ethtool-test")[0] == "ethtool"
+            assert self.filesdb.has_file("usr/bin/ethtool")
+        finally:
+            open(files_xml, "w").write(original)
+            self.filesdb.rebuild()
+
+        assert not self.filesdb.has_file("usr/share/ethtool-test")
+        pisi.api.remove(["ethtool"])
+
+    def testIncrementalRebuildRemoved(self):
+        self.filesdb.rebuild()
+        # Records of a package that is not installed
+        self.filesdb.add_files("ghost", self.__files("usr/share/ghost"))
+        self.filesdb.close()
+        assert self.filesdb.has_file("usr/share/ghost")
+
+        self.filesdb.rebuild(incremental=True)
+        assert not self.filesdb.has_file("usr/share/ghost")
+
+    def testRebuildAfterJournal(self):
+        pisi.api.install(["ethtool"])
+        self.filesdb.rebuild()
+        self.filesdb.close()
+
+        # An index that is not up to date and the journal left behind
+        # by an interrupted operation
+        open(self.__index_file(), "wb").write(pisi.db.filesdb.INDEX_FORMAT)
+        open(self.__index_file(".journal"), "wb").write("+usr/share/ghost\0ghost\n")
+
+        self.filesdb.rebuild(incremental=True)
+        assert not os.path.exists(self.__index_file(".journal"))
+        assert self.filesdb.has_file("usr/bin/ethtool")
+        assert not self.filesdb.has_file("usr/share/ghost")
+        pisi.api.remove(["ethtool"])
@@ -51,6 +51,17 @@ class InstallDBTestCase(testcase.TestCase):
         assert release == "1"
         assert build == None
 
+    def testGetPackageInfo(self):
+        pisi.api.install(["ethtool"])
+        self.installdb = pisi.db.installdb.InstallDB()
+        info = self.installdb.get_package_info("ethtool")
+        assert info.version == "0.3"
+        assert info.summary["en"]
+        assert info.install_time is not None
+        pisi.api.remove(["ethtool"])
+        self.installdb = pisi.db.installdb.InstallDB()
+        self.assertRaises(Exception, self.installdb.get_package_info, "ethtool")
+
     def testGetFiles(self):
         pisi.api.install(["ethtool"])
         self.installdb = pisi.db.installdb.InstallDB()
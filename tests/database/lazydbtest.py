@@ -10,8 +10,11 @@
 # Please read the COPYING file.
 #
 
+import os
 import unittest
+import pisi.context as ctx
 import pisi.db.lazydb as lazydb
+import pisi.db.itembyrepo
 
 class TestDB(lazydb.LazyDB):
 
@@ -21,6 +24,15 @@ class TestDB(lazydb.LazyDB):
     def getTestField(self):
         return self.testfield
 
+class CachedTestDB(lazydb.LazyDB):
+
+    def __init__(self):
+        lazydb.LazyDB.__init__(self, cacheable=True)
+
+    def init(self):
+        self.items = pisi.db.itembyrepo.ItemByRepo({"repo": {"item": "value"}})
+        self.testfield = True
+
 class LazyDBTestCase(unittest.TestCase):
 
     def testDatabaseMethodForcingInit(self):
@@ -38,3 +50,55 @@ class LazyDBTestCase(unittest.TestCase):
         db = TestDB()
         db2 = TestDB()
         assert id(db) == id(db2)
+
+    def testCacheSaveAndLoad(self):
+        db = CachedTestDB()
+        assert db.testfield
+        db.cache_save()
+        db._delete()
+
+        db = CachedTestDB()
+        assert db.cache_load()
+        assert not db.__dict__.has_key("items")
+        assert db.items.dbobj["repo"]["item"] == "value"
+        assert db.testfield
+        db.cache_flush()
+        db._delete()
+
+    def testIncrementalCacheSave(self):
+        db = CachedTestDB()
+        assert db.testfield
+        db.cache_save()
+        db._delete()
+
+        db = CachedTestDB()
+        assert db.cache_load()
+        assert db.testfield
+        db.testfield = False
+        db.mark_dirty("testfield")
+        db.cache_save()
+        db._delete()
+
+        db = CachedTestDB()
+        assert db.cache_load()
+        assert not db.testfield
+        assert db.items.dbobj["repo"]["item"] == "value"
+        db.cache_flush()
+        db._delete()
+
+    def testTruncatedCache(self):
+        db = CachedTestDB()
+        assert db.testfield
+        db.cache_save()
+        db._delete()
+
+        cache_file = os.path.join(ctx.config.cache_root_dir(), "cachedtestdb.cache")
+        size = os.path.getsize(cache_file)
+        f = open(cache_file, "r+b")
+        f.truncate(size - 1)
+        f.close()
+
+        db = CachedTestDB()
+        assert not db.cache_load()
+        assert not os.path.exists(cache_file)
+        db._delete()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import unittest
+import pisi.db.searchindex as searchindex
+
+class SearchIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        index = searchindex.SearchIndex()
+        for name, summary, desc in (("bogofilter", "Fast Bayesian spam filter", "Mail filter"),
+                                    ("spamassassin", "Spam filter", "Perl mail filter"),
+                                    ("filtergen", "Packet filter generator", "Firewall tool")):
+            index.add(name, "name", name)
+            index.add(name, "summary", summary, "en")
+            index.add(name, "desc", desc, "en")
+        index.add("filtergen", "summary", u"Paket süzgeci üreteci", "tr")
+        self.tables = [index.table]
+        self.fields = {"name": True, "summary": True, "desc": True}
+
+    def testSearch(self):
+        found = searchindex.search(self.tables, ["spam", "filter"], "en", self.fields)
+        self.assertEqual(set(found), set(["bogofilter", "spamassassin"]))
+        self.assertEqual(searchindex.search(self.tables, ["mail", "firewall"], "en", self.fields), [])
+
+    def testFields(self):
+        found = searchindex.search(self.tables, ["filter"], "en", {"name": True})
+        self.assertEqual(set(found), set(["bogofilter", "filtergen"]))
+        found = searchindex.search(self.tables, ["perl"], "en", {"summary": True})
+        self.assertEqual(found, [])
+
+    def testLanguage(self):
+        self.assertEqual(searchindex.search(self.tables, [u"süzgeç"], "tr", self.fields), [])
+        self.assertEqual(searchindex.search(self.tables, [u"süzgec"], "tr", self.fields), ["filtergen"])
+        self.assertEqual(searchindex.search(self.tables, [u"süzgec"], "de", self.fields), [])
+
+    def testRanking(self):
+        # Name matches come first
+        found = searchindex.search(self.tables, ["spam"], "en", self.fields)
+        self.assertEqual(found, ["spamassassin", "bogofilter"])
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+
+import testcase
+import pisi
+import pisi.context as ctx
+import pisi.db.transaction as transaction
+
+class TransactionTestCase(testcase.TestCase):
+
+    def setUp(self):
+        testcase.TestCase.setUp(self)
+        self.installdb = pisi.db.installdb.InstallDB()
+        self.historydb = pisi.db.historydb.HistoryDB()
+        self.journal = os.path.join(ctx.config.info_dir(), ctx.const.transaction_journal)
+
+    def tearDown(self):
+        self.installdb.clear_needs_restart("*")
+
+    def __history_path(self):
+        return os.path.join(ctx.config.history_dir(), self.historydb.history.histfile)
+
+    def __package_after(self, name, version, release):
+        package = pisi.history.Package()
+        package.name = name
+        package.version = version
+        package.release = release
+        return package
+
+    def testBatchedHistory(self):
+        with transaction.Transaction():
+            self.historydb.create_history("install")
+            path = self.__history_path()
+            package = self.__package_after("ethtool", "6", "2")
+            self.historydb.add_and_update(pkgAfter=package, operation="install")
+            assert not os.path.exists(path)
+            assert os.path.exists(self.journal)
+
+        assert os.path.exists(path)
+        assert not os.path.exists(self.journal)
+        history = pisi.history.History(path)
+        assert [p.name for p in history.operation.packages] == ["ethtool"]
+
+    def testNestedTransaction(self):
+        with transaction.Transaction() as outer:
+            with transaction.Transaction() as inner:
+                assert inner is outer
+            assert transaction.active() is outer
+        assert transaction.active() is None
+
+    def testRecoverActive(self):
+        with transaction.Transaction():
+            self.historydb.create_history("install")
+            path = self.__history_path()
+            package = self.__package_after("ethtool", "6", "2")
+            self.historydb.add_and_update(pkgAfter=package, operation="install")
+            with transaction.Transaction():
+                # Reading the history again does not take the journal of
+                # the running operation for an interrupted one
+                pisi.db.historydb.HistoryDB().init()
+                transaction.recover()
+                assert os.path.exists(self.journal)
+            assert not os.path.exists(path)
+
+        assert not os.path.exists(self.journal)
+        history = pisi.history.History(path)
+        assert [p.name for p in history.operation.packages] == ["ethtool"]
+
+    def testMarkedPackages(self):
+        with transaction.Transaction():
+            self.installdb.mark_needs_restart("ethtool")
+            assert self.installdb.list_needs_restart() == ["ethtool"]
+            needs_restart = os.path.join(ctx.config.info_dir(), ctx.const.needs_restart)
+            assert not os.path.exists(needs_restart) or \
+                    not "ethtool" in open(needs_restart).read()
+        assert self.installdb.list_needs_restart() == ["ethtool"]
+
+    def testRecover(self):
+        self.historydb.create_history("install")
+        path = self.__history_path()
+        trans = transaction.Transaction()
+        transaction._active = trans
+        try:
+            package = self.__package_after("ethtool", "6", "2")
+            self.historydb.add_and_update(pkgAfter=package, operation="install")
+            self.installdb.mark_needs_restart("ctorrent")
+        finally:
+            # Leave the journal behind as an interrupted operation would
+            transaction._active = None
+            trans.journal.close()
+
+        assert not os.path.exists(path)
+        transaction.recover()
+        assert not os.path.exists(self.journal)
+        history = pisi.history.History(path)
+        assert [p.name for p in history.operation.packages] == ["ethtool"]
+        assert self.installdb.list_needs_restart() == ["ctorrent"]
+
+        # Replaying the journal again does not duplicate written records
+        open(self.journal, "w").write("H\t%s\tinstall\t2011-01-01\t00:00\t0\n"
+                                      "P\tinstall\t\tethtool\t\t\t6\t2\n"
+                                      % self.historydb.history.histfile)
+        transaction.recover()
+        history = pisi.history.History(path)
+        assert len(history.operation.packages) == 1
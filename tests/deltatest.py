@@ -0,0 +1,35 @@
+import unittest
+import pisi.files
+import pisi.operations.delta as delta
+
+class DeltaTestCase(unittest.TestCase):
+
+    def makeFiles(self, *entries):
+        files = pisi.files.Files()
+        for path, hash, mode in entries:
+            files.append(pisi.files.FileInfo(path = path, type = 'data',
+                                             mode = mode, hash = hash))
+        return files
+
+    def testFilesDiff(self):
+        old = self.makeFiles(('usr/bin/a', 'h1', '0755'),
+                             ('usr/lib/b', 'h2', '0644'),
+                             ('usr/share/c', 'h3', '0644'),
+                             ('usr/share/d', None, '0755'))
+        new = self.makeFiles(('usr/bin/a', 'h1', '0700'),
+                             ('usr/lib64/b', 'h2', '0644'),
+                             ('usr/share/c', 'h4', '0644'),
+                             ('usr/share/d', None, '0755'),
+                             ('usr/share/e', 'h5', '0644'))
+        diff = delta.FilesDiff(old, new)
+
+        paths = lambda files: sorted(f.path for f in files)
+        self.assertEqual(paths(diff.added), ['usr/lib64/b', 'usr/share/e'])
+        self.assertEqual(paths(diff.removed), ['usr/lib/b'])
+        self.assertEqual(paths(diff.deltas), ['usr/share/c', 'usr/share/d', 'usr/share/e'])
+        self.assertEqual([(o.path, n.path) for o, n in diff.relocations],
+                         [('usr/lib/b', 'usr/lib64/b')])
+        self.assertEqual(paths(diff.permission_changes), ['usr/bin/a'])
+
+        self.assertEqual(paths(delta.find_delta(old, new)), paths(diff.deltas))
+        self.assertEqual(delta.find_relocations(old, new), diff.relocations)
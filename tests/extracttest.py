@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import unittest
+
+import pisi
+import pisi.graph
+from pisi.operations import extract
+
+class _Relation(object):
+
+    def __init__(self, package):
+        self.package = package
+
+class _Path(object):
+
+    def __init__(self, path):
+        self.path = path
+
+class _Info(object):
+
+    def __init__(self, name, replaces, conflicts):
+        self.name = name
+        self.replaces = [_Relation(p) for p in replaces]
+        self.conflicts = [_Relation(p) for p in conflicts]
+
+class _Files(object):
+
+    def __init__(self, paths):
+        self.list = [_Path(p) for p in paths]
+
+class _Install(object):
+    """Records the steps of installing a package"""
+
+    def __init__(self, name, paths=(), replaces=(), conflicts=(), fail=False,
+                 fail_check=False):
+        self.pkginfo = _Info(name, replaces, conflicts)
+        self.files = _Files(paths or ["usr/share/%s" % name])
+        self.fail = fail
+        self.fail_check = fail_check
+        self.steps = []
+
+    def __getattr__(self, step):
+        if not step in ("install", "check_replaces", "run_old_remove_scripts",
+                        "prepare_extract", "store_pisi_files", "finish_extract",
+                        "configure", "notify_installed"):
+            raise AttributeError, step
+        return lambda *args: self.steps.append(step)
+
+    def check(self, ask_reinstall):
+        self.steps.append("check")
+        if self.fail_check:
+            raise pisi.Error("check failed")
+
+    def unpack(self):
+        self.steps.append("unpack")
+        if self.fail:
+            raise pisi.Error("unpack failed")
+
+class ExtractTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = pisi.graph.Digraph()
+        for name in ("a", "b", "c", "d", "e"):
+            self.graph.add_vertex(name)
+        self.graph.add_edge("b", "a")
+
+    def testWave(self):
+        wave = extract._Wave(3)
+        assert wave.add(_Install("a"), self.graph)
+        # Depends on a package of the wave
+        assert not wave.add(_Install("b"), self.graph)
+        # Has common files with a package of the wave
+        assert not wave.add(_Install("c", ["usr/share/a"]), self.graph)
+        # Conflicts with or replaces a package of the wave
+        assert not wave.add(_Install("c", conflicts=["a"]), self.graph)
+        assert not wave.add(_Install("c", replaces=["a"]), self.graph)
+        # Not in the graph, its dependencies are not known
+        assert not wave.add(_Install("f"), self.graph)
+        assert wave.add(_Install("c"), self.graph)
+        assert wave.add(_Install("d"), self.graph)
+        # The wave is full
+        assert not wave.add(_Install("e"), self.graph)
+        self.assertEqual([i.pkginfo.name for i in wave.installs], ["a", "c", "d"])
+
+    def testInstallWaveError(self):
+        installs = [_Install("a"), _Install("c", fail=True), _Install("d")]
+        self.assertRaises(pisi.Error, extract.install_wave, installs, False, 2)
+
+        # The packages that were extracted are registered
+        prepared = ["check", "check_replaces", "run_old_remove_scripts",
+                    "prepare_extract", "unpack"]
+        registered = prepared + ["store_pisi_files", "finish_extract", "configure",
+                                 "notify_installed"]
+        self.assertEqual(installs[0].steps, registered)
+        self.assertEqual(installs[2].steps, registered)
+        self.assertEqual(installs[1].steps, prepared)
+
+    def testInstallWaveCheckError(self):
+        installs = [_Install("a", replaces=["r"]), _Install("c", fail_check=True),
+                    _Install("d")]
+        self.assertRaises(pisi.Error, extract.install_wave, installs, False, 2)
+
+        # The replaced packages of the first package are not removed and
+        # the remove scripts of its old version are not run
+        self.assertEqual(installs[0].steps, ["check"])
+        self.assertEqual(installs[1].steps, ["check"])
+        self.assertEqual(installs[2].steps, [])
@@ -17,3 +17,37 @@ class FilesTestCase(unittest.TestCase):
         self.files = pisi.files.Files()
         self.files.read('repos/pardus-2007/system/base/curl/pspec.xml')
 
+
+    def testParse(self):
+        files = pisi.files.Files()
+        files.parse("""<Files>
+    <File>
+        <Path>usr/bin/acpi</Path>
+        <Type>executable</Type>
+        <Size>30</Size>
+        <Uid>0</Uid>
+        <Gid>0</Gid>
+        <Mode>0755</Mode>
+        <SHA1Sum>ab5a0d4b3d0a3c2e8e8b6b8bd1a9b2a5c4e0f0d1</SHA1Sum>
+    </File>
+    <File>
+        <Path>etc/acpi</Path>
+        <Type>config</Type>
+        <Permanent>true</Permanent>
+    </File>
+</Files>""")
+        self.assertEqual(len(files.list), 2)
+        acpi, conf = files.list
+        self.assertEqual(acpi.path, "usr/bin/acpi")
+        self.assertEqual(acpi.size, 30)
+        self.assertEqual(acpi.mode, "0755")
+        self.assertEqual(acpi.hash, "ab5a0d4b3d0a3c2e8e8b6b8bd1a9b2a5c4e0f0d1")
+        self.assertEqual(conf.type, "config")
+        self.assertEqual(conf.permanent, "true")
+        self.assertEqual(conf.size, None)
+        self.assertRaises(AttributeError, setattr, acpi, "unknown", 1)
+
+    def testParseErrors(self):
+        self.assertRaises(pisi.files.Error, pisi.files.Files().parse,
+                          "<Files><File><Path>usr/bin/acpi</Path></File></Files>")
+        self.assertRaises(pisi.files.Error, pisi.files.Files().parse, "<Files><File>")
@@ -1,4 +1,7 @@
+import os
 import unittest
+import pisi.file
+import pisi.context as ctx
 from pisi.specfile import SpecFile
 from pisi import uri
 from pisi.file import File
@@ -31,3 +34,28 @@ class FileTestCase(unittest.TestCase):
         f = File('http://www.gnu.org/licenses/gpl2.txt', File.read)
         r = f.readlines()
         assert (len(r) > 0)
+
+    def testDecompressVerified(self):
+        import bz2
+        import hashlib
+        data = "<PISI>\n" + "<Package/>\n" * 10000 + "</PISI>\n"
+        compressed = bz2.compress(data)
+        open("/tmp/pisi-index.xml.bz2", "w").write(compressed)
+
+        sha1sum = hashlib.sha1(compressed).hexdigest()
+        localfile = File.decompress("/tmp/pisi-index.xml.bz2",
+                                    File.COMPRESSION_TYPE_AUTO, sha1sum)
+        self.assertEqual(localfile, "/tmp/pisi-index.xml")
+        self.assertEqual(open(localfile).read(), data)
+
+        self.assertRaises(pisi.file.Error, File.decompress,
+                          "/tmp/pisi-index.xml.bz2", File.COMPRESSION_TYPE_BZ2, "0" * 40)
+
+    def testDecompressTruncated(self):
+        import bz2
+        data = "<PISI>\n" + "<Package/>\n" * 10000 + "</PISI>\n"
+        open("/tmp/pisi-truncated.xml.bz2", "w").write(bz2.compress(data)[:-10])
+        self.assertRaises(pisi.file.Error, File.decompress,
+                          "/tmp/pisi-truncated.xml.bz2", File.COMPRESSION_TYPE_BZ2)
+        assert not os.path.exists("/tmp/pisi-truncated.xml")
+        assert not os.path.exists("/tmp/pisi-truncated.xml" + ctx.const.temporary_suffix)
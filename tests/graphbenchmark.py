@@ -0,0 +1,47 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+# Measures the time spent sorting a chain of vertices with random
+# shortcuts, deeper than the recursion limit, in topological order and
+# in levels.
+#
+# Usage: python graphbenchmark.py [number of vertices]
+
+import sys
+import time
+import random
+
+import pisi.graph
+
+def main(size):
+    g = pisi.graph.Digraph()
+    random.seed(0)
+    for u in xrange(size - 1):
+        g.add_edge(u, u + 1)
+        g.add_edge(u, random.randint(u + 1, size - 1))
+
+    start = time.time()
+    g.topological_sort()
+    order = time.time() - start
+
+    start = time.time()
+    g.levels()
+    levels = time.time() - start
+
+    print "%d vertices" % size
+    print "%-20s %10s" % ("method", "time (s)")
+    print "%-20s %10.2f" % ("topological_sort", order)
+    print "%-20s %10.2f" % ("levels", levels)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
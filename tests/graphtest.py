@@ -1,5 +1,6 @@
 import unittest
 import os
+import random
 import pisi
 from pisi import graph
 
@@ -35,3 +36,23 @@ class GraphTestCase(unittest.TestCase):
         order = self.g1.topological_sort()
         assert order[0] == 0
         assert order[-1] == 4
+
+    def testLevels(self):
+        assert self.g1.levels() == [[0], [2, 3], [4]] or \
+               self.g1.levels() == [[0], [3, 2], [4]]
+        self.assertRaises(graph.CycleException, self.g0.levels)
+
+    def testLargeGraph(self):
+        # A chain deeper than the recursion limit with random shortcuts
+        g = pisi.graph.Digraph()
+        size = 20000
+        random.seed(0)
+        for u in range(size - 1):
+            g.add_edge(u, u + 1)
+            g.add_edge(u, random.randint(u + 1, size - 1))
+
+        assert g.topological_sort() == range(size)
+        assert g.levels() == [[u] for u in range(size)]
+
+        g.add_edge(size - 1, 0)
+        assert not g.cycle_free()
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+# Compares the peak memory usage and the time spent building the PackageDB
+# tables of a synthetic repository index with the streaming parser and
+# with the former piksemel document walk. Each parser runs in a separate
+# process so that their peak RSS can be measured independently.
+#
+# Usage: python indexbenchmark.py [number of packages]
+
+import os
+import sys
+import gzip
+import time
+import shutil
+import resource
+import tempfile
+import subprocess
+
+import piksemel
+
+import pisi.db.packagedb
+
+PACKAGE = """  <Package>
+    <Name>package%(index)d</Name>
+    <Summary xml:lang="en">Synthetic package %(index)d</Summary>
+    <Description xml:lang="en">Synthetic package %(index)d used to benchmark the repository index parser.</Description>
+    <IsA>app:console</IsA>
+    <PartOf>system.base</PartOf>
+    <License>GPLv2</License>
+    <RuntimeDependencies>
+%(dependencies)s
+    </RuntimeDependencies>
+%(replaces)s
+    <History>
+      <Update release="%(release)d">
+        <Date>2011-01-01</Date>
+        <Version>1.%(index)d</Version>
+        <Comment>Synthetic update</Comment>
+        <Name>Packager</Name>
+        <Email>packager@example.org</Email>
+      </Update>
+    </History>
+    <Build>1</Build>
+    <Distribution>Pardus</Distribution>
+    <DistributionRelease>2011</DistributionRelease>
+    <Architecture>i686</Architecture>
+    <InstalledSize>123456</InstalledSize>
+    <PackageSize>65432</PackageSize>
+    <PackageHash>da39a3ee5e6b4b0d3255bfef95601890afd80709</PackageHash>
+    <PackageURI>p/package%(index)d-1.%(index)d-%(release)d-1.pisi</PackageURI>
+    <PackageFormat>1.2</PackageFormat>
+  </Package>
+"""
+
+def generate_index(path, count):
+    f = open(path, "w")
+    f.write("<PISI>\n")
+    f.write("  <Distribution>\n    <SourceName>Pardus</SourceName>\n    <Obsoletes>\n")
+    for index in range(0, count, 100):
+        f.write("      <Package>obsolete%d</Package>\n" % index)
+    f.write("    </Obsoletes>\n  </Distribution>\n")
+    for index in range(count):
+        dependencies = "\n".join('      <Dependency versionFrom="1.%d">package%d</Dependency>' % (dep, dep)
+                                    for dep in range(max(0, index - 5), index))
+        replaces = ""
+        if index % 50 == 0:
+            replaces = "    <Replaces>\n      <Package>old%d</Package>\n    </Replaces>" % index
+        f.write(PACKAGE % {"index": index, "release": index % 10 + 1,
+                           "dependencies": dependencies, "replaces": replaces})
+    f.write("</PISI>\n")
+    f.close()
+
+def parse_dom(index_path):
+    """The former PackageDB.init tables built from a piksemel document"""
+    doc = piksemel.parse(index_path)
+
+    packages = dict(map(lambda x: (x.getTagData("Name"), gzip.zlib.compress(x.toString())), doc.tags("Package")))
+
+    revdeps = {}
+    for node in doc.tags("Package"):
+        name = node.getTagData('Name')
+        deps = node.getTag('RuntimeDependencies')
+        if deps:
+            for dep in deps.tags("Dependency"):
+                revdeps.setdefault(dep.firstChild().data(), set()).add((name, dep.toString()))
+
+    distribution = doc.getTag("Distribution")
+    obsoletes = distribution and distribution.getTag("Obsoletes")
+    obsoletes = obsoletes and map(lambda x: x.firstChild().data(), obsoletes.tags("Package")) or []
+
+    replaces = [x.getTagData("Name") for x in doc.tags("Package") if x.getTagData("Replaces")]
+
+    return packages, revdeps, obsoletes, replaces
+
+parsers = {"dom": parse_dom,
+           "stream": pisi.db.packagedb.parse_index}
+
+def run_parser(parser, index_path):
+    start = time.time()
+    packages, revdeps, obsoletes, replaces = parsers[parser](index_path)
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print "%s %f %d %d %d %d %d" % (parser, elapsed, peak, len(packages),
+                                    len(revdeps), len(obsoletes), len(replaces))
+
+def main(count):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        index_path = os.path.join(tmpdir, "pisi-index.xml")
+        generate_index(index_path, count)
+        print "Index of %d packages, %.1f MB" % (count, os.path.getsize(index_path) / 1048576.0)
+        print "%-8s %10s %14s %10s %10s %10s %10s" % ("parser", "time (s)", "peak RSS (kB)",
+                                                     "packages", "revdeps", "obsoletes", "replaces")
+        for parser in sorted(parsers):
+            output = subprocess.Popen([sys.executable, __file__, "--run", parser, index_path],
+                                      stdout=subprocess.PIPE).communicate()[0]
+            name, elapsed, peak, packages, revdeps, obsoletes, replaces = output.split()
+            print "%-8s %10.2f %14s %10s %10s %10s %10s" % (name, float(elapsed), peak,
+                                                           packages, revdeps, obsoletes, replaces)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--run":
+        run_parser(sys.argv[2], sys.argv[3])
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
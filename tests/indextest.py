@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import os
+import time
+import zipfile
+import unittest
+
+import pisi
+import pisi.api
+import pisi.index
+import pisi.util as util
+
+class IndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = "/tmp/pisi-index-test"
+        self.output = "/tmp/pisi-index-test.xml"
+        self.log = "/tmp/pisi-index-test.log"
+        util.clean_dir(self.repo)
+        util.ensure_dirs(self.repo)
+
+        metadata = open("metadata.xml").read()
+        self.packages = {}
+        self.deltas = {}
+        for name in ("popt-libs", "popt-devel"):
+            path = os.path.join(self.repo, "%s-1.7-3-p11-i686.pisi" % name)
+            package = zipfile.ZipFile(path, "w")
+            package.writestr("metadata.xml", metadata.replace("popt-libs", name))
+            package.close()
+            self.packages[name] = path
+
+            path = os.path.join(self.repo, "%s-2-3-p11-i686.delta.pisi" % name)
+            open(path, "w").write("delta of %s" % name)
+            self.deltas[name] = path
+
+        # Files older than the index
+        past = time.time() - 100
+        for path in self.packages.values() + self.deltas.values():
+            os.utime(path, (past, past))
+
+        # Hashed files are logged, also by the worker processes
+        self.sha1_file = util.sha1_file
+        def sha1_file(path):
+            open(self.log, "a").write("%s\n" % path)
+            return self.sha1_file(path)
+        util.sha1_file = sha1_file
+
+    def tearDown(self):
+        util.sha1_file = self.sha1_file
+        util.clean_dir(self.repo)
+        for path in (self.output, self.output + ".sha1sum", self.log):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def __index(self, incremental):
+        if os.path.exists(self.log):
+            os.unlink(self.log)
+        pisi.api.index([self.repo], self.output, skip_sources=True,
+                       skip_signing=True, incremental=incremental)
+        index = pisi.index.Index()
+        index.read(self.output)
+        hashed = []
+        if os.path.exists(self.log):
+            # Only the files of the repository, not the written index
+            hashed = sorted(path for path in open(self.log).read().split()
+                                if path.startswith(self.repo + "/"))
+        return dict((p.name, p) for p in index.packages), hashed
+
+    def testIncrementalIndex(self):
+        previous, hashed = self.__index(False)
+        self.assertEqual(hashed, sorted(self.packages.values() + self.deltas.values()))
+
+        # A package is touched and a delta of an unchanged package replaced
+        future = time.time() + 100
+        os.utime(self.packages["popt-devel"], (future, future))
+        open(self.deltas["popt-libs"], "w").write("new delta of popt-libs")
+        os.utime(self.deltas["popt-libs"], (future, future))
+
+        packages, hashed = self.__index(True)
+        self.assertEqual(hashed, sorted([self.packages["popt-devel"], self.deltas["popt-libs"]]))
+
+        # The reused entries are the previous ones
+        for name in ("popt-libs", "popt-devel"):
+            for attr in ("packageURI", "packageSize", "packageHash", "version", "release"):
+                self.assertEqual(getattr(packages[name], attr), getattr(previous[name], attr))
+
+        delta = packages["popt-devel"].deltaPackages[0]
+        previous_delta = previous["popt-devel"].deltaPackages[0]
+        self.assertEqual((delta.packageURI, delta.packageHash),
+                         (previous_delta.packageURI, previous_delta.packageHash))
+
+        # The changed delta of the unchanged package is hashed again
+        delta = packages["popt-libs"].deltaPackages[0]
+        self.assertEqual(delta.packageHash, self.sha1_file(self.deltas["popt-libs"]))
+        self.assertNotEqual(delta.packageHash,
+                            previous["popt-libs"].deltaPackages[0].packageHash)
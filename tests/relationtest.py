@@ -50,3 +50,13 @@ class RelationTestCase(unittest.TestCase):
 
         pisi.api.remove(["ethtool"])
 
+    def testSatisfiesConstraints(self):
+        satisfies = pisi.relation.satisfies_constraints
+        assert satisfies((), "0.3", "1")
+        assert satisfies((("version", "0.3"),), "0.3", "1")
+        assert not satisfies((("version", "0.4"),), "0.3", "1")
+        assert satisfies((("versionFrom", "0.2"), ("versionTo", "1.0")), "0.3", "1")
+        assert not satisfies((("versionFrom", "0.10"),), "0.3", "1")
+        assert not satisfies((("release", "2"),), "0.3", "1")
+        assert satisfies((("releaseFrom", "1"), ("releaseTo", "3")), "0.3", "2")
+        assert not satisfies((("releaseTo", "7"),), "0.3", "10")
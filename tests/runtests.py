@@ -26,23 +26,29 @@ from database.componentdbtest import ComponentDBTestCase
 from database.filesdbtest import FilesDBTestCase
 from database.lazydbtest import LazyDBTestCase
 from database.itembyrepotest import ItemByRepoTestCase
+from database.searchindextest import SearchIndexTestCase
+from database.transactiontest import TransactionTestCase
 
 from archivetests import ArchiveTestCase
 from configfiletest import ConfigFileTestCase
 from conflicttests import ConflictTestCase
 from constanttest import ConstantTestCase
+from deltatest import DeltaTestCase
 from dependencytest import DependencyTestCase
-from fetchtest import FetchTestCase
+from extracttest import ExtractTestCase
+from fetchtest import FetchTestCase, FetchSessionTestCase
 from filetest import FileTestCase
 from filestest import FilesTestCase
 from graphtest import GraphTestCase
 from historytest import HistoryTestCase
+from indextest import IndexTestCase
 from metadatatest import MetadataTestCase
 from mirrorstest import MirrorsTestCase
 from packagetest import PackageTestCase
 from relationtest import RelationTestCase
 from replacetest import ReplaceTestCase
 from shelltest import ShellTestCase
+from solvertest import SolverTestCase
 from specfiletests import SpecFileTestCase
 from srcarchivetest import SourceArchiveTestCase
 from uritest import UriTestCase
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+import unittest
+import pisi
+import pisi.solver
+
+class SolverTestCase(unittest.TestCase):
+
+    def testPlanInstall(self):
+        G_f, order = pisi.solver.Solver().plan_install(["curl"])
+        assert order[-1] == "curl"
+        for dep in ("libidn", "zlib", "openssl"):
+            assert G_f.has_edge("curl", dep)
+            assert order.index(dep) < order.index("curl")
+
+    def testPlanInstallMissing(self):
+        self.assertRaises(Exception, pisi.solver.Solver().plan_install, ["hedehodo"])
+
+    def testPlanRemove(self):
+        pisi.api.install(["ctorrent"])
+        G_f, order = pisi.solver.Solver().plan_remove(["openssl"])
+        assert "ctorrent" in order
+        assert order.index("ctorrent") < order.index("openssl")
+        pisi.api.remove(["ctorrent", "openssl"])
+
+    def testPackageGraph(self):
+        solver = pisi.solver.Solver()
+        G_f = solver.package_graph(["openssl"], reverse=True)
+        assert G_f.has_edge("curl", "openssl")
+        assert G_f.has_edge("ctorrent", "openssl")
+        assert G_f.vertex_data("openssl") == solver.packagedb.get_version("openssl", None)[:2]
@@ -61,3 +61,52 @@ class UtilTestCase(unittest.TestCase):
         copy_file('/etc/pisi/pisi.conf', '/tmp/pisi-test1')
         copy_file('/etc/pisi/sandbox.conf', '/tmp/pisi-test2')
         copy_file_stat('/etc/pisi/pisi.conf', '/tmp/pisi-test1')
+
+    def testLRUCache(self):
+        cache = LRUCache(10)
+        cache.put("a", 1, 4)
+        cache.put("b", 2, 4)
+        assert cache.get("a") == 1
+        cache.put("c", 3, 4)
+        # b is the least recently used one
+        assert cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3
+        assert (cache.hits, cache.misses, cache.size) == (3, 1, 8)
+        cache.put("d", 4, 20)
+        assert cache.get("d") is None and len(cache) == 2
+
+    def testRecordedDigest(self):
+        path = '/tmp/pisi-test-digest'
+        open(path, 'w').write('pisi')
+        digest = sha1_file(path)
+        assert recorded_digest(path) is None
+        record_digest(path, digest)
+        assert recorded_digest(path) == digest
+        assert check_file_hash(path, digest)
+        move_file(path, path + '-moved')
+        assert recorded_digest(path + '-moved') == digest
+        # Changing the file invalidates the record
+        open(path + '-moved', 'a').write('!')
+        assert recorded_digest(path + '-moved') is None
+        os.unlink(path + '-moved')
+
+    def testPruneDigestCache(self):
+        cache_path = '/tmp/pisi-test-digest.cache'
+        if os.path.exists(cache_path):
+            os.unlink(cache_path)
+        cache = DigestCache(cache_path)
+        paths = ['/tmp/pisi-test-digest-%d' % i for i in range(3)]
+        for path in paths:
+            open(path, 'w').write(path)
+            cache.update({path: sha1_file(path)})
+        cache.update({paths[0]: None})
+        os.unlink(paths[1])
+        assert len(open(cache_path).readlines()) == 4
+
+        cache.prune()
+        assert len(open(cache_path).readlines()) == 1
+        assert cache.get(paths[2]) == sha1_file(paths[2])
+        assert cache.get(paths[0]) is None
+        os.unlink(paths[0])
+        os.unlink(paths[2])
+        os.unlink(cache_path)
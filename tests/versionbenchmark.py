@@ -0,0 +1,48 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2011, TUBITAK/UEKAE
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# Please read the COPYING file.
+#
+
+# Measures the time spent comparing version strings through the cached
+# keys of make_version and through Version objects compared to strings.
+#
+# Usage: python versionbenchmark.py [number of comparisons]
+
+import sys
+import time
+
+import pisi.version
+from pisi.version import Version
+
+def main(comparisons):
+    versions = ["%d.%d.%d" % (i % 7, i % 13, i) for i in xrange(1000)]
+    versions.extend("%s_rc%d" % (v, i % 3) for i, v in enumerate(versions[:500]))
+    objects = map(Version, versions)
+    count = len(versions)
+
+    start = time.time()
+    for i in xrange(comparisons):
+        pisi.version.make_version(versions[i % count]) < \
+                pisi.version.make_version(versions[(i * 7) % count])
+    keys = time.time() - start
+
+    start = time.time()
+    for i in xrange(comparisons):
+        objects[i % count] < versions[(i * 7) % count]
+    strings = time.time() - start
+
+    print "%d comparisons" % comparisons
+    print "%-20s %10s" % ("method", "time (s)")
+    print "%-20s %10.2f" % ("make_version keys", keys)
+    print "%-20s %10.2f" % ("Version to string", strings)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -10,6 +10,7 @@
 
 import unittest
 
+import pisi.version
 from pisi.version import Version
 
 class VersionTestCase(unittest.TestCase):
@@ -73,3 +74,27 @@ class VersionTestCase(unittest.TestCase):
         v2 = Version('1.9.1')
         self.assert_( not v1 > v2 )
         self.assert_( not v1 >= v2 )
+
+    def testMakeVersionCache(self):
+        key = pisi.version.make_version("2.23_rc1")
+        self.assert_(key is pisi.version.make_version("2.23_rc1"))
+        self.assertEqual(pisi.version.version_key("2.23_rc1"), key)
+        self.assertEqual(pisi.version.version_key("2.x"), None)
+        self.assertRaises(pisi.version.InvalidVersionError,
+                          pisi.version.make_version, "2.x")
+
+        # The cache is bounded, keys stay correct after it is emptied
+        for i in xrange(pisi.version.CACHE_LIMIT + 10):
+            pisi.version.make_version("1.%d" % i)
+        self.assert_(pisi.version.make_version("1.10") > pisi.version.make_version("1.9"))
+
+    def testComparisonOfKeys(self):
+        versions = ["%d.%d.%d" % (i % 7, i % 13, i) for i in xrange(1000)]
+        versions.extend("%s_rc%d" % (v, i % 3) for i, v in enumerate(versions[:500]))
+        count = len(versions)
+
+        for i in xrange(count):
+            a, b = versions[i], versions[(i * 7) % count]
+            expected = Version(a) < Version(b)
+            self.assertEqual(pisi.version.make_version(a) < pisi.version.make_version(b), expected)
+            self.assertEqual(Version(a) < b, expected)